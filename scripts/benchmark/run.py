@@ -0,0 +1,227 @@
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+# Windows...
+sys.path.append(".")
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+# Canvas chains: (output suffix, canvas configuration)
+CANVASES = {
+    "reportlab": (".pdf", {"canvas": "rl"}),
+    "svgwrite": (".svg", {"canvas": "svgwrite"}),
+    "svg2pdf(r)": (".pdf", {}),  # The default pdf chain: svg -> svgwrite -> svg2pdf(r)
+    "svg2pdf(rl)": (".pdf", {"canvas_formats": {"svg2pdf": "svg2pdf(rl)"}}),
+    "svg2pdf(re)": (".pdf", {"canvas_formats": {"svg2pdf": "svg2pdf(re)"}}),
+}
+LAYOUTS = ["greedy", "maxrects", "rectpack", "rectpack_best", "all"]
+SIZES = ["Tiny", "Small", "Medium", "Large", "Huge"]
+
+
+def make_cases():
+    """The benchmark cases: token counts, big maps, canvas chains and layout modes."""
+    cases = [
+        {"name": "tokens-small", "tokens": 12},
+        {"name": "tokens-large", "tokens": 200},
+        {"name": "map-big", "tokens": 12, "map": (6000, 4000)},
+        {"name": "map-grid", "tokens": 0, "map": (8000, 8000), "grid": (200, 200)},
+    ]
+    cases += [{"name": f"canvas-{canvas}", "tokens": 24, "canvas": canvas, "map": (1500, 1000)}
+              for canvas in CANVASES]
+    cases += [{"name": f"layout-{layout}", "tokens": 60, "layout": layout}
+              for layout in LAYOUTS]
+    return cases
+
+
+def make_images(folder: Path, count: int = 6, size: int = 512):
+    """Writes synthetic token images: shapes on a plain background, with some noise."""
+    rng = np.random.RandomState(0)
+    paths = []
+    for i in range(count):
+        image = Image.new("RGB", (size, size), tuple(rng.randint(150, 256, 3).tolist()))
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x, y = rng.randint(0, size, 2)
+            r = rng.randint(size // 16, size // 4)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randint(0, 256, 3).tolist()))
+        noise = rng.randint(-12, 13, (size, size, 3))
+        array = np.clip(np.asarray(image).astype(int) + noise, 0, 255).astype(np.uint8)
+        path = folder / f"token{i}.png"
+        Image.fromarray(array).save(path)
+        paths.append(path)
+    return paths
+
+
+def make_map(folder: Path, size):
+    """Writes a synthetic map image: a noisy gradient."""
+    width, height = size
+    path = folder / f"map{width}x{height}.png"
+    if not path.exists():
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        rng = np.random.RandomState(1)
+        array = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+        array += rng.randint(-20, 21, (height, width, 1))
+        Image.fromarray(np.clip(array, 0, 255).astype(np.uint8)).save(path)
+    return path
+
+
+def make_config(case, folder: Path):
+    """The tokenpdf configuration of a case."""
+    suffix, canvas_config = CANVASES[case.get("canvas", "reportlab")]
+    images = make_images(folder)
+    count = case["tokens"]
+    monsters = {}
+    for i in range(len(images)):
+        # Spread the tokens over the monsters, with mixed sizes and token types
+        n = count // len(images) + (i < count % len(images))
+        if not n:
+            continue
+        monsters[f"monster{i}"] = {
+            "size": SIZES[i % len(SIZES)],
+            "image_url": str(images[i]),
+            "tokens": [{"type": "circle", "count": n - n // 3},
+                       {"type": "standing", "count": n // 3}],
+        }
+    config = {
+        "output": str(folder / f"{case['name']}{suffix}"),
+        "verbose": False,
+        "seed": 1,
+        "page_size": "A4",
+        "layout": case.get("layout", "rectpack_best"),
+        "derived_cache": case.get("derived_cache", False),
+        "layout_cache": case.get("layout_cache", False),
+        "monsters": monsters,
+        **canvas_config,
+    }
+    if "map" in case:
+        config["maps"] = {"map": {"image_url": str(make_map(folder, case["map"])),
+                                  "dpi": 100, "add_grid": True}}
+        if "grid" in case:
+            config["maps"]["map"]["grid"] = list(case["grid"])
+    return config
+
+
+def peak_rss() -> int | None:
+    """The peak resident set size of this process, in bytes (None where unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(case, folder: Path):
+    """Runs a case in this process, and returns its measurements."""
+    from tokenpdf.pipeline.workflow import WorkflowManager
+    config = make_config(case, folder)
+    config_path = folder / f"{case['name']}.json"
+    config_path.write_text(json.dumps(config))
+    start = time.perf_counter()
+    workflow = WorkflowManager(str(config_path))
+    workflow.run()
+    total = time.perf_counter() - start
+    output = Path(workflow.config["output_file"])
+    return {
+        "stages": workflow.timings[0],
+        "total": total,
+        "peak_rss": peak_rss(),
+        "output_bytes": output.stat().st_size if output.exists() else None,
+    }
+
+
+def run_case_process(case, folder: Path, timeout: float):
+    """Runs a case in a fresh process, so its peak memory is measured alone."""
+    cmd = [sys.executable, __file__, "--case", json.dumps(case), "--folder", str(folder)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": f"Timed out after {timeout}s"}
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"Exit code {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str | None:
+    """The current commit, if running from a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """Run the benchmark cases, and write their stage times, peak memory and output sizes as JSON."""
+    parser = make_parser()
+    args = parser.parse_args()
+    folder = Path(args.folder) if args.folder else Path(tempfile.mkdtemp(prefix="tokenpdf_bench_"))
+    folder.mkdir(parents=True, exist_ok=True)
+
+    if args.case:
+        # A single case, in a child process: the result is the last line of the output
+        print(json.dumps(run_case(json.loads(args.case), folder)))
+        return
+
+    cases = [case for case in make_cases()
+             if not args.only or any(name in case["name"] for name in args.only)]
+    results = []
+    for case in cases:
+        for repeat in range(args.repeat):
+            logger.info(f"Running {case['name']} ({repeat + 1}/{args.repeat})...")
+            result = run_case_process(dict(case, derived_cache=args.derived_cache, layout_cache=args.layout_cache),
+                                      folder, args.timeout)
+            if "error" in result:
+                logger.warning(f"{case['name']} failed: {result['error']}")
+            else:
+                stages = ", ".join(f"{k} {v:.2f}s" for k, v in result["stages"].items())
+                logger.info(f"{case['name']}: {result['total']:.2f}s ({stages}), "
+                            f"peak RSS {(result['peak_rss'] or 0) / 2**20:.0f}MB, "
+                            f"output {(result['output_bytes'] or 0) / 2**20:.1f}MB")
+            results.append({**case, "repeat": repeat, **result})
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    logger.info(f"Results written to {args.output}")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the tokenpdf pipeline end to end, on synthetic images")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="The JSON results file.")
+    parser.add_argument("--only", nargs="*", help="Only run the cases whose names contain any of these.")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="The number of runs of each case.")
+    parser.add_argument("--derived-cache", action="store_true",
+                        help="Use the derived image cache (warm runs after the first).")
+    parser.add_argument("--layout-cache", action="store_true",
+                        help="Use the layout cache (warm runs after the first).")
+    parser.add_argument("--timeout", type=float, default=900, help="Timeout of each run, in seconds.")
+    parser.add_argument("--folder", default=None, help="Working folder for the images and outputs.")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def token_array():
+    """A 40x40 RGB image of random pixels"""
+    return np.random.RandomState(0).randint(0, 256, (40, 40, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def orc_config(tmp_path, token_array):
+    """Writes a configuration of two circle tokens of an orc (token_array, saved in tmp_path)
+    drawn with ReportLab, with the persistent caches off.
+    Call it with extra top-level settings (TOML), it returns the configuration's path."""
+    Image.fromarray(token_array).save(tmp_path / "orc.png")
+
+    def write(settings: str = ""):
+        path = tmp_path / "config.toml"
+        path.write_text(f"""{settings}
+canvas = "rl"
+image_cache = false
+derived_cache = false
+layout_cache = false
+[monsters.orc]
+image_url = "{(tmp_path / 'orc.png').as_posix()}"
+tokens = [{{ type = "circle", count = 2 }}]
+""")
+        return path
+    return write
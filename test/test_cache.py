@@ -0,0 +1,53 @@
+import sys
+
+sys.path.append('.')
+from tokenpdf.utils.cache import PersistentCache
+
+
+def _file(cache, content, suffix=".png"):
+    path = cache.temp_path(suffix)
+    path.write_bytes(content)
+    return path
+
+
+def test_identical_content_stored_once(tmp_path):
+    cache = PersistentCache(tmp_path)
+    p1 = cache.put("http://a/1.png", _file(cache, b"same"))
+    p2 = cache.put("http://b/2.png", _file(cache, b"same"))
+    assert p1 == p2
+    assert cache.stats["files"] == 1
+    assert cache.get("http://a/1.png").read_bytes() == b"same"
+    cache.remove("http://a/1.png")
+    assert p2.exists()
+    cache.remove("http://b/2.png")
+    assert not p2.exists()
+
+
+def test_lru_eviction(tmp_path):
+    cache = PersistentCache(tmp_path, max_bytes=25)
+    cache.put("a", _file(cache, b"a" * 10))
+    cache.put("b", _file(cache, b"b" * 10))
+    assert cache.entry("a") is not None  # "b" is now the least recently used
+    cache.put("c", _file(cache, b"c" * 10))
+    assert cache.entry("b") is None
+    assert cache.has("a") and cache.has("c")
+    assert cache.stats["evictions"] == 1
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_index_persists(tmp_path):
+    cache = PersistentCache(tmp_path)
+    path = cache.put("key", _file(cache, b"data"), etag='"e"')
+    reopened = PersistentCache(tmp_path)
+    entry = reopened.entry("key")
+    assert entry.path == path and entry.etag == '"e"'
+
+
+def test_replaced_content_removed_once_unreferenced(tmp_path):
+    cache = PersistentCache(tmp_path)
+    old = cache.put("a", _file(cache, b"old"))
+    cache.put("b", _file(cache, b"old"))
+    cache.put("a", _file(cache, b"new"))
+    assert old.exists()  # Still referred to by "b"
+    cache.put("b", _file(cache, b"newer"))
+    assert not old.exists() and cache.stats["files"] == 2
@@ -4,6 +4,7 @@ sys.path.append('.')
 from tokenpdf.canvas import make_canvas, Canvas, CanvasPage, CanvasPageView
 from tokenpdf.resources import ResourceLoader
 import numpy as np
+import pytest
 
 
 def paint_rotated_image(page):
@@ -37,6 +38,103 @@ def paint_rotated_line(page):
     rtview = tview.rotate(-np.pi * 30/180)
     rtview.line(0,0, 10, 10, style='dash')
     
+def test_reportlab_identical_images_share_form(tmp_path, token_array):
+    from tokenpdf.canvas.reportlab import ReportLabCanvas
+    from tokenpdf.image import TokenImage, image_stats
+    from tokenpdf.utils.image import circle_mask
+    output = tmp_path / "out.pdf"
+    canvas = ReportLabCanvas({}, str(output))
+    page = canvas.create_page((100, 100))
+    for i in range(4):
+        page.image(i * 20, 0, 15, 15, TokenImage(token_array, circle_mask(20)))
+    temp_files = image_stats["temp_files_written"]
+    canvas.save()
+    assert len(canvas._forms) == 1
+    assert image_stats["temp_files_written"] == temp_files
+    assert output.read_bytes().count(b"/Subtype /Image") == 2  # The image and its soft mask
+
+
+def test_reportlab_page_cache_reuses_pages(tmp_path, monkeypatch, token_array):
+    import pikepdf
+    import tokenpdf.canvas.reportlab as reportlab
+    from tokenpdf.image import TokenImage
+    from tokenpdf.utils.cache import PersistentCache
+    cache = PersistentCache(tmp_path / "pages")
+    monkeypatch.setattr(reportlab, "main_page_cache", cache)
+
+    def save(name):
+        canvas = reportlab.ReportLabCanvas({}, str(tmp_path / name))
+        for i in range(2):
+            canvas.create_page((100, 100)).image(i * 20, 0, 15, 15, TokenImage(token_array))
+        canvas.save()
+        return canvas
+    first = save("first.pdf")
+    assert cache.stats["misses"] == 2 and cache.stats["files"] == 2
+    assert first.pages[0].content_hash() != first.pages[1].content_hash()
+    save("second.pdf")
+    assert cache.stats["hits"] == 2
+    with pikepdf.open(tmp_path / "second.pdf") as pdf:
+        assert len(pdf.pages) == 2
+        # The image of both pages is stored once
+        images = {obj.objgen for obj in pdf.objects
+                  if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image"}
+        assert len(images) == 1
+
+
+def test_reportlab_streaming_releases_finished_pages(tmp_path, token_array):
+    import pikepdf
+    from PIL import Image
+    from tokenpdf.canvas.reportlab import ReportLabCanvas
+    from tokenpdf.image import TokenImage
+    path = tmp_path / "token.png"
+    Image.fromarray(token_array).save(path)
+    canvas = ReportLabCanvas({"stream_pages": True}, str(tmp_path / "out.pdf"))
+    image = TokenImage(path)
+    assert image.image.size == (40, 40)  # Decoded
+    first = canvas.create_page((100, 100))
+    first.image(0, 0, 15, 15, image)
+    canvas.finish_page(first)
+    # Rendered on its own, and its image is read again from the file when needed
+    assert first.fragment is not None and first.commands == []
+    assert "image" not in image._img._sources
+    # The output is assembled from the pages' PDFs: no ReportLab canvas of its own, and no forms of the fragment
+    assert canvas._pdf is None and canvas._forms == {}
+    canvas.create_page((100, 50)).image(0, 0, 15, 15, image)
+    canvas.save()
+    canvas.cleanup()
+    with pikepdf.open(tmp_path / "out.pdf") as pdf:
+        assert [float(page.mediabox[3]) for page in pdf.pages] == pytest.approx([100 * 72 / 25.4, 50 * 72 / 25.4])
+        images = {obj.objgen for obj in pdf.objects
+                  if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image"}
+        assert len(images) == 1
+    assert not first.fragment.exists()
+
+
+def test_reportlab_streaming_recomputes_evicted_images(tmp_path, monkeypatch):
+    import tokenpdf.image
+    from tokenpdf.canvas.reportlab import ReportLabCanvas
+    from tokenpdf.image import TokenImage, derived_images
+    from tokenpdf.utils.cache import PersistentCache
+    # A budget smaller than any image: storing a derived image evicts every other one
+    monkeypatch.setattr(tokenpdf.image, "main_derived_cache", PersistentCache(tmp_path / "derived", max_bytes=1))
+    derived_images.clear()
+    rng = np.random.RandomState(0)
+    shared, other = [TokenImage(rng.randint(0, 256, (40, 40, 3), dtype=np.uint8)).resize(size=(20, 20))
+                     for _ in range(2)]
+    canvas = ReportLabCanvas({"stream_pages": True}, str(tmp_path / "out.pdf"))
+    first = canvas.create_page((100, 100))
+    first.image(0, 0, 15, 15, shared)
+    canvas.finish_page(first)
+    second = canvas.create_page((100, 100))
+    # Evicts the shared image, which the first page released
+    second.image(0, 0, 15, 15, other)
+    second.image(20, 0, 15, 15, shared)
+    canvas.save()
+    canvas.cleanup()
+    derived_images.clear()
+    assert (tmp_path / "out.pdf").exists()
+
+
 def main():
     canvas : Canvas = make_canvas({'output_file':'test.pdf'})
     page = canvas.create_page([100,200])
@@ -0,0 +1,47 @@
+import os
+import stat
+import sys
+import threading
+
+sys.path.append('.')
+import pytest
+import tokenpdf.daemon
+from tokenpdf.daemon import DaemonError, QueueFullError, RenderDaemon, make_server, submit_job
+
+
+def test_daemon_renders_jobs(tmp_path, orc_config):
+    config = orc_config()
+    with RenderDaemon(workers=1, max_queue=0, preload_rembg=False) as daemon:
+        server = make_server(daemon, str(tmp_path / "daemon.sock"))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            job = submit_job(str(tmp_path / "daemon.sock"), [config], tmp_path / "out.pdf", wait=False)
+            # The only worker is busy, and no job may wait for it
+            with pytest.raises(QueueFullError):
+                daemon.submit([config])
+            job = daemon.wait(job["id"])
+        finally:
+            server.shutdown()
+            server.server_close()
+    assert job["status"] == "done", job
+    task, = job["tasks"]
+    assert task["output_file"] == str(tmp_path / "out.pdf") and (tmp_path / "out.pdf").exists()
+    assert set(task["stages"]) >= {"load", "layout", "draw", "save"}
+    assert job["queue_time"] >= 0 and job["time"] >= task["time"]
+
+
+def test_job_api_is_local(tmp_path):
+    with pytest.raises(DaemonError):
+        make_server(None, "0.0.0.0:0")
+    make_server(None, "localhost:0").server_close()
+    server = make_server(None, str(tmp_path / "daemon.sock"))
+    try:
+        assert stat.S_IMODE(os.stat(tmp_path / "daemon.sock").st_mode) == 0o600
+    finally:
+        server.server_close()
+
+
+def test_workers_warm_installed_modules_only(monkeypatch):
+    monkeypatch.setattr(tokenpdf.daemon, "WARM_MODULES", ("json", "tokenpdf_not_installed"))
+    tokenpdf.daemon._init_worker(preload_rembg=False)
@@ -0,0 +1,169 @@
+import sys
+
+sys.path.append('.')
+import numpy as np
+import pytest
+from PIL import Image
+import tokenpdf.image
+from tokenpdf.image import TokenImage, derived_images
+from tokenpdf.utils.cache import PersistentCache
+from tokenpdf.utils.image import add_grid, circle_mask
+
+
+@pytest.fixture
+def derived_cache(tmp_path, monkeypatch):
+    cache = PersistentCache(tmp_path)
+    monkeypatch.setattr(tokenpdf.image, "main_derived_cache", cache)
+    derived_images.clear()
+    yield cache
+    derived_images.clear()
+
+
+def _token_image():
+    rng = np.random.RandomState(0)
+    array = rng.randint(0, 256, (40, 30, 3), dtype=np.uint8)
+    return TokenImage(array, circle_mask(20))
+
+
+def _render(image):
+    return np.asarray(image.join_mask().resize(size=(15, 20)).image)
+
+
+def test_derived_keys_are_stable():
+    a, b = _token_image(), _token_image()
+    assert a.key == b.key
+    assert a.join_mask().key == b.join_mask().key
+    assert a.join_mask().key != a.join_mask(blend=False).key
+    assert a.resize(size=(15, 20)).key != a.resize(size=(16, 20)).key
+
+
+def test_derived_images_persist(derived_cache):
+    expected = _render(_token_image())
+    assert derived_cache.stats["misses"] == 2  # join_mask, resize
+    derived_images.clear()
+
+    resized = _token_image().join_mask().resize(size=(15, 20))
+    assert resized.dims == (15, 20)
+    np.testing.assert_array_equal(np.asarray(resized.image), expected)
+    # Only the final image is loaded, its sources are never computed
+    assert derived_cache.stats["hits"] == 1
+
+
+def test_join_mask_keeps_source(derived_cache):
+    image = _token_image()
+    mode = image.image.mode
+    first = np.asarray(image.join_mask().image)
+    derived_images.clear()
+    assert image.image.mode == mode
+    np.testing.assert_array_equal(np.asarray(image.join_mask().image), first)
+
+
+class _StubModel:
+    """ Stands in for an ONNX session with a dynamic batch dimension """
+    class _Input:
+        name = "input"
+        shape = ["batch", 3, 320, 320]
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [self._Input()]
+
+    def run(self, outputs, feed):
+        x = feed["input"]
+        self.batch_sizes.append(len(x))
+        return [x.mean(axis=1, keepdims=True) ** 2]
+
+
+def test_rembg_batch_matches_single(monkeypatch):
+    rembg = pytest.importorskip("rembg")
+    from rembg.sessions.u2net import U2netSession
+    import tokenpdf.utils.rembg as trembg
+    session = object.__new__(U2netSession)
+    session.model_name = "u2net"
+    session.inner_session = _StubModel()
+    monkeypatch.setattr(trembg, "_checked_session", lambda provider=None: session)
+
+    rng = np.random.RandomState(1)
+    images = [rng.randint(0, 256, (h, w, 3), dtype=np.uint8) for h, w in [(40, 30), (64, 64), (25, 50)]]
+    batched = trembg.rembg_remove_batch(images, batch_size=2)
+    assert session.inner_session.batch_sizes == [2, 1]
+    for image, mask in zip(images, batched):
+        single = rembg.remove(image, session=session, only_mask=True, post_process_mask=True)
+        np.testing.assert_array_equal(np.asarray(mask), np.asarray(single))
+
+
+def test_prepared_images_match_sequential(derived_cache):
+    from tokenpdf.pipeline.prepare import final_images, prepare_images
+    derived_cache.disable()
+    expected = np.asarray(_token_image().resize(size=(15, 20)).join_mask().image)
+    derived_images.clear()
+
+    image = _token_image().resize(size=(15, 20))
+    pending = final_images([image])
+    assert len(pending) == 1 and pending[0].needs_compute
+    assert prepare_images(pending, workers=2) == 1
+    assert not pending[0].needs_compute
+    np.testing.assert_array_equal(np.asarray(image.join_mask().image), expected)
+
+
+def test_prepared_images_survive_eviction(derived_cache):
+    from tokenpdf.pipeline.prepare import final_images, prepare_images
+    derived_cache.disable()
+    sizes = [(15, 20), (12, 16)]
+    expected = [np.asarray(_token_image().resize(size=size).join_mask().image) for size in sizes]
+    derived_images.clear()
+    derived_cache.enable()
+    # A budget smaller than any result: every prepared result is evicted
+    derived_cache.max_bytes = 1
+
+    images = [_token_image().resize(size=size) for size in sizes]
+    assert prepare_images(final_images(images), workers=2) == 2
+    for image, pixels in zip(images, expected):
+        np.testing.assert_array_equal(np.asarray(image.join_mask().image), pixels)
+
+
+def test_circle_mask_cached():
+    mask = np.asarray(circle_mask(10))
+    assert mask.shape == (20, 20) and mask.dtype == np.uint8
+    assert mask[10, 10] == 255 and mask[0, 0] == 0
+    assert np.array_equal(mask, mask.T) and np.array_equal(mask, mask[::-1])
+    assert circle_mask(10) is circle_mask(10)
+    smooth = np.asarray(circle_mask(10, antialias=True))
+    assert ((smooth > 0) & (smooth < 255)).any()
+    assert np.array_equal(smooth == 255, (smooth == 255) & (mask == 255))
+
+
+def _add_grid_per_cell(img, grid, color):
+    """The grid as add_grid drew it before it was vectorized: two pastes per cell"""
+    img = img.convert("RGBA")
+    width, height = img.size
+    x = np.linspace(0, width, grid[0] + 1)
+    y = np.linspace(0, height, grid[1] + 1)
+    cell_size = (x[1] - x[0], y[1] - y[0])
+    thickness = max(1, int(min(cell_size) / 50))
+    for i in range(grid[0] + 1):
+        for j in range(grid[1] + 1):
+            x0, y0 = int(x[i]), int(y[j])
+            img.paste(color, (x0, y0, int(x[i] + cell_size[0]), y0 + thickness))
+            img.paste(color, (x0, y0, x0 + thickness, int(y[j] + cell_size[1])))
+    return img
+
+
+@pytest.mark.parametrize("grid", [(10, 7), (13, 9), (55, 35)])
+def test_add_grid_matches_per_cell_grid(grid):
+    image = Image.fromarray(np.random.RandomState(0).randint(0, 256, (700, 1100, 3), dtype=np.uint8))
+    np.testing.assert_array_equal(np.asarray(add_grid(image, grid, "red")),
+                                  np.asarray(_add_grid_per_cell(image, grid, "red")))
+
+
+def test_add_grid_antialias():
+    image = Image.new("RGB", (1000, 700), "white")
+    # Lines at whole pixels: the same as without antialiasing
+    np.testing.assert_array_equal(np.asarray(add_grid(image, (10, 7), antialias=True)),
+                                  np.asarray(add_grid(image, (10, 7))))
+    # Lines at fractional positions: blended edge pixels, with the same total coverage
+    darkness = 255 - np.asarray(add_grid(image, (3, 1), thickness=2, antialias=True))[350, :, 0].astype(float)
+    assert darkness[333] == pytest.approx(255 * 2 / 3, abs=1) and darkness[335] == pytest.approx(255 / 3, abs=1)
+    assert darkness.sum() == pytest.approx(255 * 2 * 3, abs=2)
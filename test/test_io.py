@@ -0,0 +1,96 @@
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append('.')
+import pytest
+from tokenpdf.utils.io import download, download_file, _part_path, _write_meta
+
+CONTENT = bytes(range(256)) * 4096
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ Serves CONTENT with an ETag, supporting conditional and Range requests """
+    requests_log = []
+
+    def do_GET(self):
+        Handler.requests_log.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = CONTENT
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range", ETAG) == ETAG:
+            start = int(range_header.split("=")[1].split("-")[0])
+            body = CONTENT[start:]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    Handler.requests_log = []
+    yield f"http://127.0.0.1:{server.server_address[1]}/image"
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_streams_to_disk(url, tmp_path):
+    result = download(url, tmp_path / "image.bin", allow_rename=True, chunk_size=1000)
+    assert result.path == tmp_path / "image.png"
+    assert result.path.read_bytes() == CONTENT
+    assert result.etag == ETAG
+    assert not _part_path(tmp_path / "image.bin").exists()
+
+
+def test_download_file_conditional(url, tmp_path):
+    path = download_file(url, tmp_path / "image.png")
+    assert path.read_bytes() == CONTENT
+    path2 = download_file(url, path)
+    assert path2 == path
+    assert Handler.requests_log[-1].get("If-None-Match") == ETAG
+    assert path.read_bytes() == CONTENT
+
+
+def test_download_file_conditional_after_rename(url, tmp_path):
+    path = download_file(url, tmp_path / "image.bin", allow_rename=True)
+    assert path == tmp_path / "image.png" and path.read_bytes() == CONTENT
+    path2 = download_file(url, tmp_path / "image.bin", allow_rename=True)
+    assert path2 == path
+    assert Handler.requests_log[-1].get("If-None-Match") == ETAG
+    assert len(Handler.requests_log) == 2
+
+
+def test_download_resumes_partial(url, tmp_path):
+    path = tmp_path / "image.png"
+    part = _part_path(path)
+    part.write_bytes(CONTENT[:1000])
+    _write_meta(part, url, ETAG, None)
+    result = download(url, path)
+    assert Handler.requests_log[-1].get("Range") == "bytes=1000-"
+    assert result.path.read_bytes() == CONTENT
+    assert not part.exists()
+
+
+def test_download_restarts_changed_partial(url, tmp_path):
+    path = tmp_path / "image.png"
+    part = _part_path(path)
+    part.write_bytes(b"stale" * 100)
+    _write_meta(part, url, '"v0"', None)
+    result = download(url, path)
+    assert result.path.read_bytes() == CONTENT
@@ -0,0 +1,190 @@
+import sys
+
+sys.path.append('.')
+import pickle
+import time
+import numpy as np
+import pytest
+from tokenpdf.layouts import make_layout, CachedLayout, IncrementalLayout
+from tokenpdf.layouts.layout import BestLayout, Layout
+from tokenpdf.utils.cache import PersistentCache
+
+
+def _page_sizes():
+    while True:
+        yield (190, 277)
+
+
+def _token_sizes():
+    return [(50, 50)] * 7 + [(25, 25)] * 30 + [(25, 60)] * 6 + [(12.5, 12.5)] * 20
+
+
+def test_rectpack_layout_pickles():
+    layout = make_layout({"layout": "rectpack", "pack_algo": "MaxRectsBssf", "bin_algo": "BFF",
+                          "sort_algo": "AREA", "rotation": True})
+    copy = pickle.loads(pickle.dumps(layout))
+    assert copy.sort_algo is layout.sort_algo
+    assert copy.arrange(_token_sizes(), _page_sizes()) == layout.arrange(_token_sizes(), _page_sizes())
+
+
+def test_parallel_best_layout_matches_sequential():
+    sequential = make_layout({"layout": "all"}).arrange(_token_sizes(), _page_sizes())
+    parallel = make_layout({"layout": "all", "layout_workers": 2}).arrange(_token_sizes(), _page_sizes())
+    assert parallel == sequential
+
+
+def test_pruned_search_stops_at_min_pages():
+    config = {"layout": "rectpack", "pack_algo": ["MaxRectsBssf", "SkylineMwf"], "sort_algo": "AREA"}
+    full = make_layout(config)
+    pruned = make_layout(dict(config, layout_search="pruned"))
+    arranged = []
+    for layout in pruned.layouts:
+        layout.arrange = (lambda arrange: lambda *a, **kw: arranged.append(1) or arrange(*a, **kw))(layout.arrange)
+    # 4 tokens of a quarter page each: a single page is the minimum
+    sizes = [(95, 138)] * 4
+    assert len(pruned.arrange(sizes, _page_sizes())) == len(full.arrange(sizes, _page_sizes())) == 1
+    # The first candidate (rotating a token) needs 2 pages, the second reaches 1 page and ends the search
+    assert len(arranged) == 2 < len(pruned.layouts)
+
+
+def test_time_budget_returns_a_result():
+    layout = make_layout({"layout": "all", "layout_time_budget": 1e-9})
+    assert sum(len(page) for page in layout.arrange(_token_sizes(), _page_sizes())) == len(_token_sizes())
+
+
+class _SlowLayout(Layout):
+    """A candidate that takes far longer than the time budget"""
+    def arrange(self, token_sizes, page_sizes, verbose=False):
+        time.sleep(60)
+        raise AssertionError("Should have been stopped")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_time_budget_stops_running_candidates(workers):
+    config = {"layout_time_budget": 0.5, "layout_workers": workers}
+    fast = make_layout({"layout": "maxrects"})
+    layout = BestLayout(config, [fast, _SlowLayout(config)])
+    start = time.perf_counter()
+    pages = layout.arrange(_token_sizes(), _page_sizes())
+    # The budget, plus the start up of the (spawned) workers
+    assert time.perf_counter() - start < 0.5 + 15
+    assert pages == fast.arrange(_token_sizes(), _page_sizes())
+
+
+def test_cached_layout_skips_cut_off_searches(tmp_path):
+    config = {"layout_time_budget": 0.5}
+    cache = PersistentCache(tmp_path)
+    fast = make_layout({"layout": "maxrects"})
+    layout = CachedLayout(config, BestLayout(config, [fast, _SlowLayout(config)]), cache)
+    layout.arrange(_token_sizes(), _page_sizes())
+    assert layout.layout.cut_off and cache.stats["files"] == 0
+    # Searches that complete within the budget are stored
+    layout = CachedLayout(config, BestLayout(config, [fast, make_layout({"layout": "greedy"})]), cache)
+    layout.arrange(_token_sizes(), _page_sizes())
+    assert not layout.layout.cut_off and cache.stats["files"] == 1
+
+
+def test_maxrects_layout_places_all_tokens():
+    # Sub-millimetre sizes, which are kept as they are
+    sizes = _token_sizes() + [(25.4, 25.4)] * 10 + [(200, 20)]
+    pages = make_layout({"layout": "maxrects"}).arrange(sizes, _page_sizes())
+    assert sorted(i for page in pages for i, *_ in page) == list(range(len(sizes)))
+    for page in pages:
+        for a, (i, x, y, w, h) in enumerate(page):
+            assert sorted((w, h)) == sorted(sizes[i])
+            assert x >= 0 and y >= 0 and x + w <= 190 + 1e-6 and y + h <= 277 + 1e-6
+            for j, x2, y2, w2, h2 in page[a + 1:]:
+                assert x + w <= x2 + 1e-6 or x2 + w2 <= x + 1e-6 or y + h <= y2 + 1e-6 or y2 + h2 <= y + 1e-6
+    # The 200mm token only fits rotated
+    assert any((w, h) == (20, 200) for page in pages for i, x, y, w, h in page)
+
+
+def test_page_count_search_tries_each_count_once():
+    layout = make_layout({"layout": "rectpack", "pack_algo": "MaxRectsBssf", "bin_algo": "BNF",
+                          "sort_algo": "AREA", "rotation": False})
+    # 9 tokens of a quarter page each: the area bound (3 pages) succeeds right away
+    assert len(layout.arrange([(95, 138)] * 9, _page_sizes())) == 3
+    assert layout.invocations == 1
+    tried = []
+    arrange_on_pages = layout.arrange_on_pages
+    layout.arrange_on_pages = lambda sizes, pages, verbose=False: (tried.append(len(pages))
+                                                                    or arrange_on_pages(sizes, pages, verbose))
+    sizes = [(100, 100)] * 7 + _token_sizes()
+    pages = layout.arrange(sizes, _page_sizes())
+    assert len(tried) == len(set(tried)) == layout.invocations
+    # The result is minimal for this packer
+    assert len(pages) - 1 in tried
+    assert sum(len(page) for page in pages) == len(sizes)
+
+
+def test_cached_layout_remaps_stored_arrangement(tmp_path):
+    config = {"layout": "maxrects"}
+    layout = CachedLayout(config, make_layout(config), PersistentCache(tmp_path))
+    sizes = _token_sizes()
+    first = layout.arrange(sizes, _page_sizes())
+    calls = []
+    layout.layout.arrange = lambda *args, **kwargs: calls.append(1)
+    # The same sizes in another order reuse the arrangement, without arranging
+    shuffled = sizes[::-1]
+    pages = layout.arrange(shuffled, _page_sizes())
+    assert not calls and layout.cache.hits == layout.cache.misses == 1
+    assert len(pages) == len(first)
+    assert sorted(i for page in pages for i, *_ in page) == list(range(len(sizes)))
+    assert all(sorted((w, h)) == sorted(shuffled[i]) for page in pages for i, x, y, w, h in page)
+
+
+def test_contiguous_area_matches_graph_components():
+    from tokenpdf.layouts.layout import _largest_contiguous_areas
+    from tokenpdf.utils.graph import largest_connected_component
+    # Two overlapping groups (3 and 2 tokens), a token touching (not overlapping) the first, and a lone token
+    page = [(0, 0, 0, 10, 10), (1, 5, 5, 10, 10), (2, 10, 10, 10, 10), (3, 20, 20, 5, 5),
+            (4, 50, 50, 10, 10), (5, 55, 50, 10, 10), (6, 100, 100, 7, 7)]
+    assert _largest_contiguous_areas([page, page[4:]]) == 300 + 200
+
+    def overlap(i, j):
+        *_, x1, y1, w1, h1 = page[i]
+        *_, x2, y2, w2, h2 = page[j]
+        return x1 + w1 >= x2 + 1e-4 and x2 + w2 >= x1 + 1e-4 and y1 + h1 >= y2 + 1e-4 and y2 + h2 >= y1 + 1e-4
+    assert sorted(largest_connected_component(range(len(page)), overlap)) == [0, 1, 2]
+
+    # Fractional sizes, dense pages: the totals are exactly those of the graph search
+    # (the layouts are compared by them, so rounding differences could change the chosen layout)
+    rng = np.random.RandomState(0)
+    for count in [40, 200, 600]:
+        page = [(i, *rng.uniform(0, 10 * np.sqrt(count), 2), *rng.uniform(5, 15, 2)) for i in range(count)]
+        component = largest_connected_component(range(len(page)), overlap)
+        assert len(component) > 10
+        assert _largest_contiguous_areas([page]) == sum(page[i][-2] * page[i][-1] for i in component)
+
+
+def test_incremental_layout_keeps_placements(tmp_path):
+    config = {"layout": "maxrects"}
+    layout = IncrementalLayout(config, make_layout(config), tmp_path / "plan.json")
+    sizes = [(50, 50)] * 25
+    layout.token_keys = [f"token{i}" for i in range(len(sizes))]
+    before = {layout.token_keys[i]: (p, rect) for p, page in enumerate(layout.arrange(sizes, _page_sizes()))
+              for i, *rect in page}
+    # Two new tokens, and the existing ones in another order
+    keys = [f"token{i}" for i in reversed(range(len(sizes)))] + ["new0", "new1"]
+    layout.token_keys = keys
+    pages = layout.arrange(sizes + [(45, 45)] * 2, _page_sizes())
+    after = {keys[i]: (p, rect) for p, page in enumerate(pages) for i, *rect in page}
+    assert all(after[key] == placement for key, placement in before.items())
+    # 25 tokens fill a page (15) and most of another, where the new tokens fit
+    assert len(pages) == 2 and layout.changed_pages == [after["new0"][0]] == [after["new1"][0]]
+
+
+def test_incremental_layout_drops_emptied_page(tmp_path):
+    config = {"layout": "maxrects"}
+    layout = IncrementalLayout(config, make_layout(config), tmp_path / "plan.json")
+    sizes = [(50, 50)] * 40
+    layout.token_keys = [f"token{i}" for i in range(len(sizes))]
+    first = [[(f"token{i}", *rect) for i, *rect in page] for page in layout.arrange(sizes, _page_sizes())]
+    assert len(first) == 3
+    # Remove every token of the middle page: the last page moves up, so it changed
+    middle = {key for key, *_ in first[1]}
+    keys = [key for key in layout.token_keys if key not in middle]
+    layout.token_keys = keys
+    pages = layout.arrange(sizes[:len(keys)], _page_sizes())
+    assert [[(keys[i], *rect) for i, *rect in page] for page in pages] == [first[0], first[2]]
+    assert layout.changed_pages == [1]
@@ -0,0 +1,60 @@
+import sys
+
+sys.path.append('.')
+import numpy as np
+import pytest
+from PIL import Image
+import tokenpdf.maps.tiles
+from tokenpdf.image import TokenImage, image_stats
+from tokenpdf.maps.tiles import TileStore, read_region
+from tokenpdf.utils.cache import PersistentCache
+from tokenpdf.utils.image import add_grid
+
+
+@pytest.fixture
+def tile_cache(tmp_path, monkeypatch):
+    cache = PersistentCache(tmp_path / "tiles")
+    monkeypatch.setattr(tokenpdf.maps.tiles, "main_tile_cache", cache)
+    return cache
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L"])
+def test_regions_match_cropped_map(tmp_path, tile_cache, mode):
+    rng = np.random.RandomState(0)
+    image = Image.fromarray(rng.randint(0, 256, (700, 1100, 4), dtype=np.uint8)).convert(mode)
+    image.save(tmp_path / "map.png")
+    store = TileStore.build(TokenImage(str(tmp_path / "map.png")), tile_size=256)
+    gridded = add_grid(image, (13, 9), "red")
+    for box in [(0, 0, 1100, 700), (250, 100, 530, 300), (900, 600, 1200, 760), (-10, -5, 40, 20)]:
+        np.testing.assert_array_equal(np.asarray(read_region(store, box)), np.asarray(image.crop(box)))
+        np.testing.assert_array_equal(np.asarray(read_region(store, box, ((13, 9), "red", False))),
+                                      np.asarray(gridded.crop(box)))
+
+
+def test_tile_store_is_reused(tmp_path, tile_cache):
+    Image.fromarray(np.zeros((300, 400, 3), dtype=np.uint8)).save(tmp_path / "map.png")
+    TileStore.build(TokenImage(str(tmp_path / "map.png")), tile_size=128)
+    decoded = image_stats["decoded"]
+    store = TileStore.build(TokenImage(str(tmp_path / "map.png")), tile_size=128)
+    assert image_stats["decoded"] == decoded and tile_cache.stats["hits"] == 1
+    assert store.size == (400, 300) and store.tiles.shape == (3, 4, 128, 128, 3)
+
+
+def test_tile_stores_in_use_are_not_evicted(tmp_path, tile_cache):
+    # A budget smaller than any store: building a store evicts every other one, unless in use
+    tile_cache.max_bytes = 1
+    images = []
+    for i in range(2):
+        image = Image.fromarray(np.full((300, 400, 3), i, dtype=np.uint8))
+        image.save(tmp_path / f"map{i}.png")
+        images.append(image)
+    first = TileStore.build(TokenImage(str(tmp_path / "map0.png")), tile_size=128)
+    second = TileStore.build(TokenImage(str(tmp_path / "map1.png")), tile_size=128)
+    for store, image in zip([first, second], images):
+        np.testing.assert_array_equal(np.asarray(store.read((100, 50, 300, 250))),
+                                      np.asarray(image.crop((100, 50, 300, 250))))
+    # Evicted once no longer used
+    path = first.path
+    del first
+    TileStore.build(TokenImage(str(tmp_path / "map0.png")), tile_size=64)
+    assert not path.exists() and second.path.exists()
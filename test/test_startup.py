@@ -0,0 +1,32 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+# Loaded on first use, never at import time
+HEAVY_MODULES = ["rembg", "onnxruntime", "cv2", "networkx", "pikepdf", "PyPDF2"]
+
+
+def _imported_modules(module: str):
+    """The modules imported by a cold import of module (as listed by -X importtime)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def test_cli_imports_no_pipeline():
+    # The pipeline (and its backends) is only imported to render locally
+    assert "tokenpdf.pipeline.workflow" not in _imported_modules("tokenpdf.__main__")
+
+
+@pytest.mark.parametrize("module", ["tokenpdf.__main__", "tokenpdf.pipeline.workflow", "tokenpdf.daemon"])
+def test_heavy_backends_imported_lazily(module):
+    modules = _imported_modules(module)
+    assert not [name for name in HEAVY_MODULES if name in modules]
@@ -0,0 +1,38 @@
+import sys
+
+sys.path.append('.')
+import tracemalloc
+import pytest
+from tokenpdf.utils.timing import StageTimer, rebase_events, stage, trace_origin
+
+
+def test_nested_stages():
+    counts = {"decoded": 0}
+    events = []
+    timer = StageTimer(events, memory=True, counters=counts.copy)
+    stage("ignored")  # No active timer
+    with timer.activate():
+        with stage("save"):
+            for i in range(2):
+                with stage("page", page=i):
+                    counts["decoded"] += 1
+                    data = bytearray(1 << 20)
+            del data
+    assert not tracemalloc.is_tracing()
+    assert set(timer.stages) == {"save", "save/page"}
+    assert timer.stages["save"] >= timer.stages["save/page"]
+    assert timer.counters["save/page"]["decoded"] == 2
+    assert timer.peak_memory["save"] >= timer.peak_memory["save/page"] >= 1 << 20
+    assert [e["name"] for e in events] == ["page", "page", "save"]
+    assert events[1]["args"]["page"] == 1
+
+
+def test_rebased_events_share_timeline():
+    events = []
+    with StageTimer(events).activate():
+        with stage("load"):
+            pass
+    ts = events[0]["ts"]
+    # Relative to an origin a second earlier (e.g. a parent process started before this one)
+    rebase_events(events, trace_origin() - 1)
+    assert events[0]["ts"] == pytest.approx(ts + 1e6)
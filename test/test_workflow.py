@@ -0,0 +1,20 @@
+import sys
+
+sys.path.append('.')
+import pytest
+from tokenpdf.pipeline.workflow import TaskError, WorkflowManager
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failed_task_does_not_stop_others(tmp_path, orc_config, workers):
+    config = orc_config(f"""
+output = "{(tmp_path / 'out_{ps}.pdf').as_posix()}"
+page_size = ["A5", "nonsense"]
+task_workers = {workers}""")
+    workflow = WorkflowManager(str(config), verbose=False)
+    with pytest.raises(TaskError) as error:
+        workflow.run()
+    first, second = error.value.results
+    assert first.error is None and first.output_file.endswith("out_A5.pdf")
+    assert (tmp_path / "out_A5.pdf").exists() and "draw" in first.stages
+    assert second.label == "page_size=nonsense" and "Traceback" in second.error
@@ -1,4 +1,17 @@
-from .image import TokenImage, FloatingImage
-from .resources import ResourceLoader
+__all__ = ['TokenImage', 'FloatingImage', 'ResourceLoader']
 
-__all__ = ['TokenImage', 'FloatingImage', 'ResourceLoader']
\ No newline at end of file
+_EXPORTS = {
+    'TokenImage': 'tokenpdf.image',
+    'FloatingImage': 'tokenpdf.image',
+    'ResourceLoader': 'tokenpdf.resources',
+}
+
+
+def __getattr__(name):
+    # Imported on first access, so the command line starts without loading the pipeline
+    if name in _EXPORTS:
+        import importlib
+        value = getattr(importlib.import_module(_EXPORTS[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
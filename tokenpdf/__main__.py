@@ -1,4 +1,3 @@
-from .pipeline.workflow import WorkflowManager
 from .utils.config import get_data_folder
 from argparse import ArgumentParser
 
@@ -17,19 +16,73 @@ def main():
                         help="Print information during execution. Default: Refers to the configuration file.")
     parser.add_argument("-s", "--silent", action="store_true", 
                         help="Silence most output. Default: Refers to the configuration file.")
-    
+    parser.add_argument("--profile", default=None, metavar="PATH",
+                        help="Write a profile of the run to PATH: the time of each stage and sub-stage, "
+                        "with decoded image bytes (and peak memory, with --profile-memory), as a trace-event JSON file "
+                        "(viewable in chrome://tracing or Perfetto).")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Also record the peak memory of each stage (with tracemalloc). "
+                        "Slows down the run considerably.")
+    parser.add_argument("--serve", default=None, metavar="ADDRESS",
+                        help="Run as a daemon, rendering jobs submitted to ADDRESS: host:port for HTTP, "
+                        "or the path of a Unix socket. The daemon's workers keep their imports, "
+                        "rembg sessions and decoded images between jobs.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="With --serve: the number of worker processes (jobs rendered concurrently).")
+    parser.add_argument("--max-queue", type=int, default=16,
+                        help="With --serve: the number of jobs waiting for a worker, beyond which jobs are rejected.")
+    parser.add_argument("--allow-remote", action="store_true",
+                        help="With --serve: allow a host:port address that isn't a loopback address. "
+                        "The job API has no authentication, and reads and writes any file the daemon can.")
+    parser.add_argument("--daemon", default=None, metavar="ADDRESS",
+                        help="Render the configuration with a daemon running at ADDRESS (see --serve), "
+                        "instead of in this process.")
 
     args = parser.parse_args()
     config_files = args.config
 
+    if args.serve:
+        from .daemon import DaemonError, serve
+        try:
+            serve(args.serve, args.workers, args.max_queue, verbose=not args.silent,
+                  allow_remote=args.allow_remote)
+        except DaemonError as e:
+            parser.exit(1, f"{e}\n")
+        return
     if args.example:
         config_files.insert(0, get_data_folder() / "example.toml")
     elif not args.example and not config_files:
         parser.error("At least one configuration file must be provided.")
     output_file = args.output
+    if args.daemon:
+        return _submit(parser, args.daemon, config_files, output_file, args.silent)
+    # Imported here, so --help, --serve and --daemon don't load the pipeline
+    from .pipeline.workflow import TaskError, WorkflowManager
     verbose = None if (not args.verbose and not args.silent) else (args.verbose and not args.silent)
-    workflow = WorkflowManager(*config_files, output_file=output_file, verbose=verbose)
-    workflow.run()
+    workflow = WorkflowManager(*config_files, output_file=output_file, verbose=verbose, profile=args.profile,
+                               profile_memory=args.profile_memory)
+    try:
+        workflow.run()
+    except TaskError as e:
+        parser.exit(1, f"{e}\n")
+
+def _submit(parser, address, config_files, output_file, silent):
+    """Renders with a daemon, printing the output file and stage times of each task."""
+    from .daemon import DaemonError, submit_job
+    try:
+        job = submit_job(address, config_files, output_file)
+    except (DaemonError, OSError) as e:
+        parser.exit(1, f"Daemon at {address}: {e}\n")
+    for task in job["tasks"]:
+        if task["error"] is not None:
+            print(f"Task {task['label']} failed:\n{task['error']}")
+        elif not silent:
+            stages = ", ".join(f"{path} {seconds:.2f}s" for path, seconds in task["stages"].items())
+            print(f"{task['output_file']} in {task['time']:.2f}s ({stages})")
+    if job["status"] != "done":
+        parser.exit(1, job.get("error", "") + "Job failed\n")
+    if not silent:
+        print(f"Waited {job['queue_time']:.2f}s for a worker, rendered in {job['time']:.2f}s")
 
 if __name__ == "__main__":
     main()
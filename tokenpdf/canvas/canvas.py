@@ -2,9 +2,17 @@ from typing import Tuple, Dict, Any, Sequence
 from pathlib import Path
 import logging 
 import numpy as np
+from platformdirs import user_cache_dir
 from tokenpdf.image import TokenImage
+from tokenpdf.utils.cache import PersistentCache
 from tokenpdf.utils.registry import RegistryClass
 
+PAGE_CACHE = Path(user_cache_dir("tokenpdf")) / "pages"
+ENABLE_PAGE_CACHE = False
+PAGE_CACHE_MAX_BYTES = 1 << 30
+# Rendered pages, by the hash of their content (see ReportLabCanvasPage.content_hash)
+main_page_cache = PersistentCache(folder=PAGE_CACHE, enabled=ENABLE_PAGE_CACHE, max_bytes=PAGE_CACHE_MAX_BYTES)
+
 
 class CanvasPage:
     """Base class for a single page in a canvas."""
@@ -410,6 +418,8 @@ class Canvas:
         self.config = config
         self.file_path = file_path if file_path else config["output_file"]
         self.files_cleanup = []
+        # Write out each page when it is finished, rather than all of them on save
+        self.stream_pages = config.get("stream_pages", False)
 
     
     def create_page(self, size: Tuple[float, float], background: str = None) -> CanvasPage:
@@ -428,7 +438,20 @@ class Canvas:
         """
         pass
 
-    
+
+    def finish_page(self, page: CanvasPage, verbose: bool = False):
+        """Called when a page is completely drawn (nothing is drawn on it afterwards).
+        When streaming pages, canvases that support it write the page out
+        and release its content and images, so only the current page is kept in memory.
+        Pages that are not finished are written on save.
+
+        Args:
+          page: The finished page.
+          verbose: bool:  (Default value = False)
+
+        """
+        pass
+
     def save(self, verbose: bool = False, return_result: bool = False):
         """Finalizes and saves the canvas to the output file.
 
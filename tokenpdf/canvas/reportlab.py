@@ -1,8 +1,12 @@
 from multiprocessing import context
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, List, Tuple
 from pathlib import Path
+import hashlib
+import tempfile
+from uuid import uuid4
 from reportlab.pdfgen import canvas as reportlab_canvas
 from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
 from tokenpdf.utils.image import to_image, join_mask_channel
 from contextlib import nullcontext
 from collections import namedtuple
@@ -10,21 +14,27 @@ from tempfile import NamedTemporaryFile
 from PIL import Image, ImageColor
 from tokenpdf.utils.verbose import vprint, vtqdm
 from tokenpdf.utils.geometry import stroke_dash_array
-from tokenpdf.image import TokenImage
-from .canvas import Canvas, CanvasPage
+from tokenpdf.utils.timing import stage
+from tokenpdf.image import TokenImage, image_stats
+from .canvas import Canvas, CanvasPage, main_page_cache
 import contextlib
 import numpy as np
 
+# Bump when the rendering of commands changes, to invalidate pages rendered by older versions
+PAGE_HASH_VERSION = 1
+
 class ReportLabCanvasPage(CanvasPage):
     """ """
     def __init__(self, canvas, width: float, height: float, background: str = None):
         super().__init__(canvas, (width, height))
-        self.pdf_canvas = canvas.pdf
+        self.pdf_canvas = None  # The ReportLab canvas the page is being rendered on (see _render_page)
         self.width = width
         self.height = height
         self.background = background
         self.commands = []  # Store commands to execute for this page
         self.lastLineDash = None
+        self.index = len(canvas.pages)
+        self.fragment = None  # The single-page PDF of the page, once rendered on its own
         if background:
             self.commands.append(("image", 0, 0, width, height, background))
 
@@ -45,16 +55,12 @@ class ReportLabCanvasPage(CanvasPage):
                 rotate = -angle # Reportlab rotates clockwise
                 
                 with apply_image_filters(image, flip) as fimage:
+                    form = self.canvas.image_form(fimage)
                     bltagaim = reportlab_translation_for_rotation(self.height, height, (x, y), rotate)
                     # Now we can rotate around this point
                     with self._translation(*bltagaim), self._rotation(rotate):
-                        image_param = fimage.image
-                        if image_param.mode == "RGBA":
-                            # Reportlab supports alpha channels, but they don't seem
-                            # to work unless passed as a file path
-                            image_param = fimage.path
-                        self.pdf_canvas.drawImage(fimage.path, 0, 0, 
-                                                    width * mm, height * mm, mask='auto')
+                        self.pdf_canvas.scale(width * mm, height * mm)
+                        self.pdf_canvas.doForm(form)
             elif cmd_type == "text":
                 _, x, y, text, font, size, rotate = command
                 self.pdf_canvas.setFont(font, size)
@@ -83,6 +89,27 @@ class ReportLabCanvasPage(CanvasPage):
                                         stroke=thickness, fill=fill)
                 
 
+    def content_hash(self) -> str:
+        """A hash of the page's content: its size and drawing commands,
+        with images identified by their content keys. Pages with the same hash render the same.
+
+        Returns:
+          : The hex digest.
+
+        """
+        digest = hashlib.sha256(repr((PAGE_HASH_VERSION, _hash_value((self.width, self.height)))).encode())
+        for command in self.commands:
+            digest.update(repr(_hash_value(command)).encode())
+        return digest.hexdigest()
+
+    def release(self):
+        """Drops the page's commands, and the pixels of its images (see TokenImage.release)."""
+        for command in self.commands:
+            if command[0] == "image" and isinstance(command[5], TokenImage):
+                _, x, y, width, height, image, flip, angle = command
+                apply_image_filters(image, flip).release()
+        self.commands = []
+
     def _image(self, x: float, y: float, width: float, height: float, image:TokenImage, 
               flip: Tuple[bool, bool] = (False, False), rotate: float = 0):
         """
@@ -282,8 +309,20 @@ class ReportLabCanvas(Canvas):
     """ """
     def __init__(self, config: Dict[str, Any], file_path: str | None = None):
         super().__init__(config, file_path)
-        self.pdf = reportlab_canvas.Canvas(config.get("output_file", file_path))
+        self.output_path = config.get("output_file", file_path)
+        self._pdf = None
         self.pages = []  # Track pages
+        self._forms = {}  # Image key -> form name
+        self._rendered = 0  # Pages rendered on their own (see _render_fragment)
+        self._fragment_images = set()  # Keys of the images of the pages rendered on their own
+
+    @property
+    def pdf(self) -> reportlab_canvas.Canvas:
+        """The ReportLab canvas of the output. Created on first use, as it is
+        never used when the output is assembled from the pages' own PDFs (see _save_fragments)."""
+        if self._pdf is None:
+            self._pdf = reportlab_canvas.Canvas(self.output_path)
+        return self._pdf
 
     def create_page(self, size: Tuple[float, float], background: str = None) -> CanvasPage:
         """
@@ -300,6 +339,43 @@ class ReportLabCanvas(Canvas):
         self.pages.append(page)
         return page
 
+    def image_form(self, image: TokenImage) -> str:
+        """Registers an image as a form XObject, drawn in the unit square.
+        Images with the same content (key) share a single form, so identical tokens
+        embed their pixels once, and are only rendered once.
+
+        Args:
+          image: The image to register (with its mask joined).
+
+        Returns:
+          : The name of the form.
+
+        """
+        key = image.key
+        name = self._forms.get(key)
+        if name is None:
+            name = f"TokenImage{len(self._forms)}"
+            self.pdf.beginForm(name, 0, 0, 1, 1)
+            self.pdf.drawImage(reportlab_image(image), 0, 0, 1, 1, mask='auto')
+            self.pdf.endForm()
+            self._forms[key] = name
+        return name
+
+    def finish_page(self, page: ReportLabCanvasPage, verbose: bool = False):
+        """Renders a finished page as a single-page PDF, and releases its commands and images,
+        when streaming pages. The output is assembled from the pages' PDFs on save.
+
+        Args:
+          page: The finished page.
+          verbose: bool:  (Default value = False)
+
+        """
+        if not self.stream_pages or page.fragment is not None:
+            return
+        with stage("page", page=page.index):
+            page.fragment = self._render_fragment(page, verbose)
+        page.release()
+
     def save(self, verbose: bool = False):
         """Finalize all pages and save the PDF.
 
@@ -311,11 +387,75 @@ class ReportLabCanvas(Canvas):
         """
         
         tqdm = vtqdm(verbose)
-        for page in tqdm(self.pages, desc="Saving pages"):
-            self.pdf.setPageSize((page.width * mm, page.height * mm))
+        print = vprint(verbose)
+        temp_files = image_stats["temp_files_written"]
+        if self.stream_pages or main_page_cache.enabled:
+            self._save_fragments(verbose)
+        else:
+            for i, page in enumerate(tqdm(self.pages, desc="Saving pages")):
+                with stage("page", page=i):
+                    self._render_page(page, verbose)
+            with stage("write"):
+                self.pdf.save()
+        print(f"Images: {len(self._forms.keys() | self._fragment_images)} unique, "
+              f"{image_stats['temp_files_written'] - temp_files} temporary files written")
+
+    def _render_page(self, page: ReportLabCanvasPage, verbose: bool = False):
+        """Draws a page's commands as the next page of the PDF."""
+        self.pdf.setPageSize((page.width * mm, page.height * mm))
+        page.pdf_canvas = self.pdf
+        try:
             page._execute_commands(verbose=verbose)  # Draw all commands for the page
-            self.pdf.showPage()  # Finalize the page
-        self.pdf.save()
+        finally:
+            page.pdf_canvas = None
+        self.pdf.showPage()  # Finalize the page
+
+    def _render_fragment(self, page: ReportLabCanvasPage, verbose: bool = False) -> Path:
+        """Renders a page as a single-page PDF, or finds it in the page cache (by its content hash)
+        when the cache is enabled. Rendered pages are stored in the cache.
+
+        Returns:
+          : The path of the page's PDF.
+
+        """
+        if main_page_cache.enabled:
+            key = "page:" + page.content_hash()
+            entry = main_page_cache.entry(key)
+            if entry is not None:
+                return entry.path
+            path = main_page_cache.temp_path(".pdf")
+        else:
+            path = Path(tempfile.gettempdir()) / f"page_{uuid4().hex[:8]}.pdf"
+            self.add_cleanup(path)
+        fragment = ReportLabCanvas(dict(self.config, output_file=str(path)))
+        page.canvas = fragment
+        try:
+            fragment._render_page(page, verbose)
+            fragment.pdf.save()
+        finally:
+            # The fragment (with its encoded images) is not kept alive by the page
+            page.canvas = self
+        # The images of the fragments are deduplicated when assembling, only counted here
+        self._fragment_images.update(fragment._forms)
+        self._rendered += 1
+        if main_page_cache.enabled:
+            return main_page_cache.put(key, path)
+        return path
+
+    def _save_fragments(self, verbose: bool = False):
+        """Saves the PDF from the pages' single-page PDFs, rendering the pages that weren't yet.
+        The pages are assembled into the output with identical images (and forms) stored once."""
+        tqdm = vtqdm(verbose)
+        print = vprint(verbose)
+        for page in tqdm(self.pages, desc="Saving pages"):
+            if page.fragment is None:
+                with stage("page", page=page.index):
+                    page.fragment = self._render_fragment(page, verbose)
+        with stage("write"):
+            assemble_pdf([page.fragment for page in self.pages], self.output_path)
+        if main_page_cache.enabled:
+            print(f"Pages: {self._rendered} rendered, "
+                  f"{len(self.pages) - self._rendered} from the page cache")
 
     @Canvas.name.getter
     def name(self):
@@ -353,6 +493,108 @@ def apply_image_filters(image:TokenImage, flip: Tuple[bool, bool] = (False, Fals
     return image
 
 
+def reportlab_image(image: TokenImage) -> ImageReader | str:
+    """The image as passed to reportlab's drawImage.
+    Images in memory are passed as a reader over their pixels (with the alpha channel
+    as a soft mask), so no intermediate file is encoded. Images that are only in a
+    file are passed by path, which keeps JPEG files embedded as they are.
+
+    Args:
+      image: The image.
+
+    Returns:
+      : An ImageReader, or a file path.
+
+    """
+    if image.in_memory:
+        return ImageReader(image.image)
+    return str(image.path)
+
+
+def assemble_pdf(paths: List[Path], output_path: str | Path):
+    """Writes the pages of PDF files as a single PDF.
+    Identical XObjects (images and forms) of different files are stored once.
+
+    Args:
+      paths: The PDF files, in page order (a file may repeat).
+      output_path: The output PDF file.
+
+    """
+    # pikepdf is only needed when pages are rendered separately
+    import pikepdf
+    sources = []
+    try:
+        with pikepdf.new() as pdf:
+            for path in paths:
+                source = pikepdf.open(path)
+                sources.append(source)
+                pdf.pages.extend(source.pages)
+            _dedupe_xobjects(pdf)
+            pdf.save(output_path)
+    finally:
+        for source in sources:
+            source.close()
+
+
+def _dedupe_xobjects(pdf: "pikepdf.Pdf"):
+    """Makes the pages (and forms) refer to one copy of each distinct XObject."""
+    unique = {}
+    digests = {}
+    for page in pdf.pages:
+        _dedupe_resources(page.obj, unique, digests)
+
+
+def _dedupe_resources(obj, unique: Dict[str, Any], digests: Dict[Tuple[int, int], str]):
+    resources = obj.get("/Resources")
+    xobjects = resources.get("/XObject") if resources is not None else None
+    if xobjects is None:
+        return
+    for name in list(xobjects.keys()):
+        xobject = xobjects[name]
+        digest = _object_digest(xobject, digests)
+        if digest in unique:
+            xobjects[name] = unique[digest]
+        else:
+            unique[digest] = xobject
+            _dedupe_resources(xobject, unique, digests)
+
+
+def _object_digest(obj, digests: Dict[Tuple[int, int], str]) -> str:
+    """A hash of a PDF object's content (including the objects it refers to)."""
+    import pikepdf
+    objgen = obj.objgen if isinstance(obj, pikepdf.Object) else (0, 0)
+    if objgen != (0, 0) and objgen in digests:
+        return digests[objgen]
+    digest = hashlib.sha256()
+    if isinstance(obj, pikepdf.Stream):
+        digest.update(b"stream:" + obj.read_raw_bytes())
+    if isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+        for key in sorted(obj.keys()):
+            digest.update(f"{key}:{_object_digest(obj[key], digests)};".encode())
+    elif isinstance(obj, pikepdf.Array):
+        for item in obj:
+            digest.update(f"{_object_digest(item, digests)},".encode())
+    else:
+        digest.update(repr(obj).encode())
+    result = digest.hexdigest()
+    if objgen != (0, 0):
+        digests[objgen] = result
+    return result
+
+
+def _hash_value(value):
+    """A value of a drawing command as a deterministic (repr-able) value."""
+    if isinstance(value, TokenImage):
+        return ("image", value.key)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (tuple, list)):
+        return tuple(_hash_value(v) for v in value)
+    return value
+
+
 def reportlab_translation_for_rotation(page_height, object_height, top_left, angle):
     """ This function calculates the translation needed before a reportlab-rotation 
         (which rotates around the bottom left) 
@@ -20,6 +20,6 @@ class SVGPDFWrapper(ConvertCanvasWrapper):
             filelike = io.StringIO(svg)
             drawing = svg2rlg(filelike)
             drawing.renderScale = 2
-            draw_on_pdf_canvas(drawing, page.pdf_canvas, 0, 0)
+            draw_on_pdf_canvas(drawing, rl_canvas.pdf, 0, 0)
         rl_canvas.pdf.save()
 
@@ -5,6 +5,7 @@ from svgwrite import Drawing
 from .canvas import Canvas, CanvasPage
 from tokenpdf.utils.geometry import stroke_dash_array
 from tokenpdf.utils.verbose import vtqdm
+from tokenpdf.utils.timing import stage
 import numpy as np
 import hashlib
 
@@ -16,6 +17,8 @@ class SvgwriteCanvasPage(CanvasPage):
         
         self.images = {}
         self.share_images_between_pages = self.canvas.config.get("share_images_between_pages", False)
+        self.drawn_images = []  # To release once the page is saved
+        self.saved = False
 
     def _find_image(self, md5):
         if not self.share_images_between_pages:
@@ -26,6 +29,7 @@ class SvgwriteCanvasPage(CanvasPage):
         return None
 
     def _image(self, x, y, width, height, image, flip = (False, False), rotate = 0):
+        self.drawn_images.append(image)
         if image.masked:
             image = image.join_mask()
         # We're using specifically a png encoding here
@@ -96,15 +100,33 @@ class SvgwriteCanvas(Canvas):
         return page
     
     
+    def finish_page(self, page: SvgwriteCanvasPage, verbose: bool = False):
+        """Saves a finished page's file, and releases its drawing and images, when streaming pages."""
+        if not self.stream_pages or page.saved:
+            return
+        i = self.pages.index(page)
+        with stage("page", page=i):
+            self._save_page(page, i)
+    
+    def _save_page(self, page: SvgwriteCanvasPage, i: int):
+        page.dwg.saveas(self.page_filename(i), pretty=True)
+        page.dwg = None
+        for image in page.drawn_images:
+            image.release()
+        page.drawn_images = []
+        page.saved = True
+
     def save(self, verbose:bool = False, return_result:bool = False):
         tqdm = vtqdm(verbose)
         results = []
         for i, page in enumerate(tqdm(self.pages, desc="Saving pages")):
-            if return_result:
-                results.append(page.dwg.tostring())
-            else:
-                page.dwg.saveas(self.page_filename(i),
-                                pretty=True)
+            if page.saved:
+                continue
+            with stage("page", page=i):
+                if return_result:
+                    results.append(page.dwg.tostring())
+                else:
+                    self._save_page(page, i)
         self.pages = []
         if return_result:
             return results
@@ -0,0 +1,380 @@
+import http.client
+import importlib
+import importlib.util
+import ipaddress
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import perf_counter, sleep, time
+from typing import Any, Dict, List, Sequence
+from uuid import uuid4
+
+from tokenpdf.utils.rembg import get_session, rembg_installed
+
+logger = logging.getLogger(__name__)
+DEFAULT_WORKERS = 1
+# Jobs waiting for a free worker, beyond those being rendered
+DEFAULT_MAX_QUEUE = 16
+# Finished jobs kept for status requests
+FINISHED_JOBS = 256
+# Imported by the workers before their first job (the pipeline imports its heavy backends on first use),
+# if installed (cv2 and pikepdf are optional)
+WARM_MODULES = ("tokenpdf.pipeline.workflow", "cv2", "pikepdf")
+
+
+class DaemonError(RuntimeError):
+    """Raised when a render daemon rejects a request."""
+
+
+class QueueFullError(DaemonError):
+    """Raised when a job is submitted to a daemon whose queue is full."""
+
+
+class RenderDaemon:
+    """Renders jobs (configuration files) in long-lived worker processes.
+    The workers keep their imports, rembg sessions and decoded images (see resources.source_images)
+    warm between jobs, so a job only pays for its own work. Jobs beyond the workers wait in a
+    bounded queue, and report their output files and stage times.
+
+    Example:
+    >>> with RenderDaemon(workers=2) as daemon:
+    ...     job = daemon.wait(daemon.submit(["campaign.toml"])["id"])
+    >>> job["tasks"][0]["output_file"]
+    'output.pdf'
+
+    Args:
+        workers: The number of worker processes (jobs rendered concurrently).
+        max_queue: The number of jobs waiting for a worker, beyond which jobs are rejected.
+        preload_rembg: Create the rembg session in the workers on start, rather than on first use.
+    """
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE,
+                 preload_rembg: bool = True):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        # Spawned (rather than forked) workers, as the parent may hold threads
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                            initializer=_init_worker, initargs=(preload_rembg,))
+        # Start (and warm up) all the workers now, rather than on the first jobs
+        for _ in range(self.workers):
+            self.executor.submit(_ping)
+        self.jobs: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, config_paths: Sequence[str], output_file: str | None = None,
+               cwd: str | None = None) -> Dict[str, Any]:
+        """Queues a job.
+
+        Args:
+            config_paths: The configuration files of the job.
+            output_file: The output file (overriding the configuration's).
+            cwd: The directory relative paths of the job are relative to (Default: the daemon's).
+
+        Returns:
+            : The job (see status).
+
+        Raises:
+            QueueFullError: If the queue is full.
+        """
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise QueueFullError(f"The queue is full ({self.max_queue} jobs waiting)")
+            self._pending += 1
+            job = {"id": uuid4().hex, "status": "pending", "config": [str(p) for p in config_paths],
+                   "submitted": time()}
+            self.jobs[job["id"]] = job
+        future = self.executor.submit(_run_job, job["config"], output_file, cwd or os.getcwd(),
+                                      job["submitted"])
+        self._futures[job["id"]] = future
+        future.add_done_callback(lambda future: self._finish(job, future))
+        return dict(job)
+
+    def _finish(self, job: Dict[str, Any], future: Future):
+        try:
+            job.update(future.result())
+        except Exception:
+            # The worker itself failed (e.g. it was killed)
+            job.update({"status": "failed", "error": traceback.format_exc(), "tasks": []})
+        with self._lock:
+            self._pending -= 1
+            self._futures.pop(job["id"], None)
+            finished = [job_id for job_id, other in self.jobs.items() if other["status"] != "pending"]
+            for job_id in finished[:-FINISHED_JOBS]:
+                del self.jobs[job_id]
+
+    def status(self, job_id: str) -> Dict[str, Any] | None:
+        """The job's state: its status ("pending", "done" or "failed"), and once finished,
+        the result of each task (output file, time, stage times and error), the time it waited
+        for a worker and its run time, in seconds. None if the job is unknown."""
+        job = self.jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def wait(self, job_id: str, timeout: float | None = None) -> Dict[str, Any] | None:
+        """Waits for a job to finish, and returns its state (see status)."""
+        future = self._futures.get(job_id)
+        if future is not None:
+            try:
+                future.exception(timeout)
+            except Exception:
+                pass
+            # The callback that records the result may still be running
+            while self.jobs.get(job_id, {}).get("status") == "pending" and future.done():
+                sleep(0.01)
+        return self.status(job_id)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """The number of workers, and of pending (queued or rendering) jobs."""
+        return {"workers": self.workers, "max_queue": self.max_queue, "pending": self._pending}
+
+    def close(self):
+        """Stops the workers, after the jobs being rendered (queued jobs are cancelled)."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _init_worker(preload_rembg: bool):
+    for name in WARM_MODULES:
+        if importlib.util.find_spec(name) is not None:
+            importlib.import_module(name)
+    if preload_rembg and rembg_installed():
+        get_session()
+
+
+def _ping():
+    pass
+
+
+def _run_job(config_paths: List[str], output_file: str | None, cwd: str, submitted: float) -> Dict[str, Any]:
+    """Renders a job in a worker, running its configuration tasks one after another."""
+    start = perf_counter()
+    queue_time = time() - submitted
+    # A worker renders one job at a time
+    os.chdir(cwd)
+    from tokenpdf.pipeline.workflow import WorkflowManager
+    try:
+        workflow = WorkflowManager(*config_paths, output_file=output_file, verbose=False)
+    except Exception:
+        return {"status": "failed", "error": traceback.format_exc(), "tasks": [],
+                "queue_time": queue_time, "time": perf_counter() - start}
+    tasks = []
+    for config in workflow.config_tasks:
+        result = workflow.run_task(config, isolate_errors=True)
+        tasks.append({"label": result.label, "output_file": result.output_file, "time": result.time,
+                      "stages": {path: seconds for path, seconds in result.stages.items() if "/" not in path},
+                      "error": result.error})
+    failed = any(task["error"] is not None for task in tasks)
+    return {"status": "failed" if failed else "done", "tasks": tasks,
+            "queue_time": queue_time, "time": perf_counter() - start}
+
+
+class _JobHandler(BaseHTTPRequestHandler):
+    """The job API of a render daemon:
+    POST /jobs queues a job ({"config": [paths], "output": path, "cwd": path, "wait": bool}),
+    GET /jobs/<id> returns a job's state, and GET /status the daemon's."""
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            config_paths = request["config"]
+            if isinstance(config_paths, str):
+                config_paths = [config_paths]
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, {"error": f"Invalid job request: {e}"})
+        daemon: RenderDaemon = self.server.render_daemon
+        try:
+            job = daemon.submit(config_paths, request.get("output"), request.get("cwd"))
+        except QueueFullError as e:
+            return self._reply(503, {"error": str(e)})
+        if not request.get("wait", True):
+            return self._reply(202, job)
+        self._reply(200, daemon.wait(job["id"]))
+
+    def do_GET(self):
+        daemon: RenderDaemon = self.server.render_daemon
+        path = self.path.rstrip("/")
+        if path == "/status":
+            return self._reply(200, daemon.stats)
+        if path.startswith("/jobs/"):
+            job = daemon.status(path[len("/jobs/"):])
+            if job is not None:
+                return self._reply(200, job)
+        self._reply(404, {"error": f"Unknown path {self.path}"})
+
+    def _reply(self, code: int, data: Dict[str, Any]):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "local"
+
+    def log_message(self, format: str, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(daemon: RenderDaemon | None, address: str, allow_remote: bool = False) -> socketserver.BaseServer:
+    """A server of the job API of the daemon (see _JobHandler).
+    The API reads and writes any file the daemon can, so it is local by default:
+    TCP addresses must be loopback addresses, and Unix sockets are only accessible to their owner.
+
+    Args:
+        daemon: The daemon running the jobs (or None, to set render_daemon later).
+        address: "host:port" for HTTP over TCP, or the path of a Unix socket.
+        allow_remote: Allow TCP addresses that aren't loopback addresses.
+
+    Returns:
+        : The server (see serve_forever).
+
+    Raises:
+        DaemonError: If the address isn't local, and allow_remote is False.
+    """
+    if _is_tcp(address):
+        host, port = address.rsplit(":", 1)
+        host = host or "localhost"
+        if not allow_remote and not _is_loopback(host):
+            raise DaemonError(f"Refusing to serve on {host}, which is not a loopback address "
+                              "(the job API has no authentication). Allow it explicitly to serve remote clients.")
+        server = ThreadingHTTPServer((host, int(port)), _JobHandler)
+    else:
+        path = Path(address)
+        if path.is_socket():
+            # Left over by a previous daemon
+            path.unlink()
+        # Created accessible to the owner only (the mode is set from the umask on bind)
+        umask = os.umask(0o177)
+        try:
+            server = _UnixHTTPServer(str(path), _JobHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+    server.render_daemon = daemon
+    return server
+
+
+def _is_loopback(host: str) -> bool:
+    """True if every address the host resolves to is a loopback address."""
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return bool(infos) and all(ipaddress.ip_address(info[4][0].split("%")[0]).is_loopback for info in infos)
+
+
+def serve(address: str, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE,
+          verbose: bool = False, allow_remote: bool = False):
+    """Runs a render daemon, serving its job API on the address until interrupted.
+
+    Args:
+        address: "host:port" for HTTP over TCP, or the path of a Unix socket.
+        workers: The number of worker processes.
+        max_queue: The number of jobs waiting for a worker, beyond which jobs are rejected.
+        verbose: Log the requests.
+        allow_remote: Allow TCP addresses that aren't loopback addresses (see make_server).
+    """
+    if verbose:
+        logging.basicConfig(level=logging.INFO)
+    if threading.current_thread() is threading.main_thread():
+        # Stop as on Ctrl+C when terminated (e.g. by a service manager)
+        signal.signal(signal.SIGTERM, _interrupt)
+    # The server is bound first, so a rejected address doesn't start (and warm) the workers
+    with make_server(None, address, allow_remote) as server, RenderDaemon(workers, max_queue) as daemon:
+        server.render_daemon = daemon
+        logger.info(f"Serving render jobs on {address} with {daemon.workers} workers")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if not _is_tcp(address):
+                Path(address).unlink(missing_ok=True)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def submit_job(address: str, config_paths: Sequence[str], output_file: str | None = None,
+               wait: bool = True, timeout: float | None = None) -> Dict[str, Any]:
+    """Submits a job to a render daemon. Relative paths are relative to the current directory.
+
+    Args:
+        address: The daemon's address (see make_server).
+        config_paths: The configuration files of the job.
+        output_file: The output file (overriding the configuration's).
+        wait: Wait for the job to finish.
+        timeout: The timeout of the request, in seconds.
+
+    Returns:
+        : The job's state (see RenderDaemon.status).
+
+    Raises:
+        QueueFullError: If the daemon's queue is full.
+        DaemonError: If the daemon rejected the job.
+    """
+    request = {"config": [str(Path(p).resolve()) for p in config_paths],
+               "output": str(Path(output_file).resolve()) if output_file else None,
+               "cwd": os.getcwd(), "wait": wait}
+    connection = _connection(address, timeout)
+    try:
+        connection.request("POST", "/jobs", json.dumps(request), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        data = json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+    if response.status == 503:
+        raise QueueFullError(data.get("error", "The queue is full"))
+    if response.status >= 400:
+        raise DaemonError(data.get("error", f"Request failed with status {response.status}"))
+    return data
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _connection(address: str, timeout: float | None) -> http.client.HTTPConnection:
+    if _is_tcp(address):
+        host, port = address.rsplit(":", 1)
+        return http.client.HTTPConnection(host or "localhost", int(port), timeout=timeout)
+    return _UnixHTTPConnection(address, timeout)
+
+
+def _is_tcp(address: str) -> bool:
+    """Addresses are "host:port" (or ":port"), other addresses are Unix socket paths."""
+    host, _, port = address.rpartition(":")
+    return port.isdigit() and "/" not in host
@@ -1,4 +1,4 @@
-from .image_filter import ImageFilter, apply_imagefilters
+from .image_filter import ImageFilter, apply_imagefilters, apply_imagefilters_batch
 from .foreground import ZoomToROI, ForegroundFilter
 
-__all__ = ["ImageFilter", "apply_imagefilters", "ZoomToROI", "ForegroundFilter"]
\ No newline at end of file
+__all__ = ["ImageFilter", "apply_imagefilters", "apply_imagefilters_batch", "ZoomToROI", "ForegroundFilter"]
\ No newline at end of file
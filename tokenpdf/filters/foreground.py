@@ -1,15 +1,23 @@
 from typing import Tuple
 import numpy as np
-import cv2
 from .image_filter import ImageFilter
+from tokenpdf.utils.rembg import DEFAULT_BATCH_SIZE
 
-class ZoomToROI(ImageFilter, name="zoom"):
+class _ForegroundBatchMixin:
+    """ Computes the foregrounds of all prepared images together, batching background removal """
+    def prepare(self, images):
+        # Imported here, as tokenpdf.image depends on the filters
+        from tokenpdf.image import prepare_foregrounds
+        loader_config = getattr(self.loader, "config", {})
+        batch_size = self.config.get("batch_size", loader_config.get("rembg_batch_size", DEFAULT_BATCH_SIZE))
+        prepare_foregrounds(images, batch_size)
+
+class ZoomToROI(_ForegroundBatchMixin, ImageFilter, name="zoom"):
     def filter(self, image):
         return image.crop_foreground_roi(zoom=True)
 
-class ForegroundFilter(ImageFilter, name="foreground"):
+class ForegroundFilter(_ForegroundBatchMixin, ImageFilter, name="foreground"):
     def filter(self, image):
-        mask = image.foreground.as_array()
-        return image.add_mask(mask).join_mask()
+        return image.add_mask(image.foreground).join_mask()
     
 
@@ -1,5 +1,5 @@
 from tokenpdf.utils.verbose import vprint
-from typing import Sequence, Dict
+from typing import Sequence, Dict, List
 
 class ImageFilterRegistry:
     def __init__(self):
@@ -31,6 +31,11 @@ class ImageFilter:
     def filter(self, image):
         raise NotImplementedError("Subclasses must implement this method")
 
+    def prepare(self, images):
+        """Called with all the images about to be filtered together,
+        before filtering them (e.g. to batch expensive computations). Optional."""
+        pass
+
 
     @classmethod
     def __init_subclass__(cls, name=None, **kwargs):
@@ -39,13 +44,27 @@ class ImageFilter:
             name = cls.__name__
         ImageFilter.IMAGE_FILTER_REGISTRY.register(name, cls)
 
-def apply_imagefilters(image, filters:Sequence[str]|Dict[str, Dict], loader):
+def make_imagefilters(filters:Sequence[str]|Dict[str, Dict], loader) -> List[ImageFilter]:
     if isinstance(filters, tuple|list):
         filters = {f: {} for f in filters}
+    result = []
     for name, config in filters.items():
         filter_cls = ImageFilter.IMAGE_FILTER_REGISTRY.get(name)
         if filter_cls is None:
             raise ValueError(f"Unknown filter: {name}")
-        filter = filter_cls(config, loader)
+        result.append(filter_cls(config, loader))
+    return result
+
+def apply_imagefilters(image, filters:Sequence[str]|Dict[str, Dict], loader):
+    for filter in make_imagefilters(filters, loader):
         image = filter.filter(image)
-    return image
\ No newline at end of file
+    return image
+
+def apply_imagefilters_batch(images, filters:Sequence[str]|Dict[str, Dict], loader) -> List:
+    """Applies the filters to several images, letting each filter prepare
+    all the images before filtering them (e.g. to batch background removal)."""
+    images = list(images)
+    for filter in make_imagefilters(filters, loader):
+        filter.prepare(images)
+        images = [filter.filter(image) for image in images]
+    return images
\ No newline at end of file
@@ -2,9 +2,13 @@ from __future__ import annotations
 from pathlib import Path
 import PIL.ImageFilter
 from PIL import Image
-import csv
+import hashlib
+import json
+import weakref
 import tempfile
 from typing import Sequence, Tuple, Dict, Callable
+from collections import namedtuple
+from functools import lru_cache
 from uuid import uuid4
 import imagesize
 import numpy as np
@@ -13,144 +17,93 @@ import PIL.Image
 import logging
 import base64
 from platformdirs import user_cache_dir
-from wrapt import synchronized
-from tokenpdf.utils.io import download_file
-from tokenpdf.utils.image import join_mask_channel, find_background, mask_to_roi, force_roi_aspect_ratio
+from tokenpdf.utils.io import download_file, download
+from tokenpdf.utils.cache import PersistentCache, MemoryLRU, file_digest
+from tokenpdf.utils.image import join_mask_channel, find_background, find_background_batch, mask_to_roi, \
+    force_roi_aspect_ratio, default_background_method
+from tokenpdf.utils.rembg import DEFAULT_BATCH_SIZE
 from tokenpdf.filters import apply_imagefilters
 
 
 logger = logging.getLogger(__name__)
 PossibleSource = str | Path | PIL.Image.Image | np.ndarray
 
-IMAGE_CACHE = user_cache_dir("tokenpdf", "imaged2")
+IMAGE_CACHE = Path(user_cache_dir("tokenpdf")) / "images"
+DERIVED_CACHE = Path(user_cache_dir("tokenpdf")) / "derived"
 ENABLE_MAIN_IMAGE_CACHE = True
+ENABLE_DERIVED_CACHE = True
+DERIVED_MEMORY_ITEMS = 64
+# Bump when a derivation changes, to invalidate derived images stored by older versions
+DERIVED_KEY_VERSION = 1
 RESIZE_ALG = PIL.Image.Resampling.LANCZOS
 
-class ImagePersistentCache:
-    def __init__(self, folder: Path = IMAGE_CACHE, enabled:bool=False):
-        self.folder = Path(folder)
-        self.folder.mkdir(parents=True, exist_ok=True)
-        self.index = {}
-        self.enabled = False
-        if enabled:
-            self.enable()
-
-
-    def enable(self):
-        self.enabled = True
-        self.load_index()
-    def disable(self):
-        self.enabled = False
-
-    def get(self, key: str) -> FloatingImage:
-        if not self.enabled:
-            raise KeyError("Cache is disabled.")
-        if key not in self.index:
-            raise KeyError(f"Key {key} not found in cache.")
-        return FloatingImage(self.folder / self.index[key])
-    
-    def has(self, key: str) -> bool:
-        if not (self.enabled) or (key not in self.index):
-            return False
-        exists = (self.folder / self.index[key]).exists()
-        if not exists:
-            # Shouldn't get here normally
-            # unless manually deleted
-            self._remove(key)
-        return exists
-        
-        
-    @synchronized
-    def _remove(self, key: str):
-        if not self.enabled:
-            return
-        if key in self.index:
-            path = self.folder / self.index[key]
-            if path.exists():
-                path.unlink()
-            del self.index[key]
-            self.save_index()
-    
-    @synchronized
-    def new(self, key: str, default_suffix=".png") -> Path:
-        if not self.enabled:
-            raise KeyError("Cache is disabled.")
-        if key in self.index and (self.folder / self.index[key]).exists():
-            return self.folder / self.index[key]
-        file_path = self.folder / f"{uuid4().hex[:8]}{default_suffix}"
-        self.index[key] = file_path.name
-        return file_path
-    
-    @synchronized
-    def update_suffix(self, key: str, new_suffix: str):
-        if not self.enabled or key not in self.index:
-            return
-        path = Path(self.index[key])
-        new_path = path.with_suffix(new_suffix)
-        if path.exists():
-            path.rename(new_path)
-        self.index[key] = new_path.name
-        self.save_index()
-
-    @synchronized
-    def clear(self, key: str = None, update_index=True):
-        if not self.enabled:
-            return
-        if key and key in self.index:
-            path = Path(self.index[key])
-            if path.exists():
-                path.unlink()
-            del self.index[key]
-        elif not key:
-            for k in list(self.index.keys()):
-                self.clear(k, update_index=False)
-        if update_index:
-            self.save_index()
-
-    @synchronized
-    def _get_index(self)->Dict[str, str]:
-        return self.index.copy()
-    
-    def save_index(self):
-        index = self._get_index()
-        index_path = self.folder / "index.csv"
-        with open(index_path, "w") as f:
-            writer = csv.writer(f)
-            for key, value in index.items():
-                writer.writerow([key, value])
-
-    def __getitem__(self, key: str) -> FloatingImage:
-        return self.get(key)
-
-
-    @synchronized
-    def load_index(self):
-        logger.info(f"Loading image cache index from {self.folder}")
-        index_path = self.folder / "index.csv"
-        if index_path.exists():
-            with open(index_path, "r") as f:
-                reader = csv.reader(f)
-                for row in reader:
-                    if len(row) >= 2:
-                        self.index[row[0]] = row[1]
-        self.resolve_references()
-
-    @synchronized
-    def resolve_references(self):
-        while self._resolve_references_step():
-            pass
-
-    def _resolve_references_step(self):
-        changed = False
-        for key, value in self.index.items():
-            if (('/' in value or '\\' in value or value.startswith("*"))
-                and value in self.index):
-                # This is a reference to another temporary file
-                self.index[key] = self.index[value]
-                changed = True
-        return changed
-                
+class ImagePersistentCache(PersistentCache):
+    """
+    The persistent cache of downloaded images.
+    Images are stored once per content (even if downloaded from several URLs),
+    and are revalidated with conditional requests on later runs.
+    """
+
+    def download(self, url: str, default_suffix: str = ".png") -> Path:
+        """
+        Get a local copy of the URL's image, downloading it only if the cached copy
+        is missing or out of date.
+        """
+        entry = self.entry(url, count=False)
+        # Deterministic name, so an interrupted download can be resumed
+        temp_path = self.temp_path(default_suffix, name=hashlib.sha1(url.encode()).hexdigest())
+        result = download(url, temp_path, allow_rename=True,
+                          etag=entry.etag if entry else None,
+                          last_modified=entry.last_modified if entry else None)
+        # Counted under the lock, as images are downloaded in several threads (see ResourceLoader)
+        if result.not_modified:
+            with self._lock:
+                self.hits += 1
+            return entry.path
+        with self._lock:
+            self.misses += 1
+        return self.put(url, result.path, result.etag, result.last_modified)
+
+
 main_image_cache = ImagePersistentCache(folder=IMAGE_CACHE, enabled=ENABLE_MAIN_IMAGE_CACHE)
+# Derived images (foregrounds, joined masks, resizes), by derived key
+main_derived_cache = PersistentCache(folder=DERIVED_CACHE, enabled=ENABLE_DERIVED_CACHE)
+derived_images = MemoryLRU(DERIVED_MEMORY_ITEMS)
+# Derived images still referenced elsewhere, so they are reused even when evicted from derived_images
+_live_derived_images = weakref.WeakValueDictionary()
+
+LazySource = namedtuple("LazySource", ["compute", "args", "dims", "persist"])
+# Image files written to the temporary folder (encoded from pixels in memory),
+# and image files decoded (opened as PIL images)
+image_stats = {"temp_files_written": 0, "decoded": 0, "decoded_bytes": 0}
+
+
+def derive_key(parent: str, op: str, *params) -> str:
+    """
+    The key of the image derived from the image with the parent key, by the operation
+    op with the given parameters. Chaining keys identifies a derived image by
+    (source content, operation chain, parameters), without computing it.
+    """
+    data = json.dumps([DERIVED_KEY_VERSION, parent, op, params], default=_jsonable)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def _jsonable(obj):
+    return obj.tolist() if hasattr(obj, "tolist") else str(obj)
+
+def _hash_key(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else repr(part).encode())
+    return h.hexdigest()
+
+def _count_decoded(image: PIL.Image.Image):
+    image_stats["decoded"] += 1
+    image_stats["decoded_bytes"] += image.width * image.height * len(image.getbands())
+
+@lru_cache(maxsize=1024)
+def _file_key(path: Path, mtime_ns: int, size: int) -> str:
+    """ Content key of a file, memoized per file version """
+    return file_digest(path)
     
 
 class FloatingImage:
@@ -159,13 +112,128 @@ class FloatingImage:
     (URL, path, memory) or formats, depending on need.
     """
 
-    def __init__(self, *sources: Sequence[PossibleSource], default_suffix=".png", **kw):
+    def __init__(self, *sources: Sequence[PossibleSource], default_suffix=".png", key: str | None = None, **kw):
         self._sources = {}
         self._default_suffix = default_suffix
         self._save_kw = kw
         self._temp_sources = []
+        self._key = key
+        # The lazy source of a computed image, to compute it again after it is released
+        self._recompute = None
         for source in sources:
             self.add_source(source)
+
+    @classmethod
+    def derived(cls, key: str, compute: Callable[..., PIL.Image.Image], args: Tuple = (),
+                dims: Tuple[int, int] | None = None, persist: bool = False,
+                default_suffix=".png", **kw) -> FloatingImage:
+        """
+        A lazily computed image, derived from other images.
+        The image is only computed when needed, and is memoized by its key in memory
+        and, if persist is True, in the derived image cache on disk, so later runs
+        load it instead of computing it.
+
+        Args:
+            key: The derived key of the image (see derive_key).
+            compute: A function computing the image from args.
+                     A module-level function, so lazy images can be sent to other processes.
+            args: The arguments of compute (typically the source images).
+            dims: The dimensions of the image, if known without computing it.
+            persist: Keep the computed image in the derived image cache.
+        """
+        image = derived_images.get(key)
+        if image is None:
+            image = _live_derived_images.get(key)
+        if image is None:
+            image = cls(default_suffix=default_suffix, key=key, **kw)
+            image._sources["lazy"] = LazySource(compute, args, dims, persist)
+            _live_derived_images[key] = image
+        derived_images[key] = image
+        return image
+
+    @property
+    def key(self) -> str:
+        """
+        A key identifying the image's content. A hash of the content for source images,
+        and a chain of the source's key and the applied operations for derived images.
+        """
+        if self._key is None:
+            self._key = self._content_key()
+        return self._key
+
+    def _content_key(self) -> str:
+        if not self._has_path():
+            if "image" in self._sources:
+                image = self._sources["image"]
+                return _hash_key(image.mode, image.size, image.tobytes())
+            elif "array" in self._sources:
+                array = self._sources["array"]
+                return _hash_key(str(array.dtype), array.shape, np.ascontiguousarray(array).tobytes())
+        # Files (including downloaded ones) are keyed by their content hash
+        path = Path(self.as_path())
+        stat = path.stat()
+        return _file_key(path, stat.st_mtime_ns, stat.st_size)
+
+    @property
+    def needs_compute(self) -> bool:
+        """
+        True if the image is lazy, and is not in the derived image cache.
+        """
+        lazy = self._sources.get("lazy")
+        if lazy is None:
+            return False
+        return not (lazy.persist and main_derived_cache.enabled and main_derived_cache.has(self._key))
+
+    @property
+    def in_memory(self) -> bool:
+        """
+        True if the image's pixels are in memory, or are computed rather than read from a file.
+        """
+        return "image" in self._sources or "array" in self._sources or self.needs_compute
+
+    def _resolve(self):
+        """ Computes a lazy image, or loads it from the derived image cache """
+        lazy = self._sources.get("lazy")
+        if lazy is None:
+            return
+        if lazy.persist and main_derived_cache.enabled:
+            entry = main_derived_cache.entry(self._key)
+            if entry is not None:
+                self._set_cached(entry.path)
+                return
+        self._set_computed(lazy.compute(*lazy.args))
+
+    def _set_cached(self, path: Path):
+        """ Sets the result of a lazy image, stored in the derived image cache """
+        lazy = self._sources.pop("lazy", None)
+        self._sources["perm_path"] = Path(path)
+        if lazy is not None:
+            # Computed again if evicted (see _restore_evicted)
+            self._recompute = lazy
+
+    def _restore_evicted(self) -> bool:
+        """ Makes the image lazy again if its result was evicted from the derived image cache.
+        Returns True if it was """
+        path = self._sources.get("perm_path")
+        if self._recompute is None or path is None or Path(path).exists() or "image" in self._sources:
+            return False
+        del self._sources["perm_path"]
+        self._sources["lazy"] = self._recompute
+        return True
+
+    def _set_computed(self, image: PIL.Image.Image):
+        """ Sets the result of a lazy image (computed here, or elsewhere in a batch) """
+        lazy = self._sources.pop("lazy", None)
+        if image.mode not in ("RGB", "RGBA", "L"):
+            # As it would read back from a file (see as_pil)
+            image = image.convert("RGBA")
+        self._sources["image"] = image
+        self._recompute = lazy
+        if lazy is not None and lazy.persist and main_derived_cache.enabled:
+            path = main_derived_cache.temp_path(".png")
+            # Derived images are stored lossless, regardless of the source format
+            image.save(path, format="PNG", compress_level=1)
+            self._sources["perm_path"] = main_derived_cache.put(self._key, path)
     
 
     def add_source(self, source: PossibleSource):
@@ -188,12 +256,14 @@ class FloatingImage:
         """
         Get the image as a PIL image.
         """
+        self._resolve()
         if "image" in self._sources:
             return self._sources["image"]
         elif "array" in self._sources:
             return PIL.Image.fromarray(self._sources["array"])
         else:
             self._sources["image"] = (image := PIL.Image.open(self.as_path()))
+            _count_decoded(image)
             if image.mode not in ("RGB", "RGBA", "L"):
                 self._sources["image"] = (image := image.convert("RGBA"))
 
@@ -204,6 +274,7 @@ class FloatingImage:
         """
         Get the image as a path, downloading or writing to disk if necessary.
         """
+        self._resolve()
         if "perm_path" in self._sources:
             return self._sources["perm_path"]
         elif "temp_path" in self._sources:
@@ -217,30 +288,40 @@ class FloatingImage:
         else:
             raise ValueError("No valid source found.")
     
+    @property
+    def needs_download(self) -> bool:
+        """
+        True if the image is only available remotely, and has not been downloaded yet.
+        """
+        return ("url" in self._sources and "temp_path" not in self._sources
+                and not any(s in self._sources for s in ("perm_path", "image", "array")))
+
+    def prefetch(self) -> FloatingImage:
+        """
+        Download the image (if remote) ahead of use.
+        """
+        if self.needs_download:
+            self.as_path()
+        return self
+
     def _download_to_temporary(self, url: str):
-        temp_path = self._get_temp_path(url)
-        actual_path = download_file(url, temp_path, allow_rename=True)
-        if actual_path.suffix != temp_path.suffix and main_image_cache.enabled:
-            main_image_cache.update_suffix(url, actual_path.suffix)
-        return actual_path
+        if main_image_cache.enabled:
+            return main_image_cache.download(url, self._default_suffix)
+        temp_path = self._get_temp_path()
+        return download_file(url, temp_path, allow_rename=True)
             
     def flip(self, horz: bool = False, vert: bool = False) -> FloatingImage:
         if not horz and not vert:
             return self
-        img = self.as_pil()
-        if horz:
-            img = img.transpose(PIL.Image.FLIP_LEFT_RIGHT)
-        if vert:
-            img = img.transpose(PIL.Image.FLIP_TOP_BOTTOM)
-        return FloatingImage(img, default_suffix=self._default_suffix, **self._save_kw)
+        return FloatingImage.derived(derive_key(self.key, "flip", bool(horz), bool(vert)),
+                                     _flip, (self, bool(horz), bool(vert)),
+                                     dims=self.dims, default_suffix=self._default_suffix, **self._save_kw)
 
     def rotate(self, angle: float) -> FloatingImage:
         if angle == 0:
             return self
-        return FloatingImage(self.as_pil().rotate(angle*np.pi/180, 
-                                                  resample=RESIZE_ALG, expand=True),
-                                                  default_suffix=self._default_suffix, 
-                                                  **self._save_kw)
+        return FloatingImage.derived(derive_key(self.key, "rotate", angle), _rotate, (self, angle),
+                                     default_suffix=self._default_suffix, **self._save_kw)
 
     def as_array(self) -> np.ndarray:
         """
@@ -264,6 +345,23 @@ class FloatingImage:
             del self._sources[source]
         self._temp_sources = []
 
+    def release(self):
+        """
+        Drop the image's pixels from memory (and those of the images it was computed from),
+        if they can be read again from a file, or computed again.
+        Object can still be used after this.
+        """
+        if self._recompute is not None:
+            # Lazy again: read from the derived image cache if still stored there, computed again if evicted
+            self._sources.pop("image", None)
+            self._sources.pop("perm_path", None)
+            self._sources["lazy"] = self._recompute
+            for arg in self._recompute.args:
+                if isinstance(arg, (FloatingImage, FloatingImageWithROI, TokenImage)):
+                    arg.release()
+        elif "image" in self._sources and self._has_path():
+            del self._sources["image"]
+
     def crop(self, roi: Tuple[int, int, int, int], zoom:bool=False) -> "FloatingImageWithROI" | "FloatingImage":
         """
         Return a FloatingImage representing the cropped area
@@ -276,19 +374,20 @@ class FloatingImage:
     
     @property
     def dims(self) -> Tuple[int, int]:
+        lazy = self._sources.get("lazy")
+        if lazy is not None and lazy.dims is not None:
+            return lazy.dims
+        self._resolve()
         if "image" in self._sources:
             return self._sources["image"].size
         elif "array" in self._sources:
-            return self._sources["array"].shape[:2]
+            return self._sources["array"].shape[1::-1]
         else:
             return imagesize.get(self.as_path())
 
-    def _get_temp_path(self, url: str|Path|None = None, suffix = None) -> Path:
+    def _get_temp_path(self, suffix = None) -> Path:
         if suffix is None:
             suffix = self._default_suffix
-        if url and main_image_cache.enabled:
-            return main_image_cache.new(url, suffix)
-        
         folder = Path(tempfile.gettempdir())
         path = folder / f"fi_{uuid4().hex[:8]}{suffix}"
         return path
@@ -299,9 +398,11 @@ class FloatingImage:
                 scale_y = scale_x
             if scale_y==1 and scale_x==1:
                 return self
-            size = np.round(np.array(self.dims()) * np.array([scale_x, scale_y])).astype(int)
-
-        return FloatingImage(self.as_pil().resize(size, resample=RESIZE_ALG), default_suffix=self._default_suffix, **self._save_kw) 
+            size = np.round(np.array(self.dims) * np.array([scale_x, scale_y])).astype(int)
+        size = tuple(int(v) for v in size)
+        return FloatingImage.derived(derive_key(self.key, "resize", size), _resize, (self, size),
+                                     dims=size, persist=True,
+                                     default_suffix=self._default_suffix, **self._save_kw)
     
     
     def _has_path(self) -> bool:
@@ -322,12 +423,13 @@ class FloatingImage:
     def as_png(self) -> Path:
         return self.as_specific_image_format(".png")
         
-    def _save(self, source, url:str = None, format:str = None):
+    def _save(self, source, format:str = None):
         if format is None:
             format = self._default_suffix
-        path = self._get_temp_path(url=url, suffix=format)
+        path = self._get_temp_path(suffix=format)
         self._temp_sources.append(source)
         self.as_pil().save(path, **self._save_kw)
+        image_stats["temp_files_written"] += 1
         self._sources[source] = path
 
 
@@ -346,6 +448,7 @@ class FloatingImageWithROI:
             return self._sources["cropped_image"]
         elif "cropped_path" in self._sources:
             self._sources["cropped_image"] = (cimage := PIL.Image.open(self._sources["cropped_path"]))
+            _count_decoded(cimage)
             return cimage
             
         else:
@@ -363,16 +466,33 @@ class FloatingImageWithROI:
             self._sources["cropped_path"] = self._img._get_temp_path()
             
             self._sources["cropped_image"].save(self._sources["cropped_path"])
+            image_stats["temp_files_written"] += 1
             return self._sources["cropped_path"]
         else:
             cropped = self.as_pil()
             self._sources["cropped_path"] = self._img._get_temp_path()
             
             cropped.save(self._sources["cropped_path"], **self._img._save_kw)
+            image_stats["temp_files_written"] += 1
             return self._sources["cropped_path"]
+
+    @property
+    def in_memory(self) -> bool:
+        return "cropped_path" not in self._sources
         
     def as_floating_image(self) -> FloatingImage:
-        return FloatingImage(self.as_pil(), default_suffix=self._img._default_suffix, **self._img._save_kw)
+        return FloatingImage(self.as_pil(), default_suffix=self._img._default_suffix, key=self.key,
+                             **self._img._save_kw)
+
+    @property
+    def key(self) -> str:
+        return derive_key(self._img.key, "crop", self._roi)
+
+    def release(self):
+        """
+        Drop the cropped pixels from memory (the image they are cropped from is kept).
+        """
+        self._sources.pop("cropped_image", None)
        
     def cleanup(self):
         self._img.cleanup()
@@ -394,7 +514,14 @@ class FloatingImageWithROI:
     def resize(self, size: Tuple[int, int] = None, scale_x: float = None, scale_y : float = None) -> FloatingImage:
         if scale_x != None and (scale_x == 1 and scale_y == 1):
             return self
-        return self.as_floating_image().resize(size, scale_x, scale_y)
+        if size is None:
+            if scale_y is None:
+                scale_y = scale_x
+            size = np.round(np.array(self.dims) * np.array([scale_x, scale_y])).astype(int)
+        size = tuple(int(v) for v in size)
+        return FloatingImage.derived(derive_key(self.key, "resize", size), _resize, (self, size),
+                                     dims=size, persist=True,
+                                     default_suffix=self._img._default_suffix, **self._img._save_kw)
     
     def flip(self, horz: bool = False, vert: bool = False) -> FloatingImage:
         return self.as_floating_image().flip(horz, vert)
@@ -409,6 +536,60 @@ class FloatingImageWithROI:
     def as_png(self) -> Path:
         return self.as_floating_image().as_png()
 
+# Computations of lazy images (module-level, so lazy images can be pickled)
+
+def _flip(image: FloatingImage, horz: bool, vert: bool) -> PIL.Image.Image:
+    img = image.as_pil()
+    if horz:
+        img = img.transpose(PIL.Image.FLIP_LEFT_RIGHT)
+    if vert:
+        img = img.transpose(PIL.Image.FLIP_TOP_BOTTOM)
+    return img
+
+def _rotate(image: FloatingImage, angle: float) -> PIL.Image.Image:
+    return image.as_pil().rotate(angle*np.pi/180, resample=RESIZE_ALG, expand=True)
+
+def _resize(image: FloatingImage | FloatingImageWithROI, size: Tuple[int, int]) -> PIL.Image.Image:
+    return image.as_pil().resize(size, resample=RESIZE_ALG)
+
+def _foreground(source: TokenImage) -> PIL.Image.Image:
+    return _background_to_foreground(find_background(source.array))
+
+def _join_mask(image: TokenImage, blend: bool, allow_resize: bool) -> PIL.Image.Image:
+    # putalpha works in place, so join to a copy to keep the source image intact
+    return join_mask_channel(image.image.copy(), image.mask_array, blend, allow_resize)
+
+def _background_to_foreground(background: np.ndarray) -> PIL.Image.Image:
+    foreground = PIL.Image.fromarray(np.logical_not(background)).filter(PIL.ImageFilter.ModeFilter(13))
+    # As "L" rather than "1", so it reads back the same from the cache
+    return foreground.convert("L")
+
+def prepare_foregrounds(images: Sequence[TokenImage], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Computes the foregrounds of several images ahead of use, finding their backgrounds
+    in batches. Foregrounds already computed (or in the derived image cache) are skipped.
+
+    Args:
+        images: The images.
+        batch_size: The number of images per background removal batch.
+
+    Returns:
+        : The number of foregrounds computed.
+    """
+    pending = {}
+    for image in images:
+        foreground = image.foreground
+        if foreground.needs_compute:
+            pending.setdefault(foreground.key, (image, foreground))
+    pending = list(pending.values())
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        backgrounds = find_background_batch([image.join_mask().array for image, _ in batch],
+                                            batch_size=batch_size)
+        for (_, foreground), background in zip(batch, backgrounds):
+            foreground._set_computed(_background_to_foreground(background))
+    return len(pending)
+
 def to_floating_image(source: PossibleSource | None, default_suffix=None, **save_kw)->FloatingImage|None:
     if isinstance(source, (FloatingImage, FloatingImageWithROI)):
         return source
@@ -445,11 +626,43 @@ class TokenImage:
     @property
     def dims(self) -> Tuple[int, int]:
         return self._img.dims
+
+    @property
+    def key(self) -> str:
+        """
+        A key identifying the image's content, and its mask's content (if any).
+        """
+        if not self.masked:
+            return self._img.key
+        return derive_key(self._img.key, "add_mask", self._mask.key)
+
+    @property
+    def needs_download(self) -> bool:
+        return (self._img.needs_download if isinstance(self._img, FloatingImage) else False) or \
+               (self._mask.needs_download if isinstance(self._mask, FloatingImage) else False)
+
+    def prefetch(self) -> TokenImage:
+        """
+        Download the remote sources of the image (and mask) ahead of use.
+        """
+        for fimage in (self._img, self._mask):
+            if isinstance(fimage, FloatingImage):
+                fimage.prefetch()
+        return self
     
     def cleanup(self):
         self._img.cleanup()
         if self._mask:
             self._mask.cleanup()
+
+    def release(self):
+        """
+        Drop the pixels of the image and its mask from memory, where they can be read
+        again from a file, or computed again (see FloatingImage.release).
+        """
+        for fimage in (self._img, self._mask, self._gray, self._foreground):
+            if fimage is not None:
+                fimage.release()
     
     def add_mask(self, mask: FloatingImage|PossibleSource) -> TokenImage:
         image = self
@@ -469,6 +682,13 @@ class TokenImage:
     def array(self) -> np.ndarray:
         return self._img.as_array()
     
+    @property
+    def in_memory(self) -> bool:
+        """
+        True if the image's pixels are in memory (or computed), rather than only in a file.
+        """
+        return self._img.in_memory
+
     @property
     def mask(self) -> PIL.Image.Image:
         return self._mask.as_pil() if self._mask else None
@@ -521,10 +741,10 @@ class TokenImage:
     @property
     def foreground(self) -> FloatingImage | FloatingImageWithROI:
         if self._foreground is None:
-            arr = find_background(self.join_mask().array)
-            foreground = FloatingImage(np.logical_not(arr), default_suffix=self._default_suffix, **self._save_kw)
-            foreground = foreground.as_pil().filter(PIL.ImageFilter.ModeFilter(13))
-            self._foreground = FloatingImage(foreground, default_suffix=self._default_suffix, **self._save_kw)
+            source = self.join_mask()
+            key = derive_key(source.key, "foreground", default_background_method(), 13)
+            self._foreground = FloatingImage.derived(key, _foreground, (source,), dims=self.dims, persist=True,
+                                                     default_suffix=self._default_suffix, **self._save_kw)
         return self._foreground
     
     @property
@@ -555,7 +775,10 @@ class TokenImage:
     def join_mask(self, blend:bool=True, allow_resize:bool=True) -> TokenImage:
         if not self.masked:
             return self
-        image = join_mask_channel(self.image, self.mask_array, blend, allow_resize)
+        image = FloatingImage.derived(derive_key(self.key, "join_mask", blend, allow_resize),
+                                      _join_mask, (self, blend, allow_resize),
+                                      dims=self.dims, persist=True,
+                                      default_suffix=self._default_suffix, **self._save_kw)
         return TokenImage(image, default_suffix=self._default_suffix, **self._save_kw)
 
     def flip(self, horz: bool = False, vert: bool = False) -> TokenImage:
@@ -1,6 +1,9 @@
 from .layout import Layout, BestLayout, LayoutImpossibleError
 from .greedy import GreedyLayout
 from .rectpack import RectPackLayout, make_default_best_layout, make_constrainted_best_layout
+from .maxrects import MaxRectsLayout
+from .cached import CachedLayout, main_layout_cache
+from .incremental import IncrementalLayout, token_keys
 
 
 
@@ -26,13 +29,16 @@ def make_layout(config: dict) -> Layout:
             # Only one layout, return it directly
             return cbest.layouts[0]
         return cbest
+    elif layout_type == "maxrects":
+        return MaxRectsLayout(config)
     elif layout_type == 'all':
         layouts = [
             make_layout(dict(config, layout="greedy")),
+            make_layout(dict(config, layout="maxrects")),
             make_layout(dict(config, layout="rectpack_best"))
         ]
         return BestLayout(config, layouts)
     else:
         raise ValueError(f"Unsupported layout type: {layout_type}")
 
-__all__ = ["make_layout", "Layout", "GreedyLayout", "RectPackLayout", "BestLayout", "LayoutImpossibleError"]
\ No newline at end of file
+__all__ = ["make_layout", "Layout", "GreedyLayout", "RectPackLayout", "MaxRectsLayout", "CachedLayout", "IncrementalLayout", "BestLayout", "LayoutImpossibleError"]
\ No newline at end of file
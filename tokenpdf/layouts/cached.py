@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Tuple
+
+from platformdirs import user_cache_dir
+
+from .layout import Layout
+from tokenpdf.utils.cache import PersistentCache
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_CACHE = Path(user_cache_dir("tokenpdf")) / "layouts"
+ENABLE_LAYOUT_CACHE = True
+LAYOUT_CACHE_MAX_BYTES = 64 << 20
+# Bump when a layout algorithm changes, to invalidate layouts stored by older versions
+LAYOUT_KEY_VERSION = 1
+# The configuration keys that affect the result of a layout
+# (not layout_time_budget: results cut off by the budget are not stored, and others don't depend on it)
+LAYOUT_CONFIG_KEYS = ["layout", "rotation", "bin_algo", "pack_algo", "sort_algo",
+                      "maxrects_heuristic", "maxrects_sort", "layout_search"]
+# Sizes are compared up to this many decimal places (of mm)
+SIZE_DECIMALS = 6
+
+
+class CachedLayout(Layout):
+    """Reuses the arrangements of a layout from a persistent cache.
+    Arrangements are keyed by the sorted token sizes, the page size and the layout's configuration,
+    so tokens of the same sizes (in any order) reuse the stored arrangement, remapped to their indices.
+    Arrangements cut off by a time budget are not stored, as they depend on the machine's speed and load.
+    Reused arrangements are logged (and printed in verbose mode).
+
+    Args:
+        config: The configuration (of the layout).
+        layout: The layout whose arrangements are cached.
+        cache: The persistent cache to store arrangements in.
+    """
+
+    def __init__(self, config: Dict[str, Any], layout: Layout, cache: PersistentCache):
+        super().__init__(config)
+        self.layout = layout
+        self.cache = cache
+
+    def __str__(self) -> str:
+        return f"Cached({self.layout})"
+
+    def arrange(
+        self,
+        token_sizes: List[Tuple[float, float]],
+        page_sizes: Generator[Tuple[float, float], None, None],
+        verbose: bool = False
+    ) -> List[List[Tuple[int, float, float, float, float]]]:
+        """Arranges tokens on pages with the cached arrangement of the same token sizes,
+        or with the layout (storing its arrangement) if there is none.
+
+        Args:
+          token_sizes: A list of tuples representing token widths and heights in mm.
+          page_sizes: A generator of tuples representing page widths and heights in mm.
+          verbose: Whether to print progress information.
+
+        Returns:
+          : A list of pages, where each page is a list of tuples
+          containing the token index and the placement rectangle (x,
+          y, width, height)
+
+        """
+        sizes = [_round_size(size) for size in token_sizes]
+        # Tokens in canonical order: the i-th token of this order has rank i
+        order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+        first_page = next(page_sizes)
+        key = self._key([sizes[i] for i in order], first_page)
+        drawn = [first_page]
+        stored = self._load(key)
+        if stored is not None:
+            # The pages after the first must be the same as the stored ones too
+            drawn.extend(next(page_sizes, None) for _ in stored["page_sizes"][1:])
+            if [_round_size(p) if p is not None else None for p in drawn] == stored["page_sizes"]:
+                self.cache.hits += 1
+                message = (f"Layout cache hit: reusing a stored layout of {len(stored['pages'])} pages "
+                           "(layout_cache = false to search again)")
+                logger.info(message)
+                if verbose:
+                    print(message)
+                return self.sort_output([[(order[rank], x, y, w, h) for rank, x, y, w, h in page]
+                                         for page in stored["pages"]])
+            drawn = [p for p in drawn if p is not None]
+        self.cache.misses += 1
+        used = []
+
+        def _pages():
+            for page_size in chain(drawn, page_sizes):
+                used.append(page_size)
+                yield page_size
+        result = self.layout.arrange(token_sizes, _pages(), verbose)
+        if self.layout.cut_off:
+            if verbose:
+                print("Layout search cut off by the time budget, not stored in the layout cache")
+            return result
+        rank = {index: r for r, index in enumerate(order)}
+        self._store(key, {
+            "pages": [[[rank[i], float(x), float(y), float(w), float(h)] for i, x, y, w, h in page]
+                      for page in result],
+            "page_sizes": [_round_size(p) for p in used[:max(1, len(result))]],
+        })
+        return result
+
+    def _key(self, sorted_sizes: List[Tuple[float, float]], page_size: Tuple[float, float]) -> str:
+        data = {
+            "version": LAYOUT_KEY_VERSION,
+            "sizes": sorted_sizes,
+            "page_size": _round_size(page_size),
+            "config": {k: self.config.get(k) for k in LAYOUT_CONFIG_KEYS},
+        }
+        return "layout:" + hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _load(self, key: str) -> Dict[str, Any] | None:
+        entry = self.cache.entry(key, count=False)
+        if entry is None:
+            return None
+        try:
+            return json.loads(entry.path.read_text())
+        except (OSError, ValueError):
+            self.cache.remove(key)
+            return None
+
+    def _store(self, key: str, data: Dict[str, Any]):
+        path = self.cache.temp_path(".json")
+        path.write_text(json.dumps(data))
+        self.cache.put(key, path)
+
+
+def _round_size(size: Tuple[float, float]) -> List[float]:
+    return [round(float(v), SIZE_DECIMALS) for v in size]
+
+
+main_layout_cache = PersistentCache(folder=LAYOUT_CACHE, enabled=ENABLE_LAYOUT_CACHE,
+                                    max_bytes=LAYOUT_CACHE_MAX_BYTES)
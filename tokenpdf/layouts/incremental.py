@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Sequence, Tuple
+
+import numpy as np
+
+from .layout import Layout
+from .maxrects import MaxRectsLayout, place_rect
+
+PLAN_VERSION = 1
+# Token configuration keys that don't identify the token (e.g. the token counts of its monster)
+VOLATILE_KEYS = {"tokens", "count"}
+# Sizes are compared up to this many decimal places (of mm)
+SIZE_DECIMALS = 6
+
+
+def token_keys(configs: Sequence[Dict[str, Any]]) -> List[str]:
+    """The identities of tokens across runs: a hash of the token's configuration,
+    and its occurrence among the tokens of the same configuration.
+    Adding tokens (e.g. increasing a count) keeps the identities of the existing ones.
+
+    Args:
+      configs: The configurations of the tokens.
+
+    Returns:
+      : The key of each token.
+    """
+    seen = Counter()
+    keys = []
+    for config in configs:
+        data = {k: v for k, v in config.items() if k not in VOLATILE_KEYS}
+        digest = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+        keys.append(f"{digest}:{seen[digest]}")
+        seen[digest] += 1
+    return keys
+
+
+class IncrementalLayout(Layout):
+    """Keeps the placements of a layout plan file, and only places the tokens that are new.
+    Tokens are identified by keys (see token_keys). Tokens of the plan keep their page and position,
+    new tokens are placed in the free space of the existing pages first, and the tokens that don't fit
+    are arranged by the wrapped layout on new pages. The plan is updated after every arrangement.
+
+    Args:
+        config: The configuration (of the layout).
+        layout: The layout arranging tokens on new pages (and all the tokens, without a plan).
+        plan_path: The layout plan file.
+    """
+
+    def __init__(self, config: Dict[str, Any], layout: Layout, plan_path: str | Path):
+        super().__init__(config)
+        self.layout = layout
+        self.plan_path = Path(plan_path)
+        self.filler = MaxRectsLayout(config)
+        # The keys of the tokens of the next arrangement (by index if not set)
+        self.token_keys: List[str] | None = None
+        # The pages of the last arrangement that differ from the plan
+        self.changed_pages: List[int] = []
+
+    def __str__(self) -> str:
+        return f"Incremental({self.layout})"
+
+    def arrange(
+        self,
+        token_sizes: List[Tuple[float, float]],
+        page_sizes: Generator[Tuple[float, float], None, None],
+        verbose: bool = False
+    ) -> List[List[Tuple[int, float, float, float, float]]]:
+        """Arranges tokens on pages, keeping the placements of the tokens in the plan.
+
+        Args:
+          token_sizes: A list of tuples representing token widths and heights in mm.
+          page_sizes: A generator of tuples representing page widths and heights in mm.
+          verbose: Whether to print progress information.
+
+        Returns:
+          : A list of pages, where each page is a list of tuples
+          containing the token index and the placement rectangle (x,
+          y, width, height)
+
+        """
+        keys = self.token_keys
+        if keys is None or len(keys) != len(token_sizes):
+            keys = [f"#{i}" for i in range(len(token_sizes))]
+        sizes = [_round(size) for size in token_sizes]
+        plan = self._load_plan()
+        drawn = []
+        if plan is not None:
+            drawn = [size for _, size in zip(plan["page_sizes"], page_sizes)]
+            if [_round(size) for size in drawn] != plan["page_sizes"]:
+                # Different pages (e.g. the page size changed), start over
+                plan = None
+        if plan is None:
+            pages, page_list = self._arrange_new(token_sizes, range(len(token_sizes)),
+                                                 chain(drawn, page_sizes), verbose)
+            changed = set(range(len(pages)))
+            kept = removed = 0
+        else:
+            # The generator continues after the plan's pages
+            page_list = drawn
+            pages = [[] for _ in page_list]
+            changed = set()
+            fixed = set()
+            for i, key in enumerate(keys):
+                entry = plan["tokens"].get(key)
+                if entry is not None and entry["size"] == sizes[i] and entry["page"] < len(pages):
+                    pages[entry["page"]].append((i, *entry["rect"]))
+                    fixed.add(key)
+            kept = len(fixed)
+            # Pages that lost tokens
+            removed_tokens = [entry for key, entry in plan["tokens"].items() if key not in fixed]
+            removed = len(removed_tokens)
+            changed.update(entry["page"] for entry in removed_tokens)
+            # New tokens: first in the free space of the existing pages
+            free = np.array([[p, 0, 0, width, height] for p, (width, height) in enumerate(page_list)],
+                            dtype=float).reshape(-1, 5)
+            for p, page in enumerate(pages):
+                for _, x, y, w, h in page:
+                    free = place_rect(free, p, x, y, w, h)
+            new = [i for i, key in enumerate(keys) if key not in fixed]
+            free, unplaced = self.filler.fill(token_sizes, new, free, pages, verbose=verbose)
+            placed = set(new) - set(unplaced)
+            changed.update(p for p, page in enumerate(pages) if any(i in placed for i, *_ in page))
+            # Then on new pages
+            if unplaced:
+                new_pages, new_page_list = self._arrange_new(token_sizes, unplaced, page_sizes, verbose)
+                changed.update(range(len(pages), len(pages) + len(new_pages)))
+                pages.extend(new_pages)
+                page_list.extend(new_page_list)
+            # Pages that lost all their tokens are dropped, moving the pages after them
+            nonempty = [p for p, page in enumerate(pages) if page]
+            if len(nonempty) < len(pages):
+                first_dropped = next(p for p, page in enumerate(pages) if not page)
+                changed.update(range(first_dropped, len(pages)))
+            changed = {nonempty.index(p) for p in changed if p in nonempty}
+            pages = [pages[p] for p in nonempty]
+            page_list = [page_list[p] for p in nonempty]
+
+        self.changed_pages = sorted(changed)
+        self._save_plan(keys, sizes, pages, page_list)
+        if verbose:
+            print(f"Layout plan {self.plan_path}: kept {kept} tokens, placed {len(token_sizes) - kept}, "
+                  f"removed {removed}. Changed pages: {self.changed_pages} of {len(pages)}")
+        return pages
+
+    def _arrange_new(self, token_sizes, indices: Sequence[int], page_sizes, verbose: bool):
+        """Arranges the tokens of the indices on new pages with the wrapped layout.
+        Returns the pages (with the tokens' indices) and the page sizes."""
+        indices = list(indices)
+        used = []
+
+        def _pages():
+            for size in page_sizes:
+                used.append(size)
+                yield size
+        pages = self.layout.arrange([token_sizes[i] for i in indices], _pages(), verbose)
+        pages = [[(indices[i], *rect) for i, *rect in page] for page in pages]
+        return pages, used[:len(pages)]
+
+    def _load_plan(self) -> Dict[str, Any] | None:
+        try:
+            plan = json.loads(self.plan_path.read_text())
+        except (OSError, ValueError):
+            return None
+        if plan.get("version") != PLAN_VERSION:
+            return None
+        return plan
+
+    def _save_plan(self, keys, sizes, pages, page_list):
+        plan = {
+            "version": PLAN_VERSION,
+            "page_sizes": [_round(size) for size in page_list],
+            "tokens": {keys[i]: {"page": p, "rect": [float(v) for v in rect], "size": sizes[i]}
+                       for p, page in enumerate(pages) for i, *rect in page},
+        }
+        self.plan_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.plan_path.with_name(self.plan_path.name + ".tmp")
+        temp_path.write_text(json.dumps(plan, indent=1))
+        os.replace(temp_path, self.plan_path)
+
+
+def _round(size: Tuple[float, float]) -> List[float]:
+    return [round(float(v), SIZE_DECIMALS) for v in size]
@@ -1,8 +1,16 @@
+import math
+import multiprocessing
+import queue
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Dict, Any, Generator
+from itertools import islice
+from time import perf_counter
+from typing import Iterator, List, Tuple, Dict, Any, Generator
 
-from tokenpdf.utils.general import ResettableGenerator, consume
-from tokenpdf.utils.graph import largest_connected_component
+import numpy as np
+
+from tokenpdf.utils.general import ResettableGenerator
+from tokenpdf.utils.graph import connected_components
+from tokenpdf.utils.timing import stage
 
 class Layout(ABC):
     """Abstract base class for layouts.
@@ -13,6 +21,9 @@ class Layout(ABC):
     Returns:
 
     """
+    # True if the last arrangement was cut off by a time budget (see BestLayout),
+    # so it depends on the machine's speed and load
+    cut_off = False
 
     def __init__(self, config: Dict[str, Any]):
         """Initializes the layout with the given configuration.
@@ -90,13 +101,18 @@ class LayoutImpossibleError(Exception):
 class KnownPagesLayout(Layout):
     """A subclassable layout that arranges tokens on a generator of page sizes,
     using an overrided function that arranges tokens on a concrete list of page sizes.
-    Uses an iterative "double pages number" approach to find the best number of pages.
+    Searches for the smallest number of pages: starting at the area-based lower bound,
+    galloping upwards until arranging succeeds, then binary searching between the
+    last failure and the first success.
 
     Args:
 
     Returns:
 
     """
+    # The number of arrange_on_pages calls in the last arrange
+    invocations: int = 0
+
     def arrange(
         self, 
         token_sizes: List[Tuple[float, float]], 
@@ -126,25 +142,51 @@ class KnownPagesLayout(Layout):
 
         """
         pages = [next(page_sizes)]
-        while len(pages) <= len(token_sizes): # Safety check
-            try:
-                if verbose:
-                    #print(f"Trying {len(pages)} pages")
-                    pass
-                result = self.arrange_on_pages(token_sizes, pages, verbose)
-                # Remove unneeded pages
-                while not result[-1]:
-                    result.pop()
-                return self.sort_output(result)
-            except LayoutImpossibleError as e:
-                try:
-                    # Try to add new pages
-                    pages.extend(consume(page_sizes, max(1,min(len(pages), len(token_sizes) - len(pages)))))
-                except StopIteration:
-                    # Can't even add a single page
-                    raise e
-        
-        raise LayoutImpossibleError("Not enough pages to arrange all tokens")
+        # Every token on its own page is the most that can be needed
+        limit = max(1, len(token_sizes))
+        attempts = {}
+        self.invocations = 0
+
+        def attempt(count):
+            """The arrangement on the first count pages (None if impossible), each count tried once."""
+            if count not in attempts:
+                self.invocations += 1
+                with stage("pack", pages=count):
+                    try:
+                        attempts[count] = self.arrange_on_pages(token_sizes, pages[:count], verbose)
+                    except LayoutImpossibleError:
+                        attempts[count] = None
+            return attempts[count]
+
+        # Gallop: the lower bound, then increasing steps, until arranging succeeds.
+        # Fewer pages than the lower bound are known to fail (assuming pages of the first page's size)
+        count, step = min(_area_pages(token_sizes, pages[0]), limit), 1
+        failed = count - 1
+        while True:
+            pages.extend(islice(page_sizes, count - len(pages)))
+            if len(pages) <= failed:
+                # No more pages to try
+                raise LayoutImpossibleError("Not enough pages to arrange all tokens")
+            count = min(count, len(pages))
+            result = attempt(count)
+            if result is not None:
+                break
+            if count >= limit:
+                raise LayoutImpossibleError("Not enough pages to arrange all tokens")
+            failed, count, step = count, min(count + step, limit), step * 2
+        best = _trim_pages(result)
+        # Binary search between the last failure and the first success
+        while len(best) - failed > 1:
+            middle = (failed + len(best)) // 2
+            result = attempt(middle)
+            if result is None:
+                failed = middle
+            else:
+                best = _trim_pages(result)
+        if verbose:
+            print(f"{self}: {len(best)} pages after {self.invocations} arrangements "
+                  f"(tried {sorted(attempts)})")
+        return self.sort_output(best)
     
     @abstractmethod
     def arrange_on_pages(
@@ -197,6 +239,16 @@ class BestLayout(Layout):
             else:
                 layoutr.append(layout)
         self.layouts = layoutr
+        # Number of worker processes evaluating the candidate layouts
+        self.workers = max(1, int(config.get("layout_workers", 1)))
+        # "full" runs every candidate. "pruned" stops at the minimal possible number of pages,
+        # and limits candidates to the pages of the best result so far
+        self.search = str(config.get("layout_search", "full")).lower()
+        if self.search not in ("full", "pruned"):
+            raise ValueError(f"Unsupported layout search: {self.search}")
+        # Seconds after which the best result so far is used (None: no limit).
+        # With a budget, candidates run in worker processes (at least one), so a running candidate can be stopped
+        self.time_budget = config.get("layout_time_budget") or None
 
     def arrange(
         self, 
@@ -229,27 +281,115 @@ class BestLayout(Layout):
         if not token_sizes:
             return []
         page_sizes = ResettableGenerator(page_sizes)
-        best_result = None
-        best_layout = None
-        layouts = self.layouts.copy()
-        for layout in layouts:
-            try:
-                page_sizes.reset()
-                result = layout.arrange(token_sizes, page_sizes, verbose)
-                
-                best_result, best_layout = self._compare_results(best_result, result, best_layout, layout)
-            except LayoutImpossibleError:
+        state = _SearchState(self.search == "pruned", _min_pages(token_sizes, page_sizes), self.time_budget)
+        if len(self.layouts) > 1 and (self.workers > 1 or self.time_budget is not None):
+            candidates = self._arrange_parallel(token_sizes, page_sizes, state, verbose)
+        else:
+            candidates = self._arrange_sequential(token_sizes, page_sizes, state, verbose)
+        best = None
+        evaluated = 0
+        # Contiguous areas by result id (with the result), computed once per result
+        areas = {}
+        for index, layout, result in candidates:
+            evaluated += 1
+            if result is None:
                 if verbose:
                     print(f"Layout {layout.__class__.__name__} failed")
-        if best_result is None:
+                continue
+            if best is None:
+                best = (index, layout, result)
+            else:
+                # Ties go to the earlier candidate, so the winner doesn't depend on completion order
+                (i1, layout1, result1), (i2, layout2, result2) = sorted([best, (index, layout, result)],
+                                                                        key=lambda c: c[0])
+                best_result, best_layout = self._compare_results(result1, result2, layout1, layout2, areas)
+                best = (i1, layout1, result1) if best_layout is layout1 else (i2, layout2, result2)
+                # Only the best result is compared again
+                areas = {key: entry for key, entry in areas.items() if entry[0] is best[2]}
+            state.best_pages = len(best[2])
+        self.cut_off = state.out_of_time and evaluated < len(self.layouts)
+        if best is None:
             raise LayoutImpossibleError("No layout succeeded")
-        return best_result
+        if verbose and state.stopped:
+            print(f"Layout search stopped early ({state.stopped}), "
+                  f"using {best[1]} with {len(best[2])} pages")
+        return best[2]
+
+    def _arrange_sequential(self, token_sizes, page_sizes, state, verbose) -> Iterator[Tuple[int, Layout, Any]]:
+        """Runs the candidate layouts one after another.
+        Yields (index, layout, result) per candidate, with None results for failed layouts."""
+        for index, layout in enumerate(self.layouts):
+            if state.done():
+                return
+            page_sizes.reset()
+            pages = page_sizes if state.max_pages is None else islice(page_sizes, state.max_pages)
+            with stage("candidate", layout=str(layout)):
+                result = _arrange_candidate(layout, token_sizes, pages, verbose)
+            # Yielded outside the stage, so comparing the result isn't timed as part of the candidate
+            yield index, layout, result
+
+    def _arrange_parallel(self, token_sizes, page_sizes, state, verbose) -> Iterator[Tuple[int, Layout, Any]]:
+        """Runs the candidate layouts in a process pool.
+        Yields (index, layout, result) per candidate as they complete.
+        Candidates are submitted as workers free up, so they are limited by the search state.
+        Candidates still running when the search stops are terminated."""
+        # Generators can't be sent to workers, but a layout never uses more pages than
+        # one per token (and one more to find out)
+        page_sizes.reset()
+        page_sizes = list(islice(page_sizes, len(token_sizes) + 1))
+        context = multiprocessing.get_context("spawn")
+        workers = min(self.workers, len(self.layouts))
+        layouts = iter(enumerate(self.layouts))
+        # (index, result, error) of the completed candidates
+        completed = queue.Queue()
+        pending = {}  # Index -> layout
+        with stage("candidates", workers=workers):
+            # A pool (rather than an executor), as it can terminate the candidates still running
+            pool = context.Pool(workers)
+            try:
+                while True:
+                    # Keep the workers busy, with one queued candidate each
+                    while len(pending) < 2 * workers and not state.done():
+                        index, layout = next(layouts, (None, None))
+                        if layout is None:
+                            break
+                        pages = page_sizes[:state.max_pages] if state.max_pages is not None else page_sizes
+                        pool.apply_async(_arrange_candidate, (layout, token_sizes, pages),
+                                         callback=lambda result, index=index: completed.put((index, result, None)),
+                                         error_callback=lambda error, index=index: completed.put((index, None, error)))
+                        pending[index] = layout
+                    if not pending or state.done():
+                        return
+                    # Wake up when the time budget runs out, even if no candidate completes
+                    try:
+                        done = [completed.get(timeout=state.remaining)]
+                    except queue.Empty:
+                        continue
+                    while True:
+                        try:
+                            done.append(completed.get_nowait())
+                        except queue.Empty:
+                            break
+                    for index, result, error in sorted(done, key=lambda c: c[0]):
+                        layout = pending.pop(index)
+                        if error is not None:
+                            raise error
+                        yield index, layout, result
+            finally:
+                if pending:
+                    # Candidates still running are abandoned: stop their workers, rather than
+                    # letting them run past the search
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
     
     def _compare_results(
         self, 
         result1: List[List[Tuple[int, float, float, float, float]]], 
         result2: List[List[Tuple[int, float, float, float, float]]],
-        layout1: Layout, layout2: Layout
+        layout1: Layout, layout2: Layout,
+        areas: Dict[int, Tuple[Any, float]] | None = None
     ) -> List[List[Tuple[int, float, float, float, float]]]:
         """Compares two results and returns the best one.
 
@@ -262,6 +402,7 @@ class BestLayout(Layout):
           result2: List[List[Tuple[int: 
           layout1: Layout: 
           layout2: Layout: 
+          areas: Memoized contiguous areas of results (see _contiguous_area).
 
         Returns:
           : The best result.
@@ -280,8 +421,8 @@ class BestLayout(Layout):
             print(f"{layout2} has less pages ({len(result2)}), using it")
             return result2, layout2
         # Same number of pages, compare by total contiguous area
-        result1area = _largest_contiguous_areas(result1)
-        result2area = _largest_contiguous_areas(result2)
+        result1area = _contiguous_area(result1, areas)
+        result2area = _contiguous_area(result2, areas)
         if result1area > result2area:
             #print(f"{layout1} has the same page count ({len(result1)}) but more contiguous area ({result1area}) than {layout2} ({result2area}), using it")
             return result1, layout1
@@ -292,9 +433,90 @@ class BestLayout(Layout):
         return result1, layout1
 
     
+class _SearchState:
+    """The state of a BestLayout search, shared with the candidate runners."""
+    def __init__(self, pruned: bool, min_pages: int, time_budget: float | None):
+        self.pruned = pruned
+        self.min_pages = min_pages
+        self.deadline = None if time_budget is None else perf_counter() + float(time_budget)
+        self.best_pages = None
+        self.stopped = None  # The reason the search stopped early, if it did
+        self.out_of_time = False  # True if it stopped because of the time budget
+
+    @property
+    def max_pages(self) -> int | None:
+        """The pages a candidate may use (None: unlimited)."""
+        return self.best_pages if self.pruned else None
+
+    @property
+    def remaining(self) -> float | None:
+        """The seconds left of the time budget, once there is a result (None: no limit yet)."""
+        if self.deadline is None or self.best_pages is None:
+            return None
+        return max(0.0, self.deadline - perf_counter())
+
+    def done(self) -> bool:
+        """True if the search should stop (only once there is a result)."""
+        if self.best_pages is None:
+            return False
+        if self.pruned and self.best_pages <= self.min_pages:
+            self.stopped = f"reached the minimal number of pages, {self.min_pages}"
+        elif self.deadline is not None and perf_counter() >= self.deadline:
+            self.stopped = "time budget exceeded"
+            self.out_of_time = True
+        return self.stopped is not None
+
+
+def _min_pages(token_sizes: List[Tuple[float, float]], page_sizes: ResettableGenerator) -> int:
+    """A lower bound on the pages of any layout: the total token area over the page area
+    (of the first page), rounded up."""
+    page_sizes.reset()
+    page_size = next(page_sizes)
+    page_sizes.reset()
+    return _area_pages(token_sizes, page_size)
+
+
+def _area_pages(token_sizes: List[Tuple[float, float]], page_size: Tuple[float, float]) -> int:
+    """The total token area over the page area, rounded up (at least 1)."""
+    page_width, page_height = page_size
+    area = sum(width * height for width, height in token_sizes)
+    return max(1, math.ceil(area / (page_width * page_height) - 1e-9))
+
+
+def _trim_pages(result: List[List[Tuple[int, float, float, float, float]]]):
+    """The arrangement without its trailing empty pages."""
+    result = list(result)
+    while result and not result[-1]:
+        result.pop()
+    return result
+
+
+def _arrange_candidate(layout: Layout, token_sizes, page_sizes, verbose: bool = False):
+    """Arranges the tokens with a candidate layout, or returns None if the layout fails
+    (including when it runs out of pages, when the pages are limited).
+    Page sizes can be a list (for worker processes), or a generator."""
+    if isinstance(page_sizes, list):
+        page_sizes = iter(page_sizes)
+    try:
+        return layout.arrange(token_sizes, page_sizes, verbose)
+    except (LayoutImpossibleError, StopIteration):
+        return None
+
+    
+def _contiguous_area(result, areas: Dict[int, Tuple[Any, float]] | None) -> float:
+    """The largest contiguous areas of a result, memoized in areas (by result id) if given."""
+    if areas is None:
+        return _largest_contiguous_areas(result)
+    entry = areas.get(id(result))
+    if entry is None or entry[0] is not result:
+        entry = areas[id(result)] = (result, _largest_contiguous_areas(result))
+    return entry[1]
+
+
 def _largest_contiguous_areas(result: List[List[Tuple[int, float, float, float, float]]]) -> float:
     """Returns the largest contiguous area in the result.
-    Sums per-page contiguous areas.
+    Sums per-page contiguous areas: the area of the largest (by token count)
+    group of overlapping tokens of each page.
 
     Args:
       result: List[List[Tuple[int: 
@@ -305,32 +527,38 @@ def _largest_contiguous_areas(result: List[List[Tuple[int, float, float, float,
 
     """
     EPS = 1e-4
-    def _overlap(r1, r2):
-        """
-
-        Args:
-          r1: 
-          r2: 
-
-        Returns:
-
-        """
-        *_, x1, y1, w1, h1 = r1
-        *_, x2, y2, w2, h2 = r2
-        return (
-            x1 + w1 >= x2 + EPS and x2 + w2 >= x1 + EPS and
-            y1 + h1 >= y2 + EPS and y2 + h2 >= y1 + EPS
-        )
-    ccs = [
-        (page, largest_connected_component(range(len(page)), lambda i, j: _overlap(page[i], page[j])))
-        for page in result
-    ]
-    return sum(
-        sum(page[i][-2] * page[i][-1] for i in cc)
-        for page, cc in ccs
-    )
-
-
-
-
-    
+    total = 0
+    for page in result:
+        if not page:
+            continue
+        x, y, w, h = np.asarray([rect[-4:] for rect in page], dtype=float).T
+        overlap = ((x[:, None] + w[:, None] >= x[None, :] + EPS) & (x[None, :] + w[None, :] >= x[:, None] + EPS) &
+                   (y[:, None] + h[:, None] >= y[None, :] + EPS) & (y[None, :] + h[None, :] >= y[:, None] + EPS))
+        np.fill_diagonal(overlap, False)
+        labels = connected_components(len(page), np.nonzero(np.triu(overlap)))
+        # The largest component, or the one with the first token among equally large ones
+        largest = int(np.argmax(np.bincount(labels)))
+        # Summed in the iteration order of the component's set as a graph search builds it,
+        # so the float totals (and the comparisons of layouts) are exactly those of the graph search
+        members = set(_search_order(overlap, largest))
+        total += sum(page[i][-2] * page[i][-1] for i in members)
+    return total
+
+
+def _search_order(adjacency: np.ndarray, source: int) -> List[int]:
+    """The nodes of the source's connected component, in the order a breadth-first search
+    (networkx's, with neighbors in ascending order) visits them. Vectorized per level:
+    the neighbors of a level, in row-major order, are the order the search visits them in."""
+    seen = np.zeros(len(adjacency), dtype=bool)
+    seen[source] = True
+    level = np.array([source])
+    order = [level]
+    while level.size:
+        _, neighbors = np.nonzero(adjacency[level])
+        neighbors = neighbors[~seen[neighbors]]
+        # The first visit of each node
+        _, first = np.unique(neighbors, return_index=True)
+        level = neighbors[np.sort(first)]
+        seen[level] = True
+        order.append(level)
+    return np.concatenate(order).tolist()
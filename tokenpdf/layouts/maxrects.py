@@ -0,0 +1,194 @@
+from typing import Any, Dict, Generator, Iterable, List, Tuple
+import numpy as np
+from .layout import Layout, LayoutImpossibleError
+from tokenpdf.utils.verbose import vtqdm
+
+# Tolerance for comparing positions and sizes, in mm
+EPS = 1e-6
+
+# Heuristic name -> function of the leftover widths and heights of the fitting free rectangles
+# (and the rectangles themselves), returning the (primary, secondary) scores to minimize
+HEURISTICS = {
+    # Best short side fit: smallest leftover on the short side
+    "bssf": lambda dw, dh, free: (np.minimum(dw, dh), np.maximum(dw, dh)),
+    # Best long side fit: smallest leftover on the long side
+    "blsf": lambda dw, dh, free: (np.maximum(dw, dh), np.minimum(dw, dh)),
+    # Best area fit: smallest free rectangle
+    "baf": lambda dw, dh, free: (free[:, 3] * free[:, 4], np.minimum(dw, dh)),
+    # Bottom left: the position closest to the page's origin (top first, then left)
+    "bl": lambda dw, dh, free: (free[:, 2], free[:, 1]),
+}
+
+SORTS = {
+    "area": lambda sizes: -sizes[:, 0] * sizes[:, 1],
+    "side": lambda sizes: -np.maximum(sizes[:, 0], sizes[:, 1]),
+    "none": lambda sizes: np.zeros(len(sizes)),
+}
+
+
+class MaxRectsLayout(Layout):
+    """A MaxRects packer on NumPy arrays.
+    The free rectangles of all the pages are kept in a single array, so the fit of each token
+    is scored on all the pages at once. Pages are added as needed, without re-packing earlier pages,
+    and sizes are not rounded (sub-millimetre precision)."""
+
+    def __init__(self, config: Dict[str, Any]):
+        """Initializes the layout with the given configuration.
+
+        Args:
+            config: Dictionary of configuration options for the layout.
+        """
+        super().__init__(config)
+        self.heuristic_name = str(config.get("maxrects_heuristic", "bssf")).lower()
+        if self.heuristic_name not in HEURISTICS:
+            raise ValueError(f"Unsupported maxrects heuristic: {self.heuristic_name}")
+        self.sort_name = str(config.get("maxrects_sort", "area")).lower()
+        if self.sort_name not in SORTS:
+            raise ValueError(f"Unsupported maxrects sort: {self.sort_name}")
+        self.rotation = config.get("rotation", True)
+
+    def __str__(self) -> str:
+        return f"MR({self.heuristic_name}, {self.sort_name}, {int(self.rotation)})"
+
+    def arrange(
+        self,
+        token_sizes: List[Tuple[float, float]],
+        page_sizes: Generator[Tuple[float, float], None, None],
+        verbose: bool = False
+    ) -> List[List[Tuple[int, float, float, float, float]]]:
+        """Arranges tokens on pages, placing each token (largest first) at the best fit
+        among the free rectangles of all the pages so far, or on a new page if none fits.
+
+        Args:
+          token_sizes: A list of tuples representing token widths and heights in mm.
+          page_sizes: A generator of tuples representing page widths and heights in mm.
+          verbose: Whether to print progress information.
+
+        Returns:
+          : A list of pages, where each page is a list of tuples
+          containing the token index and the placement rectangle (x,
+          y, width, height)
+
+        """
+        if not token_sizes:
+            return []
+        pages = []
+        self.fill(token_sizes, range(len(token_sizes)), np.empty((0, 5)), pages, page_sizes, verbose)
+        return self.sort_output(pages)
+
+    def fill(
+        self,
+        token_sizes: List[Tuple[float, float]],
+        indices: Iterable[int],
+        free: np.ndarray,
+        pages: List[List[Tuple[int, float, float, float, float]]],
+        page_sizes: Generator[Tuple[float, float], None, None] | None = None,
+        verbose: bool = False
+    ) -> Tuple[np.ndarray, List[int]]:
+        """Places tokens (largest first) at the best fit among the free rectangles of the pages,
+        adding a page from page_sizes when a token doesn't fit in any.
+
+        Args:
+          token_sizes: A list of tuples representing token widths and heights in mm.
+          indices: The indices of the tokens to place.
+          free: The free rectangles of the pages, as rows of (page, x, y, width, height).
+          pages: The placements of each page, which new placements (and pages) are added to.
+          page_sizes: A generator of page sizes for new pages (None to not add pages).
+          verbose: Whether to print progress information.
+
+        Returns:
+          : The free rectangles after the placements, and the indices of the tokens
+          that were not placed (only without page_sizes).
+        """
+        indices = np.asarray(list(indices), dtype=int)
+        if not len(indices):
+            return free, []
+        sizes = np.asarray(token_sizes, dtype=float).reshape(-1, 2)
+        indices = indices[np.argsort(SORTS[self.sort_name](sizes[indices]), kind="stable")]
+        heuristic = HEURISTICS[self.heuristic_name]
+        unplaced = []
+        tqdm = vtqdm(verbose)
+        for i in tqdm(indices, desc="Arranging tokens", leave=False):
+            width, height = sizes[i]
+            placement = self._best_fit(free, width, height, heuristic)
+            if placement is None:
+                if page_sizes is None:
+                    unplaced.append(int(i))
+                    continue
+                # A new page, which must fit the token
+                try:
+                    page_width, page_height = next(page_sizes)
+                except StopIteration:
+                    raise LayoutImpossibleError("Not enough pages to arrange all tokens")
+                free = np.vstack([free, [len(pages), 0, 0, page_width, page_height]])
+                pages.append([])
+                placement = self._best_fit(free[-1:], width, height, heuristic)
+                if placement is None:
+                    raise LayoutImpossibleError(f"Token {i} ({width}x{height}) does not fit on a page "
+                                                f"({page_width}x{page_height})")
+            page, x, y, w, h = placement
+            pages[page].append((int(i), x, y, w, h))
+            free = place_rect(free, page, x, y, w, h)
+        return free, unplaced
+
+    def _best_fit(self, free: np.ndarray, width: float, height: float, heuristic):
+        """The best placement of a token in the free rectangles, as (page, x, y, width, height),
+        or None if it doesn't fit in any."""
+        orientations = [(width, height)]
+        if self.rotation and abs(width - height) > EPS:
+            orientations.append((height, width))
+        best = None
+        for w, h in orientations:
+            dw = free[:, 3] - w
+            dh = free[:, 4] - h
+            fits = np.flatnonzero((dw > -EPS) & (dh > -EPS))
+            if not len(fits):
+                continue
+            primary, secondary = heuristic(dw[fits], dh[fits], free[fits])
+            # Ties go to earlier pages, then to earlier free rectangles
+            j = np.lexsort((fits, free[fits, 0], secondary, primary))[0]
+            score = (primary[j], secondary[j], free[fits[j], 0], fits[j])
+            if best is None or score < best[0]:
+                page, x, y = free[fits[j], :3]
+                best = (score, (int(page), float(x), float(y), w, h))
+        return None if best is None else best[1]
+
+
+def place_rect(free: np.ndarray, page: int, x: float, y: float, w: float, h: float) -> np.ndarray:
+    """Splits the free rectangles of the page that intersect a placed rectangle
+    into the (maximal) free rectangles around it, and removes contained free rectangles."""
+    fp, fx, fy, fw, fh = free.T
+    hit = ((fp == page) & (fx < x + w - EPS) & (fx + fw > x + EPS) &
+           (fy < y + h - EPS) & (fy + fh > y + EPS))
+    if not hit.any():
+        return free
+    split = free[hit]
+    sp, sx, sy, sw, sh = split.T
+    right, below = np.full_like(sx, x + w), np.full_like(sy, y + h)
+    candidates = np.concatenate([
+        np.stack([sp, sx, sy, x - sx, sh], axis=1),                        # Left
+        np.stack([sp, right, sy, sx + sw - right, sh], axis=1),            # Right
+        np.stack([sp, sx, sy, sw, y - sy], axis=1),                        # Above
+        np.stack([sp, sx, below, sw, sy + sh - below], axis=1),            # Below
+    ])
+    candidates = candidates[(candidates[:, 3] > EPS) & (candidates[:, 4] > EPS)]
+    on_page = free[~hit & (fp == page)]
+    others = free[~hit & (fp != page)]
+    return np.vstack([others, _prune(np.vstack([on_page, candidates]))])
+
+
+def _prune(rects: np.ndarray) -> np.ndarray:
+    """Removes the rectangles contained in other rectangles (keeping one of identical rectangles)."""
+    if len(rects) < 2:
+        return rects
+    _, x, y, w, h = rects.T
+    x2, y2 = x + w, y + h
+    # contains[i, j]: rectangle j is contained in rectangle i
+    contains = ((x[:, None] <= x[None, :] + EPS) & (y[:, None] <= y[None, :] + EPS) &
+                (x2[:, None] >= x2[None, :] - EPS) & (y2[:, None] >= y2[None, :] - EPS))
+    np.fill_diagonal(contains, False)
+    # Of identical rectangles (containing each other), only the last is removed by the earlier
+    index = np.arange(len(rects))
+    identical = contains & contains.T
+    removed = (contains & ~(identical & (index[:, None] > index[None, :]))).any(axis=0)
+    return rects[~removed]
@@ -47,6 +47,20 @@ class RectPackLayout(KnownPagesLayout):
         self.sort_algo = PACKING_SORT_NAMES[PACKING_SORT_NAMES_L[self.sort_algo_name.lower()]]
         self.rotation = self.config.get("rotation", True)
 
+    def __getstate__(self):
+        # rectpack's sort algorithms are lambdas, so layouts are sent to worker processes
+        # with the algorithm names only
+        state = self.__dict__.copy()
+        for key in ("bin_algo", "pack_algo", "sort_algo"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.bin_algo = PACKING_BIN_NAMES[PACKING_BIN_NAMES_L[self.bin_algo_name.lower()]]
+        self.pack_algo = PACKING_ALGO_NAMES[PACKING_ALGO_NAMES_L[self.pack_algo_name.lower()]]
+        self.sort_algo = PACKING_SORT_NAMES[PACKING_SORT_NAMES_L[self.sort_algo_name.lower()]]
+
     def __str__(self)->str:
         return f"RP({int(self.bin_algo)}, {self.pack_algo_name}, {self.sort_algo_name}, {int(self.rotation)})"
     
@@ -106,7 +120,8 @@ class RectPackLayout(KnownPagesLayout):
         
         # Make sure we placed all tokens
         if len(placement) != len(token_sizes):
-            report_failure(result, token_sizes, placed, page_sizes)
+            if verbose:
+                report_failure(result, token_sizes, placed, page_sizes)
             raise LayoutImpossibleError("Not all tokens could be placed.")
         
         
@@ -1,6 +1,7 @@
 from .simple import SimpleMapper
 from .mapper import Rectangle, Result, KnownPagesMapper, Mapper
 from .map import Map
+from .tiles import TileStore, main_tile_cache
 
 def make_mapper(config):
     """
@@ -17,5 +18,6 @@ def make_mapper(config):
     else:
         raise ValueError(f"Unsupported mapper type: {mapper_type}")
     
-__all__ = ["make_mapper", "Rectangle", "Result", "KnownPagesMapper", "Mapper", "Map"]
+__all__ = ["make_mapper", "Rectangle", "Result", "KnownPagesMapper", "Mapper", "Map",
+           "TileStore", "main_tile_cache"]
 
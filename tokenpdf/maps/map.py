@@ -1,7 +1,8 @@
 import numpy as np
-from tokenpdf.image import TokenImage
-from tokenpdf.utils.image import add_grid, complete_size
+from tokenpdf.image import FloatingImage, TokenImage, derive_key
+from tokenpdf.utils.image import complete_size
 from tokenpdf.token import Token
+from .tiles import TileStore, read_region
 from functools import partial
 from PIL import Image
 
@@ -88,7 +89,7 @@ class MapFragment(Token):
         xp, yp = border_margin / 2
 
 
-        with self.map.img.crop(rect_in_image) as cropped:    
+        with self.map.region(rect_in_image) as cropped:
             view.image(xp, yp, wp, hp, cropped)
         font_size = 12
         if text_margin[1] != 0:
@@ -130,10 +131,37 @@ class Map:
         self.system = system
 
         grid_color = res.get("grid_color")
-        add_grid_ = res.get("add_grid", grid_color is not None)
-        if add_grid_:
-            grid_color = grid_color if grid_color is not None else "black"
-            self.img = self.img.op(lambda pimg: add_grid(pimg, self.size_in_cells, grid_color))
+        self.add_grid = res.get("add_grid", grid_color is not None)
+        self.grid_color = grid_color if grid_color is not None else "black"
+        self.grid_antialias = bool(res.get("grid_antialias", False))
+        self._tiles = None
+
+    @property
+    def tiles(self) -> TileStore:
+        """The map's image as a tile store, built on first use (see TileStore.build)"""
+        if self._tiles is None:
+            self._tiles = TileStore.build(self.img)
+        return self._tiles
+
+    def region(self, rect) -> TokenImage:
+        """A lazy image of a rectangle of the map (x, y, width, height, in pixels of the map's image),
+        with the grid if added. Only the tiles under the rectangle are read, when the image is drawn.
+
+        Args:
+          rect: The rectangle, rounded to whole pixels as in PIL's crop.
+
+        Returns:
+          : The rectangle's image.
+        """
+        x, y, w, h = rect
+        box = tuple(int(round(v)) for v in (x, y, x + w, y + h))
+        grid = None
+        if self.add_grid:
+            grid = (tuple(int(v) for v in np.round(self.size_in_cells)), self.grid_color, self.grid_antialias)
+        size = (box[2] - box[0], box[3] - box[1])
+        image = FloatingImage.derived(derive_key(self.img.key, "map_region", box, grid),
+                                      read_region, (self.tiles, box, grid), dims=size)
+        return TokenImage(image)
     @property
     def size_on_page(self):
         """ """
@@ -0,0 +1,168 @@
+import hashlib
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Tuple
+from uuid import uuid4
+
+import numpy as np
+from PIL import Image
+from platformdirs import user_cache_dir
+
+from tokenpdf.image import TokenImage, derive_key
+from tokenpdf.utils.cache import PersistentCache
+from tokenpdf.utils.image import add_grid_region
+
+TILE_CACHE = Path(user_cache_dir("tokenpdf")) / "tiles"
+ENABLE_TILE_CACHE = True
+TILE_CACHE_MAX_BYTES = 8 << 30
+TILE_SIZE = 512
+# Tile stores of map images, by the source image's key and the tile size
+main_tile_cache = PersistentCache(folder=TILE_CACHE, enabled=ENABLE_TILE_CACHE, max_bytes=TILE_CACHE_MAX_BYTES)
+
+
+class TileStore:
+    """The decoded pixels of an image, stored as square tiles in a memory-mapped .npy file
+    (of shape (rows, columns, tile size, tile size, channels)).
+    Regions are read from the tiles they overlap, so reading a region only pages in
+    (and keeps in memory) about the region's pixels, however large the image is.
+    Stores are pickled by path, so regions can be read in other processes.
+
+    Args:
+        path: The .npy file of the tiles.
+        size: The size of the image (the tiles of the last row and column are padded).
+    """
+
+    def __init__(self, path: Path, size: Tuple[int, int]):
+        self.path = Path(path)
+        self.size = tuple(int(v) for v in size)
+        self._tiles = None
+
+    @classmethod
+    def build(cls, image: TokenImage, tile_size: int = TILE_SIZE) -> "TileStore":
+        """The tile store of an image: from the tile cache, or decoded once and written
+        a row of tiles at a time (then stored in the tile cache, if enabled).
+        The image's pixels are released once written.
+
+        Args:
+          image: The image (joined with its mask, if any).
+          tile_size: The width and height of the tiles, in pixels.
+
+        Returns:
+          : The tile store.
+        """
+        source = image.join_mask()
+        key = derive_key(source.key, "tiles", tile_size)
+        entry = main_tile_cache.entry(key)
+        if entry is not None:
+            return cls._pinned(entry.path, source.dims, entry.digest)
+        pil = source.image
+        width, height = pil.size
+        channels = len(pil.getbands())
+        rows, cols = -(-height // tile_size), -(-width // tile_size)
+        if main_tile_cache.enabled:
+            path = main_tile_cache.temp_path(".npy")
+        else:
+            path = Path(tempfile.gettempdir()) / f"tiles_{uuid4().hex[:8]}.npy"
+        tiles = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8,
+                                          shape=(rows, cols, tile_size, tile_size, channels))
+        for row in range(rows):
+            top = row * tile_size
+            strip = np.zeros((tile_size, cols * tile_size, channels), dtype=np.uint8)
+            pixels = np.asarray(pil.crop((0, top, width, min(height, top + tile_size))))
+            strip[:pixels.shape[0], :width] = pixels.reshape(pixels.shape[0], width, channels)
+            tiles[row] = strip.reshape(tile_size, cols, tile_size, channels).swapaxes(0, 1)
+        tiles.flush()
+        del tiles, pil
+        source.release()
+        if main_tile_cache.enabled:
+            # The key identifies the content, so it stands for the content hash of the (large) file
+            digest = hashlib.sha256(key.encode()).hexdigest()
+            path = main_tile_cache.put(key, path, digest=digest)
+            return cls._pinned(path, (width, height), digest)
+        store = cls(path, (width, height))
+        weakref.finalize(store, path.unlink, missing_ok=True)
+        return store
+
+    @classmethod
+    def _pinned(cls, path: Path, size: Tuple[int, int], digest: str) -> "TileStore":
+        """A store of a file in the tile cache, which is kept from eviction (by building other stores)
+        while the store is alive, as its tiles are read lazily (and by path, in other processes)."""
+        store = cls(path, size)
+        main_tile_cache.pin(digest)
+        weakref.finalize(store, main_tile_cache.unpin, digest)
+        return store
+
+    @property
+    def tiles(self) -> np.ndarray:
+        """The tiles, memory-mapped (read-only)"""
+        if self._tiles is None:
+            self._tiles = np.load(self.path, mmap_mode="r")
+        return self._tiles
+
+    @property
+    def tile_size(self) -> int:
+        return self.tiles.shape[2]
+
+    @property
+    def mode(self) -> str:
+        return {1: "L", 3: "RGB", 4: "RGBA"}[self.tiles.shape[-1]]
+
+    def read(self, box: Tuple[int, int, int, int], mode: str | None = None) -> Image.Image:
+        """The pixels of a region of the image, as PIL's crop returns them
+        (pixels outside the image are zero).
+
+        Args:
+          box: The region, as (x0, y0, x1, y1).
+          mode: The mode to convert the image's pixels to (before padding them with zeros).
+
+        Returns:
+          : The region's image.
+        """
+        x0, y0, x1, y1 = box
+        size = (max(0, x1 - x0), max(0, y1 - y0))
+        width, height = self.size
+        left, top, right, bottom = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if right <= left or bottom <= top:
+            return Image.new(mode or self.mode, size)
+        tiles = self.tiles
+        tile = self.tile_size
+        pixels = np.empty((bottom - top, right - left, tiles.shape[-1]), dtype=np.uint8)
+        for row in range(top // tile, (bottom - 1) // tile + 1):
+            for col in range(left // tile, (right - 1) // tile + 1):
+                ty, tx = row * tile, col * tile
+                sy0, sy1 = max(top, ty), min(bottom, ty + tile)
+                sx0, sx1 = max(left, tx), min(right, tx + tile)
+                pixels[sy0 - top:sy1 - top, sx0 - left:sx1 - left] = \
+                    tiles[row, col, sy0 - ty:sy1 - ty, sx0 - tx:sx1 - tx]
+        image = Image.fromarray(pixels[..., 0] if pixels.shape[-1] == 1 else pixels)
+        if mode is not None:
+            image = image.convert(mode)
+        if (left, top, right, bottom) == tuple(box):
+            return image
+        region = Image.new(image.mode, size)
+        region.paste(image, (left - x0, top - y0))
+        return region
+
+    def __getstate__(self):
+        return {"path": self.path, "size": self.size, "_tiles": None}
+
+
+def read_region(tiles: TileStore, box: Tuple[int, int, int, int],
+                grid: Tuple[Tuple[int, int], str, bool] | None = None) -> Image.Image:
+    """Reads a region of a tile store, with the grid of the whole image (see add_grid_region).
+    Module-level, so lazy regions can be sent to other processes.
+
+    Args:
+      tiles: The tile store.
+      box: The region, as (x0, y0, x1, y1).
+      grid: The grid size, color and antialiasing, or None for no grid.
+
+    Returns:
+      : The region's image.
+    """
+    if grid is None:
+        return tiles.read(box)
+    cells, color, antialias = grid
+    # As add_grid draws on the whole image, converted to RGBA
+    return add_grid_region(tiles.read(box, "RGBA"), box, tiles.size, cells, color, antialias=antialias)
@@ -1,20 +1,28 @@
+from contextlib import nullcontext
 
 import numpy as np
 
 from tokenpdf.canvas import make_canvas
+from tokenpdf.layouts import IncrementalLayout, token_keys
+from tokenpdf.pipeline.prepare import RecordingPage, final_images, image_pool, prepare_images
 from tokenpdf.utils.verbose import vprint, vtqdm
 from tokenpdf.utils.papersize import parse_papersize
+from tokenpdf.utils.timing import StageTimer, stage
 
 class CanvasManager:
     """Manages canvas creation and token and map placement."""
 
-    def __init__(self, config, loader, verbose):
+    def __init__(self, config, loader, verbose, timer: StageTimer | None = None):
         self.verbose = verbose
+        self.timer = timer if timer is not None else StageTimer()
         self.print = vprint(verbose)
         self.tqdm = vtqdm(verbose)
         self.loader = loader
         self.canvas = make_canvas(config)
         self.config = config
+        self.image_workers = max(1, int(config.get("image_workers", 1)))
+        self.stream_pages = bool(config.get("stream_pages", False))
+        self._prepared = []
         self.page_size, self.margin, self.page_size_margin, self.margin_r = self._calculate_page_size()
 
     def place_tokens(self, tokens, layout, maps, mapper):
@@ -41,10 +49,63 @@ class CanvasManager:
         token_margins = [(r, regular) for _, r, regular in sizesm]
 
         print("Arranging tokens in pages")
+        if isinstance(layout, IncrementalLayout):
+            layout.token_keys = token_keys([token_cfg for _, token_cfg in tokens])
         print(f"Page size: {self.page_size_margin}")
         #print(f"Token sizes: {sizes_with_margins}")
-        pages = layout.arrange(sizes_with_margins, self._gen_page_size(), verbose=verbose)
-        canvas_pages = self._make_pages(pages)
+        with self.timer.stage("layout"):
+            pages = layout.arrange(sizes_with_margins, self._gen_page_size(), verbose=verbose)
+        with self.timer.stage("draw"):
+            if self.stream_pages:
+                self._stream_pages(pages, tokens, sizes, token_margins, tqdm)
+                return
+            if self.image_workers > 1:
+                self.prepare_images(pages, tokens, sizes, token_margins)
+            canvas_pages = self._make_pages(pages)
+            self._draw_pages(pages, canvas_pages, tokens, sizes, token_margins, tqdm)
+
+    def _stream_pages(self, pages, tokens, sizes, token_margins, tqdm):
+        """Draws the pages one at a time, finishing each page (see Canvas.finish_page)
+        before the next one is created, so the canvas can write it out and release its images.
+        With image workers, the images of each page are prepared just before drawing it."""
+        pool = image_pool(self.image_workers) if self.image_workers > 1 else nullcontext()
+        with pool as executor:
+            for placement_page in tqdm(pages, desc="Drawing token pages"):
+                if executor is not None:
+                    self.prepare_images([placement_page], tokens, sizes, token_margins, executor)
+                canvas_page = self.canvas.create_page(self.page_size)
+                self._draw_pages([placement_page], [canvas_page], tokens, sizes, token_margins, vtqdm(False))
+                self.canvas.finish_page(canvas_page, verbose=self.verbose)
+                self._prepared = []
+
+    def prepare_images(self, pages, tokens, sizes, token_margins, executor=None):
+        """Computes the final images of all the tokens (filters, masks, downscaling)
+        in a process pool, before drawing them.
+        The tokens are first drawn on recording pages, to find the images they draw.
+
+        Args:
+          pages: The token placements, per page.
+          tokens: The tokens and their configurations.
+          sizes: The sizes of the tokens.
+          token_margins: The margins of the tokens.
+          executor: The pool to prepare the images in (a new pool if None).
+
+        Returns:
+          : The number of images computed.
+        """
+        print = vprint(self.verbose)
+        recording_pages = [RecordingPage(self.canvas, self.page_size) for _ in pages]
+        self._draw_pages(pages, recording_pages, tokens, sizes, token_margins, vtqdm(False))
+        # Keep the prepared images referenced until drawn, so drawing finds them
+        self._prepared = final_images([image for page in recording_pages for image in page.images])
+        with stage("prepare", images=len(self._prepared)):
+            computed = prepare_images(self._prepared, self.image_workers, self.tqdm, executor)
+        if computed and executor is None:
+            print(f"Prepared {computed} images with {self.image_workers} workers")
+        return computed
+
+    def _draw_pages(self, pages, canvas_pages, tokens, sizes, token_margins, tqdm):
+        """Draws the placed tokens on the pages."""
         for placement_page, canvas_page in zip(tqdm(pages, desc="Drawing token pages"),
                                                 canvas_pages):
             page_view = canvas_page.margin_view(self.margin_r, regular=True)
@@ -107,6 +168,7 @@ class CanvasManager:
         """Saves the canvas to a file."""
         self.canvas.save(verbose=self.verbose)
         self.canvas.cleanup()
+        self._prepared = []
 
     def _calculate_page_size(self):
         """ """
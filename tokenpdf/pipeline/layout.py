@@ -1,4 +1,4 @@
-from tokenpdf.layouts import make_layout
+from tokenpdf.layouts import make_layout, CachedLayout, IncrementalLayout, main_layout_cache
 from tokenpdf.maps import make_mapper
 from tokenpdf.utils.verbose import vprint
 
@@ -20,5 +20,10 @@ class LayoutManager:
         """ """
         print = self.print
         print("Creating layout and mapper...")
-        return make_layout(self.config), make_mapper(self.config)
+        layout = make_layout(self.config)
+        if main_layout_cache.enabled:
+            layout = CachedLayout(self.config, layout, main_layout_cache)
+        if self.config.get("layout_plan"):
+            layout = IncrementalLayout(self.config, layout, self.config["layout_plan"])
+        return layout, make_mapper(self.config)
 
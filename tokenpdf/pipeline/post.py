@@ -2,12 +2,9 @@
 from pathlib import Path
 from uuid import uuid4
 
-import pikepdf
-import PyPDF2
-
-
 from tokenpdf.utils.general import rename
 from tokenpdf.utils.verbose import vprint, vtqdm
+from tokenpdf.utils.timing import stage
 
 class FilePostProcess:
     """ """
@@ -30,10 +27,12 @@ class FilePostProcess:
             cleanup = config.get("cleanup", 1)
             if cleanup:
                 print("Cleaning up PDF...")
-                FilePostProcess.cleanup_pdf(path, verbose, level=cleanup)
+                with stage("cleanup"):
+                    FilePostProcess.cleanup_pdf(path, verbose, level=cleanup)
             if config.get("compress") and path.suffix == ".pdf":
                 print("Compressing PDF...")
-                FilePostProcess.compress_pdf(path, verbose)
+                with stage("compress"):
+                    FilePostProcess.compress_pdf(path, verbose)
 
 
 
@@ -64,6 +63,7 @@ class FilePostProcess:
         #level 3: Require XObject contents (images, forms, etc)
         #level 2: Require XObject node
         #level 1: Require Resources node
+        import PyPDF2
         pdf = PyPDF2.PdfReader(input_path)
         pdf_writer = PyPDF2.PdfWriter()
         for page in pdf.pages:
@@ -125,6 +125,7 @@ class FilePostProcess:
         Returns:
 
         """
+        import pikepdf
         progress = tqdm(desc="Compressing PDF", total=100)
         with pikepdf.open(input_path) as pdf:
             pdf.save(output_path,
@@ -135,6 +136,7 @@ class FilePostProcess:
 
     @staticmethod
     def compress_pdf_pypdf2(input_path, output_path, tqdm):
+        import PyPDF2
         pdf = PyPDF2.PdfReader(input_path)
         pdf_writer = PyPDF2.PdfWriter()
         for page in pdf.pages:
@@ -0,0 +1,105 @@
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import List, Sequence, Tuple
+from tokenpdf.canvas.canvas import CanvasPage
+from tokenpdf.image import TokenImage, FloatingImage
+import tokenpdf.image
+
+
+class RecordingPage(CanvasPage):
+    """A page that draws nothing, and records the images drawn on it
+    (after the page's own image optimization)."""
+
+    def __init__(self, canvas, size: Tuple[float, float]):
+        super().__init__(canvas, size)
+        self.images: List[TokenImage] = []
+
+    def _image(self, x, y, width, height, image, flip=(False, False), rotate=0):
+        self.images.append(image)
+
+
+def final_images(images: Sequence[TokenImage]) -> List[FloatingImage]:
+    """The lazy images that need computing to draw the images:
+    the images themselves, joined with their masks (as the canvases draw them).
+    Images already computed or in the derived image cache are skipped."""
+    pending = {}
+    for image in images:
+        if not isinstance(image, TokenImage):
+            continue
+        if image.masked:
+            image = image.join_mask()
+        fimage = image._img
+        if isinstance(fimage, FloatingImage) and fimage.needs_compute:
+            pending.setdefault(fimage.key, fimage)
+    return list(pending.values())
+
+
+def prepare_images(images: Sequence[FloatingImage], workers: int, tqdm=None,
+                   executor: Executor | None = None) -> int:
+    """Computes lazy images in a process pool.
+    The results are set on the images, so drawing them only places finished pixels.
+
+    Args:
+        images: The lazy images to compute.
+        workers: The number of worker processes.
+        tqdm: Progress bar wrapper (optional).
+        executor: A pool to compute the images in (see image_pool),
+                  rather than a new pool for these images.
+
+    Returns:
+        : The number of images computed.
+    """
+    if not images:
+        return 0
+    pool = nullcontext(executor) if executor is not None else image_pool(min(workers, len(images)))
+    with pool as executor:
+        results = executor.map(_compute, images)
+        if tqdm is not None:
+            results = tqdm(results, total=len(images), desc="Preparing images")
+        for image, (kind, result) in zip(images, results):
+            if kind == "path":
+                image._set_cached(result)
+            else:
+                image._set_computed(result)
+    # The workers don't evict (they would remove each other's results), so the budget is enforced once here.
+    # Results evicted nonetheless (the batch exceeds the budget, or another process evicted them)
+    # are computed again when drawn.
+    tokenpdf.image.main_derived_cache.evict()
+    for image in images:
+        image._restore_evicted()
+    return len(images)
+
+
+@contextmanager
+def image_pool(workers: int):
+    """A process pool of workers for prepare_images,
+    set up with the derived image cache of this process."""
+    cache = tokenpdf.image.main_derived_cache
+    cache_settings = (cache.enabled, str(cache.folder))
+    # Spawned (rather than forked) workers, as the parent may hold ONNX sessions and threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=cache_settings) as executor:
+        yield executor
+
+
+def _init_worker(cache_enabled: bool, cache_folder: str):
+    cache = tokenpdf.image.main_derived_cache
+    cache.folder = Path(cache_folder)
+    # No eviction in the workers (see prepare_images)
+    cache.max_bytes = None
+    if cache_enabled:
+        cache.enable()
+    else:
+        cache.disable()
+
+
+def _compute(image: FloatingImage):
+    """Computes a lazy image in a worker. Persisted images are returned by their
+    path in the derived image cache, others by their pixels."""
+    image._resolve()
+    if "perm_path" in image._sources:
+        return "path", image._sources["perm_path"]
+    return "image", image.as_pil()
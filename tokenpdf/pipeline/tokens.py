@@ -15,6 +15,7 @@ class TokenMaker:
         """ """
         # Make tokens from config
         tokens_data = self.loader.generate_tokens(self.config)
+        self.loader.prepare_filters(tokens_data, verbose=self.verbose)
         tokens = [make_token(token_config, self.loader)
                 for token_config in self.tqdm(tokens_data, desc="Loading tokens")]
         return tokens
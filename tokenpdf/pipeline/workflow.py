@@ -1,73 +1,280 @@
+import logging
+import multiprocessing
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from queue import Empty
+from time import perf_counter
+from typing import Any, Dict, List
+
 from .tokens import TokenMaker
 from .canvas import CanvasManager
 from .layout import LayoutManager
 from .post import FilePostProcess
 from tokenpdf.resources import ResourceLoader
+from tokenpdf.image import main_image_cache, main_derived_cache, derived_images, image_stats
+from tokenpdf.layouts import main_layout_cache
+from tokenpdf.maps import main_tile_cache
+from tokenpdf.canvas.canvas import main_page_cache
 from tokenpdf.utils.verbose import vtqdm, vprint
+from tokenpdf.utils.timing import StageTimer, rebase_events, save_trace, trace_origin
+
+logger = logging.getLogger(__name__)
+# The outcome of a configuration task: its output file, stage times (and profile summary),
+# run time in seconds, and the formatted traceback if it failed (None if it succeeded)
+TaskResult = namedtuple("TaskResult", ["label", "output_file", "stages", "summary", "time", "error"])
+
+
+class TaskError(RuntimeError):
+    """Raised when some configuration tasks failed (after all the tasks ran).
+
+    Args:
+        results: The results of all the tasks.
+    """
+    def __init__(self, results: List[TaskResult]):
+        self.results = results
+        failed = [result for result in results if result.error is not None]
+        super().__init__(f"{len(failed)} of {len(results)} tasks failed: "
+                         + ", ".join(result.label for result in failed))
+
 
 class WorkflowManager:
     """Coordinates the overall workflow for generating RPG token PDFs."""
     NAMED_VARIABLES = {'ps':'page_size'}
-    def __init__(self, *config_paths, output_file=None, verbose=None):
+    def __init__(self, *config_paths, output_file=None, verbose=None, profile=None, profile_memory=False,
+                 tasks: List[Dict[str, Any]] | None = None):
         self.loader = ResourceLoader()
         
-        self.config_tasks = self.loader.load_configs(config_paths)
+        # The configuration tasks are given directly to task workers
+        self.config_tasks = self.loader.load_configs(config_paths) if tasks is None else tasks
         if isinstance(self.config_tasks, dict):
             self.config_tasks = [self.config_tasks]
         self.config = self.config_tasks[0]
         self.verbose = verbose if verbose is not None else self.config.get("verbose", False)
         self.print = vprint(self.verbose)
         self.requested_output_file = output_file
+        self.timings = []  # Stage times (in seconds) of each configuration task
+        # Profiling: trace events and per-stage memory, written to the profile path
+        self.profile = profile
+        self.profile_memory = profile_memory
+        self._trace_events = [] if profile else None
+        self._profiles = []
+        self.results: List[TaskResult] = []
+        # Called with the name of each stage of a task as it starts (see _run_one)
+        self.progress = None
 
 
     def _generate_output_path(self):
-        if self.requested_output_file:
-            self.config['output_file'] = self.requested_output_file
-        elif 'output_file' not in self.config:
-            self.config['output_file'] = self.config.get('output', 'output.pdf')
-        for n, fn in self.NAMED_VARIABLES.items():
-            if '{' + n + '}' in self.config['output_file']:
-                self.config['output_file'] = self.config['output_file'].format(**{n: self.config[fn]})
-        
-        
+        self.config['output_file'] = self._output_path(self.config)
 
     def reset(self):
         self._generate_output_path()
+        main_image_cache.configure(self.config, "image_cache")
+        main_derived_cache.configure(self.config, "derived_cache")
+        main_layout_cache.configure(self.config, "layout_cache")
+        main_page_cache.configure(self.config, "page_cache", default=False)
+        main_tile_cache.configure(self.config, "tile_cache")
+        self.timer = StageTimer(self._trace_events, memory=self.profile_memory, counters=image_stats.copy)
+        self.timings.append(self.timer.stages)
         self.layout = LayoutManager(self.config, self.verbose)
         self.tokens = TokenMaker(self.config, self.loader)
-        self.canvas = CanvasManager(self.config, self.loader, self.verbose)
+        self.canvas = CanvasManager(self.config, self.loader, self.verbose, self.timer)
 
     def run(self):
         """Executes the complete flow for token generation
-        Possibly multiple times if multiple configuration tasks are present."""
-        for config in self.config_tasks:
-            self.config = config.copy()
-            self.loader._cfg = self.config
+        Possibly multiple times if multiple configuration tasks are present,
+        in parallel worker processes with `task_workers`.
+        A failed task doesn't stop the other tasks: TaskError is raised once they are done."""
+        tasks = self.config_tasks
+        workers = min(max(1, int(self.config.get("task_workers", 1))), len(tasks))
+        if workers > 1 and len({self._output_path(config) for config in tasks}) < len(tasks):
+            logger.warning("Configuration tasks write the same output file, running them one at a time")
+            workers = 1
+        if workers > 1:
+            self.results = self._run_parallel(workers)
+        else:
+            self.results = [self.run_task(config, isolate_errors=len(tasks) > 1) for config in tasks]
+        if len(tasks) > 1:
+            for result in self.results:
+                if result.error is None:
+                    self.print(f"Task {result.label}: {result.output_file} in {result.time:.2f}s")
+                else:
+                    logger.error(f"Task {result.label} failed:\n{result.error}")
+        if self.profile:
+            save_trace(self.profile, self._trace_events, {"stages": self._profiles})
+            self.print(f"Profile written to {self.profile}")
+        if any(result.error is not None for result in self.results):
+            raise TaskError(self.results)
+
+    def run_task(self, config: Dict[str, Any], isolate_errors: bool = False) -> TaskResult:
+        """Executes the complete flow for a single configuration task.
+
+        Args:
+            config: The configuration of the task.
+            isolate_errors: Return a failure as the result's error, instead of raising it.
+
+        Returns:
+            : The result of the task.
+        """
+        self.config = config.copy()
+        self.loader._cfg = self.config
+        self.timer = None
+        start = perf_counter()
+        error = None
+        try:
             self.reset()
-            self._run_one()
+            with self.timer.activate():
+                self._run_one()
+        except Exception:
+            if not isolate_errors:
+                raise
+            error = traceback.format_exc()
+        stages, summary = (self.timer.stages, self.timer.summary()) if self.timer is not None else ({}, {})
+        self._profiles.append(summary)
+        return TaskResult(task_label(config), self.config.get("output_file"), stages, summary,
+                          perf_counter() - start, error)
+
+    def _run_parallel(self, workers: int) -> List[TaskResult]:
+        """Runs the configuration tasks in a pool of worker processes, showing the stage of each task.
+        Remote resources are downloaded once beforehand, to the image cache the workers share."""
+        tasks = self.config_tasks
+        self._prefetch_shared()
+        options = {"output_file": self.requested_output_file, "profile_memory": self.profile_memory}
+        # The workers' trace events are made relative to this process's origin
+        trace = trace_origin() if self._trace_events is not None else None
+        labels = [task_label(config) for config in tasks]
+        states = ["queued"] * len(tasks)
+        results = [None] * len(tasks)
+        # Spawned (rather than forked) workers, as the parent may hold ONNX sessions and threads
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager, \
+                ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            progress = manager.Queue()
+            futures = {executor.submit(_run_task_worker, config, i, options, trace, progress): i
+                       for i, config in enumerate(tasks)}
+            pending = set(futures)
+            with vtqdm(self.verbose)(total=len(tasks), desc="Tasks") as bar:
+                while pending:
+                    done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    while True:
+                        try:
+                            index, state = progress.get_nowait()
+                        except Empty:
+                            break
+                        states[index] = state
+                    for future in done:
+                        index = futures[future]
+                        try:
+                            results[index], events = future.result()
+                        except Exception:
+                            # The worker itself failed (e.g. it was killed)
+                            results[index] = TaskResult(labels[index], None, {}, {}, 0.0,
+                                                        traceback.format_exc())
+                            events = None
+                        states[index] = "failed" if results[index].error else "done"
+                        if events:
+                            self._trace_events.extend(events)
+                        bar.update(1)
+                    bar.set_postfix_str(", ".join(f"{label}: {state}" for label, state in zip(labels, states)))
+        self.timings = [result.stages for result in results]
+        self._profiles = [result.summary for result in results]
+        return results
+
+    def _prefetch_shared(self):
+        """Downloads the remote resources of the tasks to the image cache (if enabled),
+        so the task workers find them there instead of each downloading them."""
+        self.config = self.config_tasks[0].copy()
+        self.loader._cfg = self.config
+        main_image_cache.configure(self.config, "image_cache")
+        if not main_image_cache.enabled:
+            return
+        self.loader.load_resources()
+        downloaded = self.loader.prefetch_resources(verbose=self.verbose)
+        if downloaded:
+            self.print(f"Downloaded {downloaded} remote resources")
+
+    def _output_path(self, config: Dict[str, Any]) -> str:
+        """The output file of a configuration task."""
+        if self.requested_output_file:
+            path = self.requested_output_file
+        else:
+            path = config.get('output_file', config.get('output', 'output.pdf'))
+        for n, fn in self.NAMED_VARIABLES.items():
+            if '{' + n + '}' in path:
+                path = path.format(**{n: config[fn]})
+        return path
 
     def _run_one(self):
         """Executes the complete flow for token generation."""
 
         print = self.print
+        stage = self._stage
         print("Starting workflow...")
         print("Loading resources...")
-        self.loader.load_resources()
-        print(f"Loaded {len(self.loader.resources)} resources")
+        with stage("load"):
+            self.loader.load_resources()
+            print(f"Loaded {len(self.loader.resources)} resources")
+            downloaded = self.loader.prefetch_resources(verbose=self.verbose)
+        if downloaded:
+            print(f"Downloaded {downloaded} remote resources")
         
         print("Creating layout...")
         layout, mapper = self.layout.make_layout()
         print("Generating token objects...")
-        maps = self.tokens.make_maps()
-        tokens = self.tokens.make_tokens()
+        with stage("tokens"):
+            maps = self.tokens.make_maps()
+            tokens = self.tokens.make_tokens()
         print(f"Generated {len(tokens)} token objects")
 
         print(f"Placing {len(tokens)} tokens")
         self.canvas.place_tokens(tokens, layout, maps, mapper)
 
         print(f"Saving output to {self.config['output_file']}")
-        self.canvas.save()
+        with stage("save"):
+            self.canvas.save()
         print(f"Post-processing {self.config['output_file']}")
-        FilePostProcess.process(self.config['output_file'], self.config, self.loader)
+        with stage("post"):
+            FilePostProcess.process(self.config['output_file'], self.config, self.loader)
         print("Done, cleaning up...")
         self.loader.cleanup()
+        if main_image_cache.enabled:
+            print(f"Image cache: {main_image_cache.stats}")
+        if main_derived_cache.enabled:
+            print(f"Derived image cache: {main_derived_cache.stats}, in-memory hits: {derived_images.hits}")
+        if main_layout_cache.enabled:
+            stats = main_layout_cache.stats
+            lookups = stats["hits"] + stats["misses"]
+            print(f"Layout cache: {stats}, hit rate: {stats['hits'] / lookups if lookups else 0:.0%}")
+        if main_page_cache.enabled:
+            print(f"Page cache: {main_page_cache.stats}")
+        if main_tile_cache.enabled:
+            print(f"Map tile cache: {main_tile_cache.stats}")
+        print("Stage times: " + ", ".join(f"{path} {time:.2f}s" for path, time in self.timer.stages.items()
+                                          if "/" not in path))
+
+    def _stage(self, name: str):
+        """Times a stage of the task, reporting its start to the progress callback (if any)."""
+        if self.progress is not None:
+            self.progress(name)
+        return self.timer.stage(name)
+
+
+def task_label(config: Dict[str, Any]) -> str:
+    """A short description of a configuration task, by its values of the cross-product keys."""
+    return ", ".join(f"{key}={config.get(key)}" for key in ResourceLoader.CROSS_PRODUCT_KEYS)
+
+
+def _run_task_worker(config: Dict[str, Any], index: int, options: Dict[str, Any], trace: float | None, progress):
+    """Runs a configuration task in a worker process, reporting its stages to the progress queue.
+    Returns the task's result, and its trace events (if traced: trace is the parent's trace origin,
+    which the events are made relative to)."""
+    # Only the parent prints (see WorkflowManager._run_parallel)
+    config = dict(config, verbose=False)
+    workflow = WorkflowManager(tasks=[config], verbose=False, **options)
+    if trace is not None:
+        workflow._trace_events = []
+    workflow.progress = lambda name: progress.put((index, name))
+    result = workflow.run_task(config, isolate_errors=True)
+    if trace is not None:
+        rebase_events(workflow._trace_events, trace)
+    return result, workflow._trace_events
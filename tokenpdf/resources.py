@@ -1,16 +1,27 @@
 import itertools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Dict, Any, List, Sequence
 import numpy as np
 from tokenpdf.utils.config import merge_configs
 from tokenpdf.utils.image import get_file_dimensions, complete_size
 from tokenpdf.utils.verbose import vprint, vtqdm
-from tokenpdf.utils.io import download_file
+from tokenpdf.utils.io import download_file, http_session
+from tokenpdf.utils.cache import MemoryLRU
 from tokenpdf.systems import registry as system_registry
 from tokenpdf.maps import Map
 from .image import TokenImage
+from tokenpdf.filters import apply_imagefilters_batch
 import tokenpdf.utils.config as config
 
+logger = logging.getLogger(__name__)
+DEFAULT_DOWNLOAD_WORKERS = 8
+SOURCE_MEMORY_ITEMS = 64
+# Local image files loaded by any loader, by path and file version, so a long-running process
+# (see tokenpdf.daemon) reuses their decoded pixels in later runs
+source_images = MemoryLRU(SOURCE_MEMORY_ITEMS)
 class ResourceLoader:
     """A class responsible for loading resources, including configuration files."""
     CROSS_PRODUCT_KEYS = ["page_size"]
@@ -18,8 +29,14 @@ class ResourceLoader:
         self._local_files = []
         self._cfg = {}
         self._resources = {}
+        self._filtered = {}
         self._systems = system_registry
 
+    @property
+    def config(self) -> Dict[str, Any]:
+        """The current configuration."""
+        return self._cfg
+
     def load_config(self, file_path: str) -> Dict[str, Any]:
         """Loads a single configuration file in JSON, YAML, or TOML format.
 
@@ -250,8 +267,97 @@ class ResourceLoader:
         self._resources = resources
         return resources
     
+    def prefetch_resources(self, resources: Dict[str, Any] = None, verbose=None) -> int:
+        """Downloads all remote resources that were not downloaded yet,
+        concurrently, with a bounded number of workers.
+        Downloads are stored in the main image cache, so later stages find them on disk.
+
+        Args:
+          resources: The resources to prefetch (Default: all loaded resources)
+          verbose:  (Default value = None)
+
+        Returns:
+          : The number of resources downloaded.
+
+        """
+        resources = resources if resources is not None else self._resources
+        if verbose is None:
+            verbose = self._cfg.get("verbose", False)
+        workers = max(1, int(self._cfg.get("download_workers", DEFAULT_DOWNLOAD_WORKERS)))
+        pending = [(url, image) for url, image in resources.items()
+                   if isinstance(image, TokenImage) and image.needs_download]
+        if not pending:
+            return 0
+        # Make sure the shared session can hold a connection per worker
+        http_session(workers)
+        tqdm = vtqdm(verbose)
+        downloaded = 0
+        with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {executor.submit(image.prefetch): url for url, image in pending}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading resources"):
+                try:
+                    future.result()
+                    downloaded += 1
+                except Exception as e:
+                    # The resource may be unused, so we don't fail here.
+                    # If it is used, the download is retried (and fails) on first access.
+                    logger.warning(f"Failed to prefetch {futures[future]}: {e}")
+        return downloaded
+
     def __getitem__(self, key):
         return self._resources[key]
+
+    def filtered(self, key: str, filters: Sequence[str] | Dict[str, Dict]) -> TokenImage:
+        """Returns a resource with image filters applied.
+        Filtered images are memoized per resource and filters.
+
+        Args:
+          key: The resource key (URL).
+          filters: The filters to apply (see TokenImage.filters)
+
+        Returns:
+          : The filtered image.
+
+        """
+        if not filters:
+            return self[key]
+        memo_key = (key, _filters_key(filters))
+        if memo_key not in self._filtered:
+            self._filtered[memo_key] = self[key].filters(filters, self)
+        return self._filtered[memo_key]
+
+    def prepare_filters(self, tokens: Sequence[Dict[str, Any]], verbose=None) -> int:
+        """Applies the image filters of all the tokens ahead of drawing them.
+        Images with the same filters are filtered together, so filters can batch
+        their work (e.g. background removal) over all of them.
+
+        Args:
+          tokens: The token specifications (see generate_tokens).
+          verbose:  (Default value = None)
+
+        Returns:
+          : The number of filtered images prepared.
+
+        """
+        if verbose is None:
+            verbose = self._cfg.get("verbose", False)
+        groups = {}
+        for token in tokens:
+            filters = token.get("filters")
+            if not filters:
+                continue
+            filters_key = _filters_key(filters)
+            for key in (token.get("image_url"), token.get("border_url")):
+                if key in self._resources and (key, filters_key) not in self._filtered:
+                    groups.setdefault(filters_key, (filters, {}))[1][key] = None
+        prepared = 0
+        tqdm = vtqdm(verbose)
+        for filters_key, (filters, keys) in tqdm(groups.items(), desc="Applying image filters"):
+            keys = list(keys)
+            images = apply_imagefilters_batch([self[key] for key in keys], filters, self)
+            self._filtered.update({(key, filters_key): image for key, image in zip(keys, images)})
+            prepared += len(keys)
+        return prepared
     
     def load_resource(self, url: str, verbose=False) -> TokenImage:
         """Saves a local copy of the resource (if needed) and returns the path.
@@ -284,8 +390,17 @@ class ResourceLoader:
             path_or_url = find_local_path(Path(url), config_files, verbose)
         
         
-        # Download the resource from the URL
-        return TokenImage(path_or_url, None, default_suffix=".png", **pil_save_kw)
+        if isinstance(path_or_url, str) or not Path(path_or_url).is_file():
+            # Download the resource from the URL
+            return TokenImage(path_or_url, None, default_suffix=".png", **pil_save_kw)
+        path = Path(path_or_url).resolve()
+        stat = path.stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size, optimize_images_quality)
+        image = source_images.get(key)
+        if image is None:
+            image = TokenImage(path_or_url, None, default_suffix=".png", **pil_save_kw)
+            source_images[key] = image
+        return image
     
     def cleanup(self):
         """Cleans up temporary files created during resource loading."""
@@ -322,6 +437,9 @@ def _download(url: str, file_path: str,
 
 
 
+def _filters_key(filters: Sequence[str] | Dict[str, Dict]) -> str:
+    return json.dumps(filters, sort_keys=True, default=str)
+
 def random_ratio(mu, sigma, rng):
     """Generates a random ratio, log-normally distributed around a mean.
 
@@ -18,7 +18,7 @@ class CircleToken(Token, name="circle"):
             "circle": {
                 "radius": None, "border_color": "black", "fill_color": "white",
                 "image_url": None, "border_url": None, "keep_aspect_ratio": True,
-                "mask": "circle"
+                "mask": "circle", "mask_antialias": False
             }
         }
 
@@ -68,7 +68,7 @@ class CircleToken(Token, name="circle"):
         mask = config.get("mask")
         max_dim = max(dims)
         if mask == "circle":
-            return circle_mask(max_dim // 2)
+            return circle_mask(max_dim // 2, config.get("mask_antialias", False))
         else:
             return None
 
@@ -80,7 +80,7 @@ class Token(RegistryClass):
     def get_image(self, resources, key, config=None):
         if config is None:
             config = self.config
-        return resources[key].filters(config.get("filters", {}), resources)
+        return resources.filtered(key, config.get("filters", {}))
     
 
 
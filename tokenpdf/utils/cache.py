@@ -0,0 +1,328 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, namedtuple, OrderedDict
+from pathlib import Path
+from typing import Any, Dict
+from uuid import uuid4
+
+DEFAULT_MAX_BYTES = 2 << 30
+
+CacheEntry = namedtuple("CacheEntry", ["path", "digest", "etag", "last_modified"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    suffix TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL REFERENCES blobs(digest) ON DELETE CASCADE,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs(accessed);
+CREATE INDEX IF NOT EXISTS entries_digest ON entries(digest);
+"""
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    """ Returns the sha256 hex digest of a file's content """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PersistentCache:
+    """A persistent, content-addressed file cache.
+
+    Files are stored once per content hash, and any number of keys (e.g. source URLs)
+    can refer to the same file. The index is an SQLite database, so every update
+    is an incremental, atomic transaction (and the cache can be shared between processes).
+    When the total size of the stored files exceeds max_bytes, the least recently used
+    files are evicted, except files pinned by this process (see pin).
+
+    Args:
+        folder: The folder to store the files and the index in.
+        enabled: If False, the cache acts as always empty.
+        max_bytes: The size budget of the stored files. None or 0 for unlimited.
+    """
+    def __init__(self, folder: Path, enabled: bool = True, max_bytes: int | None = DEFAULT_MAX_BYTES):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._db = None
+        self._pinned = Counter()  # Digests of files in use, which are not evicted
+        if enabled:
+            self.enable()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def configure(self, config: Dict, name: str, default: bool = True):
+        """Applies the cache settings of a configuration:
+        "<name>" enables or disables the cache (default if missing),
+        and "<name>_max_bytes" sets its size budget."""
+        self.max_bytes = config.get(f"{name}_max_bytes", self.max_bytes)
+        if config.get(name, default):
+            self.enable()
+        else:
+            self.disable()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._db is None or self._db_pid != os.getpid():
+                # Connections can't be shared with forked processes
+                self.folder.mkdir(parents=True, exist_ok=True)
+                db = sqlite3.connect(self.folder / "index.sqlite", timeout=30,
+                                     check_same_thread=False, isolation_level=None)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA foreign_keys=ON")
+                db.executescript(_SCHEMA)
+                self._db, self._db_pid = db, os.getpid()
+            return self._db
+
+    def entry(self, key: str, count: bool = True) -> CacheEntry | None:
+        """Returns the cache entry of the key, or None (a miss).
+        A hit marks the entry's file as recently used.
+        If count is False, the hit/miss counters are left for the caller to update."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self.db.execute(
+                "SELECT e.digest, b.suffix, e.etag, e.last_modified FROM entries e "
+                "JOIN blobs b ON b.digest = e.digest WHERE e.key = ?", (key,)).fetchone()
+            if row is not None:
+                digest, suffix, etag, last_modified = row
+                path = self._blob_path(digest, suffix)
+                if path.exists():
+                    self.db.execute("UPDATE blobs SET accessed = ? WHERE digest = ?", (time.time(), digest))
+                    self.hits += count
+                    return CacheEntry(path, digest, etag, last_modified)
+                # Shouldn't get here normally, unless manually deleted
+                self._remove_blob(digest)
+            self.misses += count
+            return None
+
+    def get(self, key: str) -> Path:
+        """Returns the path of the cached file of the key. Raises KeyError on a miss."""
+        entry = self.entry(key)
+        if entry is None:
+            raise KeyError(f"Key {key} not found in cache.")
+        return entry.path
+
+    def has(self, key: str) -> bool:
+        """Checks if the key is in the cache, without affecting statistics or recency."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            row = self.db.execute(
+                "SELECT e.digest, b.suffix FROM entries e JOIN blobs b ON b.digest = e.digest "
+                "WHERE e.key = ?", (key,)).fetchone()
+        return row is not None and self._blob_path(*row).exists()
+
+    def temp_path(self, suffix: str = "", name: str | None = None) -> Path:
+        """Returns a path in the cache's folder for writing a file that will be put in the cache.
+        If name is given, the path is deterministic (e.g. to resume partial downloads)."""
+        folder = self.folder / "tmp"
+        folder.mkdir(parents=True, exist_ok=True)
+        if name is None:
+            name = uuid4().hex
+        return folder / f"{name}{suffix}"
+
+    def put(self, key: str, path: Path, etag: str | None = None, last_modified: str | None = None,
+            digest: str | None = None) -> Path:
+        """Moves a file into the cache under the key, and returns its new path.
+        If a file with the same content is already stored, the given file is deleted
+        and the key refers to the stored one.
+
+        Args:
+            key: The key of the file (e.g. the source URL).
+            path: The file to store. It is moved (not copied) into the cache.
+            etag, last_modified: Optional validators of the source, for revalidation.
+            digest: The content hash of the file, if already known.
+        """
+        path = Path(path)
+        if not self.enabled:
+            return path
+        if digest is None:
+            digest = file_digest(path)
+        suffix = path.suffix
+        with self._lock:
+            db = self.db
+            row = db.execute("SELECT suffix FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is not None and self._blob_path(digest, row[0]).exists():
+                suffix = row[0]
+                path.unlink()
+            else:
+                # Move the file in before indexing it, so the index never refers to a missing file
+                os.replace(path, self._blob_path(digest, suffix))
+            size = self._blob_path(digest, suffix).stat().st_size
+            # The file the key referred to before, which may no longer be referred to
+            previous = db.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            with db:
+                db.execute("BEGIN IMMEDIATE")
+                db.execute("INSERT INTO blobs (digest, suffix, size, accessed) VALUES (?, ?, ?, ?) "
+                           "ON CONFLICT(digest) DO UPDATE SET suffix = excluded.suffix, "
+                           "size = excluded.size, accessed = excluded.accessed",
+                           (digest, suffix, size, time.time()))
+                db.execute("INSERT OR REPLACE INTO entries (key, digest, etag, last_modified) "
+                           "VALUES (?, ?, ?, ?)", (key, digest, etag, last_modified))
+            if previous is not None and previous[0] != digest:
+                self._remove_if_orphan(previous[0])
+            self.evict(keep=digest)
+            return self._blob_path(digest, suffix)
+
+    def evict(self, max_bytes: int | None = None, keep: str | None = None) -> int:
+        """Evicts least recently used files until the total size is within the budget.
+
+        Args:
+            max_bytes: The budget. (Default: self.max_bytes)
+            keep: A digest that should not be evicted (e.g. the file just stored).
+
+        Returns:
+            : The number of files evicted.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if not self.enabled or not max_bytes:
+            return 0
+        evicted = 0
+        with self._lock:
+            total = self.total_bytes
+            if total <= max_bytes:
+                return 0
+            rows = self.db.execute("SELECT digest, size FROM blobs ORDER BY accessed ASC").fetchall()
+            for digest, size in rows:
+                if total <= max_bytes:
+                    break
+                if digest == keep or digest in self._pinned:
+                    continue
+                self._remove_blob(digest)
+                total -= size
+                evicted += 1
+            self.evictions += evicted
+        return evicted
+
+    def pin(self, digest: str):
+        """Keeps a stored file from being evicted (by this process) while it is in use,
+        e.g. a file that is read lazily. Pins are counted: each pin needs an unpin."""
+        with self._lock:
+            self._pinned[digest] += 1
+
+    def unpin(self, digest: str):
+        """Releases a pin of a stored file (see pin)."""
+        with self._lock:
+            self._pinned[digest] -= 1
+            if self._pinned[digest] <= 0:
+                del self._pinned[digest]
+
+    def remove(self, key: str):
+        """Removes a key from the cache. Its file is deleted if no other key refers to it."""
+        if not self.enabled:
+            return
+        with self._lock:
+            row = self.db.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            if row is not None:
+                self._remove_if_orphan(row[0])
+
+    def clear(self):
+        """Removes all files and keys from the cache."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for digest, in self.db.execute("SELECT digest FROM blobs").fetchall():
+                self._remove_blob(digest)
+
+    @property
+    def total_bytes(self) -> int:
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters (of this process) and the cache's current size."""
+        if not self.enabled:
+            count = 0
+        else:
+            with self._lock:
+                count = self.db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "files": count, "bytes": self.total_bytes}
+
+    def __getitem__(self, key: str) -> Path:
+        return self.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return self.has(key)
+
+    def _blob_path(self, digest: str, suffix: str) -> Path:
+        return self.folder / f"{digest}{suffix}"
+
+    def _remove_blob(self, digest: str):
+        row = self.db.execute("SELECT suffix FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        # Unindex before deleting, so the index never refers to a missing file
+        self.db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        if row is not None:
+            self._blob_path(digest, row[0]).unlink(missing_ok=True)
+
+    def _remove_if_orphan(self, digest: str):
+        """Removes a file if no key refers to it anymore (uses the entries' digest index)."""
+        if self.db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+            self._remove_blob(digest)
+
+
+class MemoryLRU:
+    """A bounded in-memory mapping, discarding the least recently used items.
+
+    Args:
+        max_items: The maximal number of items kept.
+    """
+    def __init__(self, max_items: int = 128):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
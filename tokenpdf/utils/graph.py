@@ -1,5 +1,5 @@
-import networkx as nx
-from typing import Any, Callable, List, Sequence
+import numpy as np
+from typing import Any, Callable, List, Sequence, Tuple
 
 def largest_connected_component(
         items: Sequence[Any],
@@ -17,6 +17,8 @@ def largest_connected_component(
       : A list of items in the largest connected component.
 
     """
+    # networkx is slow to import, and only needed here
+    import networkx as nx
     graph = nx.Graph()
     graph.add_nodes_from(items)
     for i, item1 in enumerate(items):
@@ -25,3 +27,32 @@ def largest_connected_component(
                 graph.add_edge(item1, item2)
     components = list(nx.connected_components(graph))
     return max(components, key=len) if components else []
+
+
+def connected_components(count: int, edges: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Labels the connected components of a graph, with a vectorized union-find:
+    the roots of the endpoints of every edge are joined (the larger root under the smaller one),
+    until all edges are within components.
+
+    Args:
+      count: The number of nodes (0 to count-1).
+      edges: The two arrays of the edges' endpoints.
+
+    Returns:
+      : The component label of each node, which is the smallest node of its component.
+
+    """
+    parent = np.arange(count)
+    u, v = (np.asarray(e, dtype=int) for e in edges)
+    while True:
+        # Point every node at its root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        ru, rv = parent[u], parent[v]
+        differ = ru != rv
+        if not differ.any():
+            return parent
+        np.minimum.at(parent, np.maximum(ru, rv)[differ], np.minimum(ru, rv)[differ])
@@ -1,13 +1,13 @@
 from functools import lru_cache
+import math
 from re import I
-from PIL import Image
+from PIL import Image, ImageColor
 from pathlib import Path
-from typing import Tuple
+from typing import Tuple, List, Sequence
 from httpx import post
 import logging
 import numpy as np
-import cv2
-from .rembg import can_use_rembg, rembg_remove
+from .rembg import can_use_rembg, rembg_installed, rembg_remove, rembg_remove_batch, DEFAULT_BATCH_SIZE
 logger = logging.getLogger(__name__)
 
 def get_file_dimensions(file_path: str | Image.Image) -> Tuple[int, int]:
@@ -154,22 +154,55 @@ def join_mask_channel(image: Image.Image, mask: np.ndarray,
     image.putalpha(mask_image)
     return image
 
-def circle_mask(radius):
+def circle_mask(radius, antialias: bool = False) -> Image.Image:
     """
-    Creates a circular boolean mask of size (2*radius, 2*radius), as a PIL image.
+    Creates a circular mask of size (2*radius, 2*radius), as a PIL image.
+    Masks are cached by radius and antialiasing, so repeated tokens of the same size share their mask.
+    The returned image is shared, and must not be modified in place.
 
     Args:
       radius: The radius of the circle, in pixels.
+      antialias: If True, the edge pixels are partially transparent, by their distance from the circle.
 
     Returns:
-        : The mask as a uint8 PIL image (0 for False, 255 for True).
+        : The mask as a uint8 PIL image (0 outside the circle, 255 inside).
 
     """
-    x = np.linspace(-radius, radius, np.round(2 * radius).astype(int))
-    y = np.linspace(-radius, radius, np.round(2 * radius).astype(int))
-    X, Y = np.meshgrid(x, y)
-    mask = X**2 + Y**2 <= radius**2
-    return to_image(mask)
+    return _circle_mask_image(int(np.round(2 * radius)), bool(antialias))
+
+
+@lru_cache(maxsize=64)
+def _circle_mask_image(size: int, antialias: bool) -> Image.Image:
+    """ Builds a circle mask of size x size pixels, row by row.
+    Pixel centers are spread evenly over [-radius, radius] (as with np.linspace), so in units of half
+    the pixel spacing, pixel i is at 2i - m (where m = size - 1) and the circle's radius is m.
+    This keeps the hard edge in exact integer arithmetic. """
+    mask = np.zeros((size, size), dtype=np.uint8)
+    m = size - 1
+    if m <= 0:
+        return Image.fromarray(mask)
+    for row in range(size):
+        dy2 = (2 * row - m) ** 2
+        if dy2 <= m * m:
+            # |2i - m| <= half  <=>  (m - half) / 2 <= i <= (m + half) / 2
+            half = math.isqrt(m * m - dy2)
+            mask[row, (m - half + 1) // 2:(m + half) // 2 + 1] = 255
+    if antialias:
+        _antialias_circle_edge(mask, m)
+    return Image.fromarray(mask)
+
+
+def _antialias_circle_edge(mask: np.ndarray, m: int):
+    """ Sets the coverage of the pixels within half a pixel of the circle's edge,
+    as 0.5 + (radius - distance), clipped to [0, 1]. """
+    radius = m / 2  # In pixel spacings
+    x = np.arange(mask.shape[1]) - radius
+    for row in range(mask.shape[0]):
+        dist = np.hypot(x, row - radius)
+        band = np.abs(dist - radius) < 0.5
+        coverage = np.clip(radius + 0.5 - dist[band], 0, 1)
+        mask[row, band] = np.round(coverage * 255).astype(np.uint8)
+
 
 def to_image(obj: Image.Image | Path | str | np.ndarray) -> Image.Image:
     """
@@ -197,38 +230,100 @@ def to_image(obj: Image.Image | Path | str | np.ndarray) -> Image.Image:
 
 
 def add_grid(img : Image.Image, grid: Tuple[int,int], color: str = "black",
-             thickness: int | None = None) -> Image.Image:
+             thickness: int | None = None, antialias: bool = False) -> Image.Image:
     """Add a grid to an image with the color and thickness specified.
+    The lines are drawn on whole rows and columns of pixels at once.
 
     Args:
       img: The image to add the grid to.
       grid: The grid size as a tuple of (width, height).
       color: The color of the grid lines (Default value = "black").      
       thickness: int | None: The thickness of the grid lines. If None, it is automatically calculated based on the cell size.
+      antialias: If True, the lines are drawn at their exact (fractional) positions,
+        blending the edge pixels by their coverage. Otherwise they start at whole pixels.
 
     Returns:
       : The image with the grid added.
 
+    """
+    return add_grid_region(img, (0, 0, *img.size), img.size, grid, color, thickness, antialias)
+
+
+def add_grid_region(img: Image.Image, box: Tuple[int, int, int, int], size: Tuple[int, int],
+                    grid: Tuple[int, int], color: str = "black",
+                    thickness: int | None = None, antialias: bool = False) -> Image.Image:
+    """Adds the grid of a larger image to a region of it, as add_grid adds it to the whole image.
+    Only the lines crossing the region are drawn, so the larger image isn't needed.
+
+    Args:
+      img: The region's image.
+      box: The region in the larger image, as (x0, y0, x1, y1).
+      size: The size of the larger image.
+      grid: The grid size as a tuple of (width, height).
+      color: The color of the grid lines (Default value = "black").
+      thickness: The thickness of the grid lines (see add_grid).
+      antialias: Blend the lines' edge pixels by their coverage (see add_grid).
+
+    Returns:
+      : The region's image with the grid added.
+
     """
     grid = np.round(np.array(grid)).astype(int)
     img = img.convert("RGBA")
-    grid = np.array(grid)
-    width, height = img.size
+    width, height = size
     x = np.linspace(0, width, grid[0]+1)
     y = np.linspace(0, height, grid[1]+1)
-    cell_size = (x[1]-x[0], y[1]-y[0])
-    line_thickness = max(1, int(min(cell_size) / 50))
-    for i in range(grid[0]+1):
-        for j in range(grid[1]+1):
-            x0 = int(x[i])
-            y0 = int(y[j])
-            x1 = int(x[i] + cell_size[0])
-            y1 = int(y[j] + cell_size[1])
-            img.paste(color, (x0, y0, x1, y0+line_thickness))
-            img.paste(color, (x0, y0, x0+line_thickness, y1))
+    if thickness is None:
+        cell_size = (x[1]-x[0], y[1]-y[0])
+        thickness = max(1, int(min(cell_size) / 50))
+    # The region, clipped to the image
+    x0, y0, x1, y1 = box
+    left, top, right, bottom = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+    if left >= right or top >= bottom:
+        return img
+    columns = _line_coverage(x, thickness, left, right, antialias)
+    rows = _line_coverage(y, thickness, top, bottom, antialias)
+    # Each band of lines is pasted whole (over the region's height or width), with its coverage as the mask
+    for start, end in _covered_runs(columns):
+        coverage = columns[start:end]
+        mask = None
+        if antialias and np.any(coverage < 1):
+            mask = _coverage_mask(np.broadcast_to(coverage, (bottom - top, end - start)))
+        img.paste(color, (left + start - x0, top - y0, left + end - x0, bottom - y0), mask)
+    for start, end in _covered_runs(rows):
+        coverage = rows[start:end]
+        mask = None
+        if antialias:
+            # Where the rows cross the columns, blend up to the larger of the two coverages
+            covered = columns[None, :]
+            coverage = np.where(covered < 1, (coverage[:, None] - covered) / np.maximum(1 - covered, 1e-6), 0)
+            mask = _coverage_mask(np.clip(coverage, 0, 1))
+        img.paste(color, (left - x0, top + start - y0, right - x0, top + end - y0), mask)
     return img
 
 
+def _line_coverage(lines: np.ndarray, thickness: int, start: int, end: int, antialias: bool) -> np.ndarray:
+    """The coverage (0 to 1) of the pixels start to end (exclusive) along an axis,
+    by lines of the thickness starting at the positions of lines (at whole pixels, without antialias)."""
+    if not antialias:
+        lines = lines.astype(int)
+    lines = lines[(lines + thickness > start) & (lines < end)]
+    # The length covered up to each pixel edge
+    edges = np.arange(start, end + 1, dtype=np.float32)
+    covered = np.clip(edges[:, None] - lines[None, :], 0, thickness).sum(axis=1)
+    return np.clip(np.diff(covered), 0, 1)
+
+
+def _covered_runs(coverage: np.ndarray) -> np.ndarray:
+    """The (start, end) of the runs of covered pixels"""
+    covered = np.concatenate([[False], coverage > 0, [False]])
+    return np.flatnonzero(np.diff(covered)).reshape(-1, 2)
+
+
+def _coverage_mask(coverage: np.ndarray) -> Image.Image:
+    return Image.fromarray(np.round(coverage * 255).astype(np.uint8))
+
+
 def find_background_rembg(image:np.ndarray,
                           provider:str|None=None,
                           post_process_mask:bool=True,
@@ -242,6 +337,7 @@ def find_foreground_rembg(image:np.ndarray, provider:str|None=None,
 
 
 def find_background_crude(image:np.ndarray, bins:int=64, background_colors:int=3) -> np.ndarray:
+    import cv2
     image = np.asarray(image)
     initial_mask = None
     # Convert to grayscale
@@ -311,6 +407,11 @@ def _to_method_and_provider(method:str|None=None):
     else:
         raise ValueError(f"Unsupported method: {method}")
 
+def default_background_method() -> str:
+    """The name of the method find_background uses by default ("rembg" or "crude").
+    Unlike find_background, this does not create a rembg session."""
+    return "rembg" if rembg_installed() else "crude"
+
 def find_background(image:np.ndarray, method:str|None = None, bins:int=64, background_colors:int=3, post_process_mask:bool=True,**kw) -> np.ndarray:
     method, provider = _to_method_and_provider(method)
     if method == "rembg":
@@ -319,6 +420,29 @@ def find_background(image:np.ndarray, method:str|None = None, bins:int=64, backg
         return find_background_crude(image, bins, background_colors)    
     raise RuntimeError(f"Logic error: unsupported method {method}")
 
+def find_background_batch(images:Sequence[np.ndarray], method:str|None = None,
+                          batch_size:int = DEFAULT_BATCH_SIZE, bins:int=64, background_colors:int=3,
+                          post_process_mask:bool=True) -> List[np.ndarray]:
+    """Finds the backgrounds of several images, as find_background does for each.
+    With rembg, the model runs on batches of images.
+
+    Args:
+      images: The images.
+      method: See find_background.
+      batch_size: The number of images per rembg model run.
+
+    Returns:
+      : The background masks, as boolean arrays.
+    """
+    method, provider = _to_method_and_provider(method)
+    if method == "rembg":
+        masks = rembg_remove_batch(images, provider=provider, batch_size=batch_size,
+                                   post_process_mask=post_process_mask)
+        return [np.asarray(mask) == 0 for mask in masks]
+    elif method == "crude":
+        return [find_background_crude(image, bins, background_colors) for image in images]
+    raise RuntimeError(f"Logic error: unsupported method {method}")
+
 def find_foreground(image:np.ndarray, method:str|None = None, bins:int=64, background_colors:int=3, post_process_mask:bool=True,**kw) -> np.ndarray:
     method, provider = _to_method_and_provider(method)
     if method == "rembg":
@@ -336,10 +460,12 @@ def find_foreground_roi(image:np.ndarray, method:str|None = None,  **kw) -> Tupl
     return mask_to_roi(mask)
 
 def mask_to_roi(mask:np.ndarray) -> Tuple[int, int, int, int]:
+    import cv2
     rect = cv2.boundingRect(mask.astype(np.uint8))
     return tuple(rect)
 
 def image_hist(image: np.ndarray, bins: int = 64) -> np.ndarray:
+    import cv2
     hist = cv2.calcHist([image], [0], None, [bins], [0, 256])
     return hist
 
@@ -1,25 +1,168 @@
 import requests
 import mimetypes
+import threading
+import json
+from collections import namedtuple
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 
-def download_file(url: str, file_path: str, allow_rename: bool = False):
+DEFAULT_POOL_SIZE = 8
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 60
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+DownloadResult = namedtuple("DownloadResult", ["path", "not_modified", "etag", "last_modified"])
+DownloadResult.__doc__ = """The result of a download.
+path: The path of the downloaded file, or None if not_modified is True.
+not_modified: True if the server answered the conditional request with 304 (no body was sent).
+etag, last_modified: The validators of the remote file, for later conditional requests."""
+
+def http_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    Get the shared HTTP session used for downloads.
+    The session keeps a connection pool per host, so repeated downloads
+    from the same server reuse their TCP/TLS connections.
+    Parameters:
+    pool_size (int): The minimal number of connections to keep per host.
+                     If the shared session has a smaller pool, it is recreated.
+    """
+    global _session, _session_pool_size
+    with _session_lock:
+        if _session is None or _session_pool_size < pool_size:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if _session is not None:
+                _session.close()
+            _session, _session_pool_size = session, pool_size
+        return _session
+
+def download(url: str, file_path: str, allow_rename: bool = False,
+             session: requests.Session | None = None,
+             etag: str | None = None, last_modified: str | None = None,
+             resume: bool = True, chunk_size: int = CHUNK_SIZE) -> DownloadResult:
+    """
+    Download a file from a URL to a local path, streaming the body straight to disk.
+    The body is written to a ".part" file next to the target, which is renamed
+    to the target once complete. If the download is interrupted, the next call
+    resumes it with a Range request (as long as the remote file did not change).
+    Parameters:
+    url (str): The URL to download the file from.
+    file_path (str): The path to save the file to. If allow_rename is True, the file's suffix
+                        will be changed based on the content type.
+    session (requests.Session): The session to download with. Defaults to the shared session.
+    etag, last_modified (str): Validators of a previously downloaded copy. If given, the request is
+                        conditional, and if the remote file did not change, nothing is downloaded.
+    resume (bool): Resume a previously interrupted download if possible.
+    chunk_size (int): The size of the chunks written to disk.
+    """
+    path = Path(file_path)
+    part = _part_path(path)
+    if session is None:
+        session = http_session()
+    headers = {}
+    offset = 0
+    part_meta = _read_meta(part) if resume and part.exists() else None
+    if part_meta and part_meta.get("url") == url and (part_meta.get("etag") or part_meta.get("last_modified")):
+        offset = part.stat().st_size
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = part_meta.get("etag") or part_meta.get("last_modified")
+    else:
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if offset and response.status_code in (206, 416) and _range_start(response) != offset:
+            # The partial file can't be resumed, start over
+            part.unlink(missing_ok=True)
+            return download(url, file_path, allow_rename, session, etag, last_modified,
+                            resume=False, chunk_size=chunk_size)
+        if response.status_code == 304:
+            return DownloadResult(None, True, etag, last_modified)
+        if response.status_code == 206 and offset:
+            mode = "ab"
+        elif response.status_code == 200:
+            mode = "wb"
+        else:
+            raise requests.HTTPError(f"Failed to download file from {url} - {response.status_code}")
+        new_etag = response.headers.get("ETag")
+        new_last_modified = response.headers.get("Last-Modified")
+        if allow_rename and 'content-type' in response.headers:
+            content_type = response.headers['content-type'].split(";")[0].strip()
+            extension = mimetypes.guess_extension(content_type, strict=False)
+            if extension:
+                path = path.with_suffix(extension)
+        part.parent.mkdir(parents=True, exist_ok=True)
+        # Keep the validators of the partial file, so it can be resumed if interrupted
+        _write_meta(part, url, new_etag, new_last_modified)
+        with open(part, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    part.replace(path)
+    _meta_path(part).unlink(missing_ok=True)
+    return DownloadResult(path, False, new_etag, new_last_modified)
+
+def download_file(url: str, file_path: str, allow_rename: bool = False,
+                  session: requests.Session | None = None, resume: bool = True):
     """
     Download a file from a URL to a local path.
+    If the file was previously downloaded to the same path, a conditional request
+    is made (using the ETag/Last-Modified headers saved alongside the requested path,
+    with the name of the file, which may have been renamed), and the file
+    is only downloaded again if it changed.
     Parameters:
     url (str): The URL to download the file from.
     file_path (str): The path to save the file to. If allow_rename is True, the file's suffix
                         will be changed based on the content type.
+    session (requests.Session): The session to download with. Defaults to the shared session.
+    resume (bool): Resume a previously interrupted download if possible.
     """
     path = Path(file_path)
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise requests.HTTPError(f"Failed to download file from {url} - {response.status_code}")
-    if allow_rename:
-        content_type = response.headers['content-type']
-        extension = mimetypes.guess_extension(content_type, strict=False)
-        if extension:
-            path = path.with_suffix(extension)
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, 'wb') as f:
-        f.write(response.content)
-    return path
\ No newline at end of file
+    meta = _read_meta(path)
+    # The file of the previous download (renamed, if allowed)
+    previous = path.with_name(meta["file"]) if meta and meta.get("file") else path
+    if meta is None or meta.get("url") != url or not previous.exists():
+        meta = {}
+    result = download(url, path, allow_rename, session,
+                      etag=meta.get("etag"), last_modified=meta.get("last_modified"),
+                      resume=resume)
+    if result.not_modified:
+        return previous
+    # Kept under the requested path, so the next call finds it even if the file was renamed
+    _write_meta(path, url, result.etag, result.last_modified, file=result.path.name)
+    return result.path
+
+def _part_path(path: Path) -> Path:
+    return path.with_name(path.name + ".part")
+
+def _meta_path(path: Path) -> Path:
+    return path.with_name(path.name + ".meta.json")
+
+def _read_meta(path: Path) -> dict | None:
+    try:
+        return json.loads(_meta_path(path).read_text())
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(path: Path, url: str, etag: str | None, last_modified: str | None, file: str | None = None):
+    if not etag and not last_modified:
+        _meta_path(path).unlink(missing_ok=True)
+        return
+    meta = {"url": url, "etag": etag, "last_modified": last_modified}
+    if file is not None:
+        meta["file"] = file
+    _meta_path(path).write_text(json.dumps(meta))
+
+def _range_start(response: requests.Response) -> int | None:
+    """ Parses the start of a "Content-Range: bytes start-end/total" header """
+    content_range = response.headers.get("Content-Range", "")
+    try:
+        return int(content_range.split()[1].split("-")[0])
+    except (IndexError, ValueError):
+        return None
@@ -1,14 +1,35 @@
 from functools import lru_cache
+from importlib.util import find_spec
+from typing import List, Sequence
+import numpy as np
+from PIL import Image
 
-try:
-    import rembg
-    import onnxruntime as ort
-except ImportError:
-    rembg = None
-    ort = None
+DEFAULT_BATCH_SIZE = 8
+# (mean, std, input size) of the models whose sessions predict by normalizing the image,
+# running the model and min-max scaling its first output. These can be run in batches.
+_BATCH_NORMALIZATION = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "bria-rmbg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (1024, 1024)),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+@lru_cache
+def _modules():
+    """ The rembg and onnxruntime modules, or None if they are not installed.
+        They are imported on first use, as importing rembg takes over a second. """
+    try:
+        import rembg
+        import onnxruntime as ort
+    except ImportError:
+        return None
+    return rembg, ort
 
 @lru_cache
 def onnx_provider_names() -> dict:
+    ort = _modules()[1]
     def find_provider(p):
         for provider in ort.get_available_providers():
             if p.lower() in provider.lower():
@@ -18,6 +39,10 @@ def onnx_provider_names() -> dict:
     res = {k: v for k, v in res.items() if v is not None}
     return res
 
+def rembg_installed() -> bool:
+    """ Check if the rembg package is installed, without creating a session """
+    return find_spec("rembg") is not None and find_spec("onnxruntime") is not None
+
 @lru_cache
 def can_use_rembg(provider=None) -> bool:
     """ Check if the rembg package can be used with the specified provider
@@ -36,12 +61,12 @@ def _get_onnx_session(rawname: str):
         The cache is per provider """
     global _rembg_sessions
     _init__rembg_sessions()
-    if not rembg:
+    if _modules() is None:
         return None
     if rawname in _rembg_sessions:
         return _rembg_sessions[rawname]
     try:
-        session = rembg.new_session(providers=[rawname])
+        session = _modules()[0].new_session(providers=[rawname])
         _rembg_sessions[rawname] = session
         return session
     except Exception:
@@ -50,6 +75,8 @@ def _get_onnx_session(rawname: str):
 
 @lru_cache
 def get_session(provider:str|None = None):
+    if _modules() is None:
+        return None
     names = onnx_provider_names()
     providers = []
     if provider is not None:
@@ -69,13 +96,70 @@ def get_session(provider:str|None = None):
         
 
 
-def rembg_remove(*args, provider:str|None=None, **kw):
-    if ort is not None:
-        ort.set_default_logger_severity(4)
-    if not rembg:
+def _checked_session(provider:str|None = None):
+    modules = _modules()
+    if modules is None:
         raise ImportError("The rembg package is not installed")
+    modules[1].set_default_logger_severity(4)
     if not can_use_rembg(provider):
         raise RuntimeError(f"Could not create a rembg session with provider {provider}")
-    return rembg.remove(*args, session=get_session(provider), **kw)
+    return get_session(provider)
+
+def rembg_remove(*args, provider:str|None=None, **kw):
+    """ rembg.remove, with the cached session of the provider (see can_use_rembg) """
+    session = _checked_session(provider)
+    return _modules()[0].remove(*args, session=session, **kw)
+
+
+def rembg_remove_batch(images: Sequence[np.ndarray | Image.Image], provider:str|None=None,
+                       batch_size:int = DEFAULT_BATCH_SIZE,
+                       post_process_mask:bool = True) -> List[Image.Image]:
+    """ Computes the foreground masks of several images, like rembg_remove(only_mask=True),
+        but running the model on stacked batches of images.
+        Models that can't be batched fall back to one call per image.
+
+    Args:
+      images: The images.
+      provider: The provider shorthand (see can_use_rembg).
+      batch_size: The number of images per model run.
+      post_process_mask: Smooth the masks' boundaries (as in rembg).
+
+    Returns:
+      : The masks, as "L" images of the same size as the images.
+    """
+    session = _checked_session(provider)
+    images = [image if isinstance(image, Image.Image) else Image.fromarray(image) for image in images]
+    params = _BATCH_NORMALIZATION.get(getattr(session, "model_name", None))
+    if params is None or batch_size <= 1:
+        return [_modules()[0].remove(image, session=session, only_mask=True, post_process_mask=post_process_mask)
+                for image in images]
+    mean, std, size = params
+    model_input = session.inner_session.get_inputs()[0]
+    if isinstance(model_input.shape[0], int):
+        # Exported with a fixed batch size
+        batch_size = model_input.shape[0]
+    masks = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        feed = np.stack([_normalize(image, mean, std, size) for image in batch])
+        preds = session.inner_session.run(None, {model_input.name: feed})[0][:, 0]
+        masks.extend(_to_mask(pred, image.size, post_process_mask) for pred, image in zip(preds, batch))
+    return masks
+
+def _normalize(image: Image.Image, mean, std, size) -> np.ndarray:
+    """ The model input of a single image, as in rembg's BaseSession.normalize """
+    arr = np.array(image.convert("RGB").resize(size, Image.Resampling.LANCZOS))
+    arr = arr / max(np.max(arr), 1e-6)
+    arr = (arr - np.array(mean)) / np.array(std)
+    return arr.transpose((2, 0, 1)).astype(np.float32)
 
-rembg_remove.__doc__ = rembg.remove.__doc__
\ No newline at end of file
+def _to_mask(pred: np.ndarray, size, post_process_mask:bool) -> Image.Image:
+    """ A model output to a mask, as in rembg's sessions (min-max scaled per image) """
+    ma, mi = np.max(pred), np.min(pred)
+    pred = (pred - mi) / (ma - mi)
+    mask = Image.fromarray((pred.clip(0, 1) * 255).astype("uint8"), mode="L")
+    mask = mask.resize(size, Image.Resampling.LANCZOS)
+    if post_process_mask:
+        from rembg.bg import post_process
+        mask = Image.fromarray(post_process(np.array(mask)))
+    return mask
\ No newline at end of file
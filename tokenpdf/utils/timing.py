@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+
+
+class StageTimer:
+    """Records the wall time of named stages of a run, and their nested sub-stages.
+    Stage totals are kept by path (e.g. "layout/candidate"), summed over repeats.
+    Optionally records trace events (for a trace viewer), the peak traced memory
+    of each stage (with tracemalloc) and the image bytes decoded in each stage.
+
+    Example:
+    >>> timer = StageTimer()
+    >>> with timer.stage("layout"):
+    ...     pages = layout.arrange(sizes, page_sizes)
+    >>> timer.stages
+    {'layout': 0.12}
+    """
+    def __init__(self, events: List[Dict[str, Any]] | None = None, memory: bool = False,
+                 counters: Callable[[], Dict[str, int]] | None = None):
+        """
+        Args:
+            events: A list to append trace events to (None to not record events).
+            memory: Record the peak traced memory of each stage (while the timer is active).
+            counters: A function returning counters (e.g. decoded image bytes),
+                      whose increments during each stage are recorded.
+        """
+        self.stages: Dict[str, float] = {}
+        self.peak_memory: Dict[str, int] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.events = events
+        self.memory = memory
+        self._read_counters = counters
+        self._local = threading.local()
+
+    @property
+    def _stack(self) -> List[Dict[str, Any]]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name: str, **args):
+        """Times the context as the stage name, nested in the current stage (if any).
+
+        Args:
+            name: The name of the stage.
+            **args: Arguments of this stage's trace event (e.g. the page index).
+        """
+        stack = self._stack
+        path = f"{stack[-1]['path']}/{name}" if stack else name
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            if stack:
+                # The parent's peak so far, before resetting it for this stage
+                stack[-1]["peak"] = max(stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {"path": path, "peak": 0,
+                 "counters": self._read_counters() if self._read_counters else None}
+        stack.append(frame)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start
+            stack.pop()
+            self.stages[path] = self.stages.get(path, 0) + duration
+            args = dict(args)
+            if memory:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                self.peak_memory[path] = max(self.peak_memory.get(path, 0), peak)
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+                args["peak_memory"] = peak
+            if frame["counters"] is not None:
+                increments = {k: v - frame["counters"].get(k, 0) for k, v in self._read_counters().items()}
+                totals = self.counters.setdefault(path, {})
+                for k, v in increments.items():
+                    totals[k] = totals.get(k, 0) + v
+                args.update(increments)
+            if self.events is not None:
+                self.events.append({"name": name, "cat": path.split("/")[0], "ph": "X",
+                                    "ts": (start - _ORIGIN) * 1e6, "dur": duration * 1e6,
+                                    "pid": os.getpid(), "tid": threading.get_ident(), "args": args})
+
+    @contextmanager
+    def activate(self):
+        """Makes this timer the target of the module-level stage() in the context,
+        and traces memory allocations if memory is recorded."""
+        global _active_timer
+        previous, _active_timer = _active_timer, self
+        start_tracing = self.memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+        try:
+            yield self
+        finally:
+            if start_tracing:
+                tracemalloc.stop()
+            _active_timer = previous
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """The totals of each stage: time, and peak memory and counters if recorded."""
+        return {path: {"time": time,
+                       **({"peak_memory": self.peak_memory[path]} if path in self.peak_memory else {}),
+                       **self.counters.get(path, {})}
+                for path, time in self.stages.items()}
+
+
+_active_timer: StageTimer | None = None
+# Trace event times are relative to the import, so the events of all timers share a timeline
+_ORIGIN = perf_counter()
+
+
+def stage(name: str, **args):
+    """Times the context as a (sub-)stage of the active timer (see StageTimer.activate).
+    Does nothing when no timer is active, so code can be instrumented unconditionally.
+
+    Example:
+    >>> for i, page in enumerate(pages):
+    ...     with stage("page", page=i):
+    ...         page.save()
+    """
+    if _active_timer is None:
+        return nullcontext()
+    return _active_timer.stage(name, **args)
+
+
+def trace_origin() -> float:
+    """The perf_counter time the trace events of this process are relative to."""
+    return _ORIGIN
+
+
+def rebase_events(events: List[Dict[str, Any]], origin: float) -> List[Dict[str, Any]]:
+    """Makes trace events recorded in this process relative to another origin
+    (e.g. the trace_origin of a parent process), so the events of several processes share a timeline.
+    perf_counter is a system-wide monotonic clock, so its times are comparable between processes.
+
+    Args:
+        events: The trace events (see StageTimer), modified in place.
+        origin: The perf_counter time to make the events relative to.
+
+    Returns:
+        : The events.
+    """
+    shift = (_ORIGIN - origin) * 1e6
+    for event in events:
+        event["ts"] += shift
+    return events
+
+
+def save_trace(path: str | Path, events: List[Dict[str, Any]], summary: Any = None):
+    """Writes trace events as a Trace Event Format JSON file,
+    which can be loaded in chrome://tracing or Perfetto.
+
+    Args:
+        path: The output file path.
+        events: The trace events (see StageTimer).
+        summary: Extra data to include (e.g. the stage totals).
+    """
+    trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+    if summary is not None:
+        trace["otherData"] = summary
+    Path(path).write_text(json.dumps(trace, indent=1))